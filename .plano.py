@@ -27,6 +27,80 @@ from skewer import *
 def test(passthrough_args=[]):
     PlanoTestCommand(skewer.tests).main(args=passthrough_args)
 
+@command
+def farm(*example_dirs, jobs=4):
+    """
+    Test multiple example directories concurrently on Minikube
+
+    Each example gets its own Minikube profile, work dir, and tunnel.
+    At most JOBS examples run at once.
+    """
+    run_farm(example_dirs, jobs=jobs)
+
+@command(parameters=[CommandParameter("jobs", type=int,
+                                     help="The number of worker processes (default: the number of CPUs)")])
+def generate_all(dir=".", jobs=None):
+    """
+    Generate the README.md files for all the examples under DIR
+
+    Directories named 'external' are skipped.
+    """
+    generate_readmes(dir, jobs=jobs)
+
+@command
+def benchmark(steps=500, iterations=5):
+    """
+    Time model validation and readme generation for a large skewer file
+
+    The skewer file is the example file with its steps repeated until
+    there are at least STEPS steps.
+    """
+    from skewer.main import Model, generate_readme_content
+
+    data = read_yaml("example/skewer.yaml")
+    example_steps = data["steps"]
+    data["steps"] = [dict(example_steps[i % len(example_steps)]) for i in range(steps)]
+
+    for i, step in enumerate(data["steps"]):
+        if "title" in step:
+            step["title"] = f"{step['title']} {i}"
+
+    with working_dir():
+        write_yaml("skewer.yaml", data)
+
+        def time_it(label, function):
+            times = list()
+
+            for _ in range(iterations):
+                start_time = get_time()
+                function()
+                times.append(get_time() - start_time)
+
+            print(f"{label:<12} {min(times) * 1000:8.1f} ms (best of {iterations})")
+
+        with logging_disabled():
+            model = Model("skewer.yaml")
+
+            time_it("load", lambda: Model("skewer.yaml"))
+            time_it("check", model.check)
+            time_it("generate", lambda: generate_readme_content(model, None))
+
+@command
+def benchmark_startup(iterations=10):
+    """
+    Time the startup of the example's './plano' commands
+    """
+    with working_dir("example"):
+        for command in ("./plano --help", "./plano generate"):
+            times = list()
+
+            for _ in range(iterations):
+                start_time = get_time()
+                run(command, stdout=DEVNULL, stderr=DEVNULL, quiet=True)
+                times.append(get_time() - start_time)
+
+            print(f"{command:<20} {min(times) * 1000:8.1f} ms (best of {iterations})")
+
 @command
 def coverage(verbose=False, quiet=False):
     check_program("coverage")
@@ -41,14 +115,14 @@ def coverage(verbose=False, quiet=False):
         print(f"file:{get_current_dir()}/htmlcov/index.html")
 
 @command
-def render(verbose=False, quiet=False):
+def render(github_api=False, verbose=False, quiet=False):
     """
     Render README.html from README.md
-    """
-    markdown = read("README.md")
-    html = convert_github_markdown(markdown)
 
-    write("README.html", html)
+    By default, the Markdown is rendered locally.  Use --github-api
+    to render it using the GitHub Markdown API.
+    """
+    render_readme("README.md", "README.html", github_api=github_api)
 
     if not quiet:
         print(f"file:{get_real_path('README.html')}")
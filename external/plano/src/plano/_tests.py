@@ -354,30 +354,62 @@ def github_operations():
 @test
 def http_operations():
     class Handler(_http.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        connections = 0
+
+        def setup(self):
+            super().setup()
+            Handler.connections += 1
+
+        def send(self, status, content=b"", headers={}):
+            self.send_response(status)
+
+            for name, value in headers.items():
+                self.send_header(name, value)
+
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
         def do_GET(self):
+            if self.path == "/redirect":
+                self.send(302, headers={"Location": "/api"})
+                return
+
+            if self.path == "/redirect-auth":
+                self.send(302, headers={"Location": "/auth"})
+                return
+
+            # The same server under another host name
+            if self.path == "/redirect-other-host":
+                self.send(302, headers={"Location": f"http://127.0.0.1:{port}/auth"})
+                return
+
+            if self.path == "/auth":
+                if self.headers["authorization"] != "Basic " + base64_encode(b"fritz:secret").decode():
+                    self.send(401)
+                    return
+
+                self.send(200, b"[1]")
+                return
+
             if not self.path.startswith("/api"):
-                self.send_response(404)
-                self.end_headers()
+                self.send(404)
                 return
 
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b"[1]")
+            self.send(200, b"[1]")
 
         def do_POST(self):
             length = int(self.headers["content-length"])
             content = self.rfile.read(length)
 
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(content)
+            self.send(200, content)
 
         def do_PUT(self):
             length = int(self.headers["content-length"])
             content = self.rfile.read(length)
 
-            self.send_response(200)
-            self.end_headers()
+            self.send(200)
 
     class ServerThread(_threading.Thread):
         def __init__(self, server):
@@ -392,11 +424,11 @@ def http_operations():
     missing_url = "http://{}:{}/nono".format(host, port)
 
     try:
-        server = _http.HTTPServer((host, port), Handler)
+        server = _http.ThreadingHTTPServer((host, port), Handler)
     except (OSError, PermissionError): # pragma: nocover
         # Try one more time
         port = get_random_port()
-        server = _http.HTTPServer((host, port), Handler)
+        server = _http.ThreadingHTTPServer((host, port), Handler)
 
     server_thread = ServerThread(server)
     server_thread.start()
@@ -449,6 +481,39 @@ def http_operations():
 
             result = http_put_json(url, parse_json(read(file_c)))
             assert result is None, result
+
+            connections = Handler.connections
+
+            for i in range(10):
+                result = http_get(url)
+                assert result == "[1]", result
+
+            assert Handler.connections == connections, (Handler.connections, connections)
+
+            result = http_get(url.replace("/api", "/redirect"))
+            assert result == "[1]", result
+
+            result = http_get(url.replace("/api", "/auth"), user="fritz", password="secret")
+            assert result == "[1]", result
+
+            with expect_error():
+                http_get(url.replace("/api", "/auth"), user="fritz", password="wrong")
+
+            result = http_get(url.replace("/api", "/redirect-auth"), user="fritz", password="secret")
+            assert result == "[1]", result
+
+            with expect_error(contains="401"):
+                http_get(url.replace("/api", "/redirect-other-host"), user="fritz", password="secret")
+
+            with working_env(PLANO_HTTP_CURL=1):
+                result = http_get(url)
+                assert result == "[1]", result
+
+                result = http_post(url, "[2]")
+                assert result == "[2]", result
+
+                with expect_error():
+                    http_get(missing_url)
     finally:
         server.shutdown()
         server.server_close()
@@ -600,6 +665,29 @@ def logging_operations():
         with logging_context("boop"):
             error("It's alarming!")
 
+    def log_in_thread(name):
+        with logging_context(name):
+            notice("In thread")
+
+    with temp_file() as out:
+        with logging_enabled(output=out):
+            with logging_context("main"):
+                threads = [_threading.Thread(target=log_in_thread, args=(x,)) for x in ("t1", "t2")]
+
+                for thread in threads:
+                    thread.start()
+
+                for thread in threads:
+                    thread.join()
+
+                notice("In main")
+
+        lines = read_lines(out)
+
+        assert any("t1: In thread" in x and "main:" not in x for x in lines), lines
+        assert any("t2: In thread" in x and "t1:" not in x for x in lines), lines
+        assert any("main: In main" in x and "t1:" not in x and "t2:" not in x for x in lines), lines
+
 @test
 def path_operations():
     abspath = _os.path.abspath
@@ -752,6 +840,107 @@ def port_operations():
         with expect_timeout():
             await_port(get_random_port(), timeout=TINY_INTERVAL)
 
+    errors = list()
+
+    def await_in_thread():
+        try:
+            await_port(get_random_port(), timeout=TINY_INTERVAL)
+        except PlanoTimeout as e:
+            errors.append(e)
+
+    thread = _threading.Thread(target=await_in_thread)
+    thread.start()
+    thread.join()
+
+    assert len(errors) == 1, errors
+
+@test
+async def aio_operations():
+    import asyncio
+
+    from . import aio
+
+    proc = await aio.run("date")
+    assert proc.exit_code == 0, proc.exit_code
+
+    print(repr(proc))
+
+    await aio.run("date", stash=True)
+    await aio.run(["echo", 1, 2, 3], shell=True)
+    await aio.run("date", output=DEVNULL)
+
+    proc = await aio.run("cat /uh/uh", check=False)
+    assert proc.exit_code > 0, proc.exit_code
+
+    with expect_error():
+        await aio.run("/not/there")
+
+    with expect_error():
+        await aio.run("cat /whoa/not/really", stash=True)
+
+    with expect_exception(PlanoProcessError):
+        await aio.call("cat /whoa/not/really")
+
+    result = (await aio.call("echo hello")).strip()
+    assert result == "hello", result
+
+    result = await aio.call("cat", input="abc")
+    assert result == "abc", result
+
+    result = (await aio.call("echo $PLANO_TEST_VAR", shell=True, env={"PLANO_TEST_VAR": 1})).strip()
+    assert result == "1", result
+
+    with expect_output(equals="hello\n") as out:
+        await aio.run("echo hello", output=out)
+
+    proc = await aio.start("sleep 10")
+
+    with expect_timeout():
+        await aio.wait(proc, timeout=TINY_INTERVAL)
+
+    await aio.stop(proc)
+    await aio.stop(proc)
+
+    async with await aio.start("sleep 10") as proc:
+        pass
+
+    assert proc.exit_code == -_signal.SIGTERM, proc.exit_code
+
+    with Timer() as timer:
+        await asyncio.gather(*[aio.sleep(0.2, quiet=True) for i in range(200)])
+        await asyncio.gather(*[aio.run("sleep 0.2", quiet=True) for i in range(20)])
+
+    assert timer.elapsed_time < 2, timer.elapsed_time
+
+    # Processes that have exited are no longer tracked
+    from .main import _child_processes
+    assert not any(isinstance(x, aio.AsyncPlanoProcess) for x in _child_processes), _child_processes
+
+    server_port = get_random_port()
+    server_socket = _socket.socket(_socket.AF_INET, _socket.SOCK_STREAM)
+
+    try:
+        server_socket.bind(("localhost", server_port))
+        server_socket.listen(20)
+
+        await asyncio.gather(*[aio.await_port(server_port, quiet=True) for i in range(10)])
+        await aio.await_port(str(server_port))
+    finally:
+        server_socket.close()
+
+    with expect_timeout():
+        await aio.await_port(get_random_port(), timeout=TINY_INTERVAL)
+
+    with working_dir():
+        async def touch_later():
+            await aio.sleep(TINY_INTERVAL)
+            touch("afile")
+
+        await asyncio.gather(aio.await_exists("afile"), touch_later())
+
+        with expect_timeout():
+            await aio.await_exists("notafile", timeout=TINY_INTERVAL)
+
 @test
 def process_operations():
     result = get_process_id()
@@ -760,6 +949,9 @@ def process_operations():
     proc = run("date")
     assert proc is not None, proc
 
+    from .main import _child_processes
+    assert proc not in _child_processes
+
     print(repr(proc))
 
     run("date", stash=True)
@@ -799,6 +991,13 @@ def process_operations():
     expect = "hello"
     assert result == expect, (result, expect)
 
+    result = call("sh -c 'echo $PLANO_TEST_VAR'", env={"PLANO_TEST_VAR": 1}).strip()
+    assert result == "1", result
+    assert "PLANO_TEST_VAR" not in ENV
+
+    result = call("echo $PLANO_TEST_VAR $HOME", shell=True, env={"PLANO_TEST_VAR": "a"}).strip()
+    assert result == "a {}".format(ENV["HOME"]), result
+
     with expect_error():
         call("cat /whoa/not/really")
 
@@ -1037,6 +1236,80 @@ def test_operations():
             with expect_system_exit():
                 run_command("--enable", "*badbye*", "--verbose")
 
+            for verbose in (False, True):
+                run_tests(chucker.tests, jobs=3, verbose=verbose)
+                run_tests(chucker.tests, enable="skipped", jobs=3, verbose=verbose)
+
+                with expect_error():
+                    run_tests([chucker.tests, chucker.moretests], enable="*badbye2*", fail_fast=True, jobs=3,
+                              verbose=verbose)
+
+                with expect_exception(KeyboardInterrupt):
+                    run_tests(chucker.tests, enable="keyboard-interrupt", jobs=3, verbose=verbose)
+
+                with expect_error():
+                    run_tests(chucker.tests, enable="timeout", jobs=3, verbose=verbose)
+
+                with expect_error():
+                    run_tests(chucker.tests, enable="system-exit", jobs=3, verbose=verbose)
+
+            with expect_error():
+                run_tests(chucker.tests, jobs=0)
+
+            with temp_file() as output_file:
+                with output_redirected(output_file, quiet=True):
+                    run_tests([chucker.tests, chucker.moretests], jobs=4)
+
+                output = read(output_file)
+                names = [x[:x.index(" .")] for x in output.splitlines() if " PASSED " in x]
+
+                assert names == [x.name for x in chucker.tests._plano_tests + chucker.moretests._plano_tests
+                                 if not x.disabled], names
+
+            run_command("--jobs", "2")
+
+            all_names = [x.name for x in chucker.tests._plano_tests if not x.disabled]
+
+            def run_shard(shard, timings_file=None):
+                with temp_file() as output_file:
+                    with output_redirected(output_file, quiet=True):
+                        run_tests(chucker.tests, shard=shard, timings_file=timings_file)
+
+                    return [x[:x.index(" .")] for x in read(output_file).splitlines() if " PASSED " in x]
+
+            shards = [run_shard(f"{i}/3") for i in (1, 2, 3)]
+
+            assert shards[0] == all_names[0::3], shards
+            assert sorted(sum(shards, [])) == sorted(all_names), shards
+
+            with working_dir():
+                timings = {"chucker.tests:hello": 10, "chucker.tests:goodbye": 6, "chucker.tests:message-hi": 5}
+
+                write_json("timings-1.json", timings)
+                write_json("timings-2.json", timings)
+
+                shards = [run_shard((i, 2), f"timings-{i}.json") for i in (1, 2)]
+
+                # Unrecorded tests count as the mean, 7 seconds
+                assert shards == [["hello", "message-hi", "message-in between"],
+                                  ["hello-async", "goodbye", "message-lo"]], shards
+
+                timings = read_json("timings-1.json")
+
+                assert set(timings) == {f"chucker.tests:{x}" for x in shards[0]} | {"chucker.tests:goodbye"}, timings
+                assert timings["chucker.tests:hello"] < 10, timings
+                assert timings["chucker.tests:goodbye"] == 6, timings
+
+            assert run_shard("3/3") != []
+
+            with expect_error():
+                run_tests(chucker.tests, shard="4/3")
+
+            with expect_error():
+                run_tests(chucker.tests, shard="a/b")
+
+            run_command("--shard", "2/2")
+
     try:
         with expect_exception():
             pass
@@ -0,0 +1,312 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+# Coroutine versions of the process, port, path, and sleep operations
+# in plano.main.  They have the same names and arguments, so use the
+# module by name:
+#
+#   from plano import aio
+#
+#   await aio.run("make")
+#   await asyncio.gather(aio.await_port(8080), aio.await_port(8081))
+
+import asyncio as _asyncio
+import os as _os
+import shlex as _shlex
+import signal as _signal
+import subprocess as _subprocess
+import sys as _sys
+
+from .main import PlanoError, PlanoProcessError, PlanoTimeout
+from .main import debug, eprint, error, exists, expand, get_time, is_string, make_temp_file, plural, read, remove
+from .main import WINDOWS, _child_processes, _format_command, _notice, _remove_child_process
+
+class AsyncPlanoProcess:
+    def __init__(self, proc, args, stash_file=None):
+        self.proc = proc
+        self.args = args
+        self.stash_file = stash_file
+        self.stdout_result = None
+        self.stderr_result = None
+
+        _child_processes.append(self)
+
+    @property
+    def pid(self):
+        return self.proc.pid
+
+    @property
+    def exit_code(self):
+        return self.proc.returncode
+
+    @property
+    def stdin(self):
+        return self.proc.stdin
+
+    @property
+    def stdout(self):
+        return self.proc.stdout
+
+    @property
+    def stderr(self):
+        return self.proc.stderr
+
+    def poll(self):
+        return self.proc.returncode
+
+    def terminate(self):
+        if self.proc.returncode is None:
+            try:
+                self.proc.terminate()
+            except ProcessLookupError: # pragma: nocover
+                pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await stop(self)
+
+    def __repr__(self):
+        return "process {} (command {})".format(self.pid, _format_command(self.args))
+
+# quiet=False - Don't log at notice level
+# stash=False - No output unless there is an error
+# output=<file> - Send stdout and stderr to a file
+# stdin=<file> - Read stdin from a file
+# stdout=<file> - Send stdout to a file
+# stderr=<file> - Send stderr to a file
+# shell=False - Run the command using the shell
+# env=<dict> - Set these environment variables for the process only
+async def start(command, stdin=None, stdout=None, stderr=None, output=None, shell=False, env=None, stash=False,
+                quiet=False):
+    _notice(quiet, "Starting a new process (command {})", _format_command(command))
+
+    if output is not None:
+        stdout, stderr = output, output
+
+    if is_string(stdin):
+        stdin = open(expand(stdin), "r")
+
+    if is_string(stdout):
+        stdout = open(expand(stdout), "w")
+
+    if is_string(stderr):
+        stderr = open(expand(stderr), "w")
+
+    if stdin is None:
+        stdin = _sys.stdin
+
+    if stdout is None:
+        stdout = _sys.stdout
+
+    if stderr is None:
+        stderr = _sys.stderr
+
+    stash_file = None
+
+    if stash:
+        stash_file = make_temp_file()
+        out = open(stash_file, "w")
+        stdout = out
+        stderr = out
+
+    if env is not None:
+        env = dict(_os.environ, **{k: str(v) for k, v in env.items()})
+
+    try:
+        if shell:
+            if is_string(command):
+                args = command
+            else:
+                args = " ".join(map(str, command))
+
+            proc = await _asyncio.create_subprocess_shell(args, stdin=stdin, stdout=stdout, stderr=stderr, env=env)
+        else:
+            if is_string(command):
+                args = _shlex.split(command)
+            else:
+                args = command
+
+            args = [expand(str(x)) for x in args]
+
+            proc = await _asyncio.create_subprocess_exec(*args, stdin=stdin, stdout=stdout, stderr=stderr, env=env)
+    except OSError as e:
+        raise PlanoError("Command {}: {}".format(_format_command(command), str(e)))
+
+    proc = AsyncPlanoProcess(proc, args, stash_file=stash_file)
+
+    _notice(quiet, "{} started", proc)
+
+    return proc
+
+async def stop(proc, timeout=None, quiet=False):
+    _notice(quiet, "Stopping {}", proc)
+
+    if proc.poll() is not None:
+        if proc.exit_code == 0:
+            debug("{} already exited normally", proc)
+        elif proc.exit_code == -(_signal.SIGTERM):
+            debug("{} was already terminated", proc)
+        else:
+            debug("{} already exited with code {}", proc, proc.exit_code)
+
+        return proc
+
+    kill(proc, quiet=True)
+
+    return await wait(proc, timeout=timeout, quiet=True)
+
+def kill(proc, quiet=False):
+    _notice(quiet, "Killing {}", proc)
+
+    proc.terminate()
+
+async def wait(proc, timeout=None, check=False, quiet=False):
+    _notice(quiet, "Waiting for {} to exit", proc)
+
+    try:
+        await _asyncio.wait_for(proc.proc.wait(), timeout)
+    except _asyncio.TimeoutError:
+        error("{} timed out after {} seconds", proc, timeout)
+        raise PlanoTimeout()
+
+    return _check_exit(proc, check)
+
+def _check_exit(proc, check):
+    _remove_child_process(proc)
+
+    if proc.exit_code == 0:
+        debug("{} exited normally", proc)
+    elif proc.exit_code < 0:
+        debug("{} was terminated by signal {}", proc, abs(proc.exit_code))
+    else:
+        if check:
+            error("{} exited with code {}", proc, proc.exit_code)
+        else:
+            debug("{} exited with code {}", proc, proc.exit_code)
+
+    if proc.stash_file is not None:
+        if proc.exit_code > 0:
+            eprint(read(proc.stash_file), end="")
+
+        if not WINDOWS:
+            remove(proc.stash_file, quiet=True)
+
+    if check and proc.exit_code > 0:
+        raise PlanoProcessError(proc)
+
+    return proc
+
+# input=<string> - Pipe <string> to the process
+async def run(command, stdin=None, stdout=None, stderr=None, input=None, output=None,
+              stash=False, shell=False, env=None, check=True, quiet=False):
+    _notice(quiet, "Running command {}", _format_command(command))
+
+    if input is not None:
+        assert stdin in (None, _subprocess.PIPE), stdin
+
+        input = input.encode("utf-8")
+        stdin = _subprocess.PIPE
+
+    proc = await start(command, stdin=stdin, stdout=stdout, stderr=stderr, output=output,
+                       stash=stash, shell=shell, env=env, quiet=True)
+
+    stdout_result, stderr_result = await proc.proc.communicate(input=input)
+
+    if stdout_result is not None:
+        proc.stdout_result = stdout_result.decode("utf-8")
+
+    if stderr_result is not None:
+        proc.stderr_result = stderr_result.decode("utf-8")
+
+    return await wait(proc, check=check, quiet=True)
+
+# input=<string> - Pipe the given input into the process
+async def call(command, input=None, shell=False, env=None, quiet=False):
+    _notice(quiet, "Calling {}", _format_command(command))
+
+    proc = await run(command, stdin=_subprocess.PIPE, stdout=_subprocess.PIPE, stderr=_subprocess.PIPE,
+                     input=input, shell=shell, env=env, check=True, quiet=True)
+
+    return proc.stdout_result
+
+async def sleep(seconds, quiet=False):
+    _notice(quiet, "Sleeping for {} {}", seconds, plural("second", seconds))
+
+    await _asyncio.sleep(seconds)
+
+async def check_port(port, host="localhost", timeout=None):
+    try:
+        _, writer = await _asyncio.wait_for(_asyncio.open_connection(host, port), timeout)
+    except (OSError, _asyncio.TimeoutError):
+        raise PlanoError("Port {} (host {}) is not reachable".format(repr(port), repr(host)))
+
+    writer.close()
+
+    try:
+        await writer.wait_closed()
+    except OSError: # pragma: nocover
+        pass
+
+async def await_port(port, host="localhost", timeout=30, quiet=False):
+    _notice(quiet, "Waiting for port {}", port)
+
+    if is_string(port):
+        port = int(port)
+
+    deadline = None if timeout is None else get_time() + timeout
+
+    # Each attempt gets the time remaining, so a connection attempt
+    # that hangs cannot outlast the timeout
+    async def is_open():
+        try:
+            await check_port(port, host=host, timeout=None if deadline is None else max(0, deadline - get_time()))
+        except PlanoError:
+            return False
+
+        return True
+
+    await _await_condition(is_open, timeout, "Timed out waiting for port {} to open".format(port))
+
+async def await_exists(path, timeout=30, quiet=False):
+    path = expand(path)
+
+    _notice(quiet, "Waiting for path {} to exist", repr(path))
+
+    async def path_exists():
+        return exists(path)
+
+    await _await_condition(path_exists, timeout, "Timed out waiting for path {} to exist".format(path))
+
+async def _await_condition(condition, timeout, timeout_message):
+    deadline = None if timeout is None else get_time() + timeout
+    period = 0.03125
+
+    while not await condition():
+        if deadline is not None:
+            remaining = deadline - get_time()
+
+            if remaining <= 0:
+                raise PlanoTimeout(timeout_message)
+
+            period = min(period, remaining)
+
+        await _asyncio.sleep(period)
+        period = min(1, period * 2)
@@ -21,6 +21,7 @@ from .main import *
 
 import argparse as _argparse
 import importlib as _importlib
+import importlib.util as _importlib_util
 import inspect as _inspect
 import os as _os
 import sys as _sys
@@ -212,8 +213,8 @@ class PlanoCommand(BaseCommand):
 
         _sys.path.insert(0, join(get_parent_dir(path), "python"))
 
-        spec = _importlib.util.spec_from_file_location("_plano", path)
-        module = _importlib.util.module_from_spec(spec)
+        spec = _importlib_util.spec_from_file_location("_plano", path)
+        module = _importlib_util.module_from_spec(spec)
         _sys.modules["_plano"] = module
 
         try:
@@ -58,6 +58,9 @@ def convert_github_markdown(markdown):
     # Remove the "user-content-" prefix from internal anchors
     content = content.replace("id=\"user-content-", "id=\"")
 
+    return format_github_markdown_html(content)
+
+def format_github_markdown_html(content):
     return _html_template.replace("@content@", content)
 
 def update_external_from_github(dir, owner, repo, ref="main"):
@@ -17,17 +17,11 @@
 # under the License.
 #
 
-import base64 as _base64
-import binascii as _binascii
-import code as _code
-import datetime as _datetime
+import contextvars as _contextvars
 import fnmatch as _fnmatch
 import getpass as _getpass
 import json as _json
 import os as _os
-import pprint as _pprint
-import pkgutil as _pkgutil
-import random as _random
 import re as _re
 import shlex as _shlex
 import shutil as _shutil
@@ -36,11 +30,11 @@ import socket as _socket
 import subprocess as _subprocess
 import sys as _sys
 import tempfile as _tempfile
+import threading as _threading
 import time as _time
 import traceback as _traceback
 import urllib as _urllib
 import urllib.parse as _urllib_parse
-import uuid as _uuid
 
 _max = max
 
@@ -234,6 +228,8 @@ except NameError: # pragma: nocover
         pdb.set_trace()
 
 def repl(locals): # pragma: nocover
+    import code as _code
+
     _code.InteractiveConsole(locals=locals).interact()
 
 def print_properties(props, file=None):
@@ -429,6 +425,8 @@ def check_env(var, message=None):
         raise PlanoError(message)
 
 def check_module(module, message=None):
+    import pkgutil as _pkgutil
+
     if _pkgutil.find_loader(module) is None:
         if message is None:
             message = "Python module {} is not found".format(repr(module))
@@ -762,6 +760,148 @@ def print_json(data, **kwargs):
 
 ## HTTP operations
 
+_http_proxy_vars = ("http_proxy", "https_proxy", "all_proxy", "HTTP_PROXY", "HTTPS_PROXY", "ALL_PROXY")
+_http_connections = dict()
+_http_connections_lock = _threading.Lock()
+_http_connections_pid = None
+
+# Requests use a native client with pooled keep-alive connections.
+# Curl is used instead if PLANO_HTTP_CURL is set or a proxy is
+# configured.
+def _http_request(method, url, content=None, content_file=None, content_type=None, output_file=None, insecure=False,
+                  user=None, password=None, quiet=False):
+    if "PLANO_HTTP_CURL" in ENV or any(x in ENV for x in _http_proxy_vars):
+        return _run_curl(method, url, content=content, content_file=content_file, content_type=content_type,
+                         output_file=output_file, insecure=insecure, user=user, password=password, quiet=quiet)
+
+    _notice(quiet, f"Sending {method} request to '{url}'")
+
+    headers = dict()
+
+    if content is not None:
+        assert content_file is None
+        body = content.encode("utf-8") if is_string(content) else content
+    elif content_file is not None:
+        with open(expand(content_file), "rb") as f:
+            body = f.read()
+    else:
+        body = None
+
+    if content_type is not None:
+        headers["Content-Type"] = content_type
+
+    if user is not None:
+        assert password is not None
+        headers["Authorization"] = "Basic " + base64_encode(f"{user}:{password}".encode("utf-8")).decode("ascii")
+
+    origin = _urllib_parse.urlsplit(url)[:2]
+
+    for _ in range(10):
+        status, location, result = _send_http_request(method, url, body, headers, insecure)
+
+        if status in (301, 302, 303, 307, 308) and location is not None:
+            url = _urllib_parse.urljoin(url, location)
+
+            # Like curl, send the credentials only to the original host
+            if _urllib_parse.urlsplit(url)[:2] != origin:
+                headers.pop("Authorization", None)
+
+            if status == 303 or (status in (301, 302) and method == "POST"):
+                method, body = "GET", None
+                headers.pop("Content-Type", None)
+
+            continue
+
+        break
+    else:
+        raise PlanoError(f"Too many redirects for {method} request to '{url}'")
+
+    if status >= 400:
+        raise PlanoError(f"{method} request to '{url}' failed with HTTP status {status}")
+
+    if output_file is not None:
+        make_parent_dir(output_file, quiet=True)
+
+        with open(expand(output_file), "wb") as f:
+            f.write(result)
+
+        return
+
+    return result.decode("utf-8")
+
+def _send_http_request(method, url, body, headers, insecure):
+    import http.client as _http_client
+
+    parsed_url = _urllib_parse.urlsplit(url)
+
+    if parsed_url.scheme not in ("http", "https"):
+        raise PlanoError(f"Unsupported URL scheme: {url}")
+
+    key = parsed_url.scheme, parsed_url.netloc, insecure
+    path = _urllib_parse.urlunsplit(("", "", parsed_url.path or "/", parsed_url.query, ""))
+
+    # A stale keep-alive connection fails on first use, so retry
+    # once with a new connection
+    for attempt in range(2):
+        conn, reused = _get_http_connection(key)
+
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            result = response.read()
+        except (_http_client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+            conn.close()
+
+            if reused and attempt == 0:
+                continue
+
+            raise PlanoError(f"{method} request to '{url}' failed: {e}")
+        except (OSError, _http_client.HTTPException) as e:
+            conn.close()
+            raise PlanoError(f"{method} request to '{url}' failed: {e}")
+
+        if response.will_close:
+            conn.close()
+        else:
+            _return_http_connection(key, conn)
+
+        return response.status, response.getheader("Location"), result
+
+def _get_http_connection(key):
+    import http.client as _http_client
+    import ssl as _ssl
+
+    global _http_connections_pid
+
+    with _http_connections_lock:
+        # Connections inherited from a parent process are not usable
+        if _http_connections_pid != _os.getpid():
+            _http_connections.clear()
+            _http_connections_pid = _os.getpid()
+
+        try:
+            return _http_connections[key].pop(), True
+        except (KeyError, IndexError):
+            pass
+
+    scheme, netloc, insecure = key
+
+    if scheme == "https":
+        context = _ssl.create_default_context()
+
+        if insecure:
+            context.check_hostname = False
+            context.verify_mode = _ssl.CERT_NONE
+
+        return _http_client.HTTPSConnection(netloc, timeout=60, context=context), False
+
+    return _http_client.HTTPConnection(netloc, timeout=60), False
+
+def _return_http_connection(key, conn):
+    with _http_connections_lock:
+        if _http_connections_pid == _os.getpid():
+            _http_connections.setdefault(key, list()).append(conn)
+
 def _run_curl(method, url, content=None, content_file=None, content_type=None, output_file=None, insecure=False,
               user=None, password=None, quiet=False):
     check_program("curl")
@@ -809,18 +949,19 @@ def _run_curl(method, url, content=None, content_file=None, content_type=None, o
         return proc.stdout_result
 
 def http_get(url, output_file=None, insecure=False, user=None, password=None, quiet=False):
-    return _run_curl("GET", url, output_file=output_file, insecure=insecure, user=user, password=password, quiet=quiet)
+    return _http_request("GET", url, output_file=output_file, insecure=insecure, user=user, password=password,
+                         quiet=quiet)
 
 def http_get_json(url, insecure=False, user=None, password=None, quiet=False):
     return parse_json(http_get(url, insecure=insecure, user=user, password=password, quiet=quiet))
 
 def http_put(url, content, content_type=None, insecure=False, user=None, password=None, quiet=False):
-    _run_curl("PUT", url, content=content, content_type=content_type, insecure=insecure, user=user, password=password,
-              quiet=quiet)
+    _http_request("PUT", url, content=content, content_type=content_type, insecure=insecure, user=user,
+                  password=password, quiet=quiet)
 
 def http_put_file(url, content_file, content_type=None, insecure=False, user=None, password=None, quiet=False):
-    _run_curl("PUT", url, content_file=content_file, content_type=content_type, insecure=insecure, user=user,
-              password=password, quiet=quiet)
+    _http_request("PUT", url, content_file=content_file, content_type=content_type, insecure=insecure, user=user,
+                  password=password, quiet=quiet)
 
 def http_put_json(url, data, insecure=False, user=None, password=None, quiet=False):
     http_put(url, emit_json(data), content_type="application/json", insecure=insecure, user=user, password=password,
@@ -828,13 +969,13 @@ def http_put_json(url, data, insecure=False, user=None, password=None, quiet=Fal
 
 def http_post(url, content, content_type=None, output_file=None, insecure=False, user=None, password=None,
               quiet=False):
-    return _run_curl("POST", url, content=content, content_type=content_type, output_file=output_file,
-                     insecure=insecure, user=user, password=password, quiet=quiet)
+    return _http_request("POST", url, content=content, content_type=content_type, output_file=output_file,
+                         insecure=insecure, user=user, password=password, quiet=quiet)
 
 def http_post_file(url, content_file, content_type=None, output_file=None, insecure=False, user=None, password=None,
                    quiet=False):
-    return _run_curl("POST", url, content_file=content_file, content_type=content_type, output_file=output_file,
-                     insecure=insecure, user=user, password=password, quiet=quiet)
+    return _http_request("POST", url, content_file=content_file, content_type=content_type, output_file=output_file,
+                         insecure=insecure, user=user, password=password, quiet=quiet)
 
 def http_post_json(url, data, insecure=False, user=None, password=None, quiet=False):
     return parse_json(http_post(url, emit_json(data), content_type="application/json", insecure=insecure, user=user,
@@ -873,7 +1014,7 @@ _DISABLED = _logging_levels.index("disabled")
 
 _logging_output = None
 _logging_threshold = _NOTICE
-_logging_contexts = list()
+_logging_contexts = _contextvars.ContextVar("plano_logging_contexts", default=())
 
 def enable_logging(level="notice", output=None, quiet=False):
     assert level in _logging_levels, level
@@ -919,15 +1060,16 @@ class logging_disabled(logging_enabled):
     def __init__(self):
         super().__init__(level="disabled")
 
+# The contexts are local to the current thread or asyncio task
 class logging_context:
     def __init__(self, name):
         self.name = name
 
     def __enter__(self):
-        _logging_contexts.append(self.name)
+        self.token = _logging_contexts.set(_logging_contexts.get() + (self.name,))
 
     def __exit__(self, exc_type, exc_value, traceback):
-        _logging_contexts.pop()
+        _logging_contexts.reset(self.token)
 
 def fail(message, *args):
     if isinstance(message, BaseException):
@@ -974,7 +1116,7 @@ def _print_message(level, message, args):
 
     line.append(cformat(level_text, color=level_color, bright=level_bright))
 
-    for name in _logging_contexts:
+    for name in _logging_contexts.get():
         line.append(cformat("{}:".format(name), color="yellow"))
 
     if isinstance(message, BaseException):
@@ -1142,21 +1284,33 @@ def await_exists(path, timeout=30, quiet=False):
     _notice(quiet, "Waiting for path {} to exist", repr(path))
 
     timeout_message = "Timed out waiting for path {} to exist".format(path)
+
+    _await_condition(lambda: exists(path), timeout, timeout_message)
+
+# Polls with exponential backoff until the condition is true.  This
+# uses a deadline instead of a Timer, since the Timer's alarm signal
+# works only in the main thread.
+def _await_condition(condition, timeout, timeout_message):
+    deadline = None if timeout is None else get_time() + timeout
     period = 0.03125
 
-    with Timer(timeout=timeout, timeout_message=timeout_message) as timer:
-        while True:
-            try:
-                check_exists(path)
-            except PlanoError:
-                sleep(period, quiet=True)
-                period = min(1, period * 2)
-            else:
-                return
+    while not condition():
+        if deadline is not None:
+            remaining = deadline - get_time()
+
+            if remaining <= 0:
+                raise PlanoTimeout(timeout_message)
+
+            period = min(period, remaining)
+
+        sleep(period, quiet=True)
+        period = min(1, period * 2)
 
 ## Port operations
 
 def get_random_port(min=49152, max=65535):
+    import random as _random
+
     ports = [_random.randint(min, max) for _ in range(3)]
 
     for port in ports:
@@ -1181,17 +1335,16 @@ def await_port(port, host="localhost", timeout=30, quiet=False):
         port = int(port)
 
     timeout_message = "Timed out waiting for port {} to open".format(port)
-    period = 0.03125
 
-    with Timer(timeout=timeout, timeout_message=timeout_message) as timer:
-        while True:
-            try:
-                check_port(port, host=host)
-            except PlanoError:
-                sleep(period, quiet=True)
-                period = min(1, period * 2)
-            else:
-                return
+    def is_open():
+        try:
+            check_port(port, host=host)
+        except PlanoError:
+            return False
+
+        return True
+
+    _await_condition(is_open, timeout, timeout_message)
 
 ## Process operations
 
@@ -1219,7 +1372,9 @@ def _format_command(command, represent=True):
 # stdout=<file> - Send stdout to a file
 # stderr=<file> - Send stderr to a file
 # shell=False - XXX
-def start(command, stdin=None, stdout=None, stderr=None, output=None, shell=False, stash=False, quiet=False):
+# env=<dict> - Set these environment variables for the process only
+def start(command, stdin=None, stdout=None, stderr=None, output=None, shell=False, env=None, stash=False,
+          quiet=False):
     _notice(quiet, "Starting a new process (command {})", _format_command(command))
 
     if output is not None:
@@ -1267,8 +1422,12 @@ def start(command, stdin=None, stdout=None, stderr=None, output=None, shell=Fals
 
         args = [expand(str(x)) for x in args]
 
+    if env is not None:
+        env = dict(_os.environ, **{k: str(v) for k, v in env.items()})
+
     try:
-        proc = PlanoProcess(args, stdin=stdin, stdout=stdout, stderr=stderr, shell=shell, close_fds=True, stash_file=stash_file)
+        proc = PlanoProcess(args, stdin=stdin, stdout=stdout, stderr=stderr, shell=shell, env=env, close_fds=True,
+                            stash_file=stash_file)
     except OSError as e:
         raise PlanoError("Command {}: {}".format(_format_command(command), str(e)))
 
@@ -1307,6 +1466,8 @@ def wait(proc, timeout=None, check=False, quiet=False):
         error("{} timed out after {} seconds", proc, timeout)
         raise PlanoTimeout()
 
+    _remove_child_process(proc)
+
     if proc.exit_code == 0:
         debug("{} exited normally", proc)
     elif proc.exit_code < 0:
@@ -1331,7 +1492,7 @@ def wait(proc, timeout=None, check=False, quiet=False):
 
 # input=<string> - Pipe <string> to the process
 def run(command, stdin=None, stdout=None, stderr=None, input=None, output=None,
-        stash=False, shell=False, check=True, quiet=False):
+        stash=False, shell=False, env=None, check=True, quiet=False):
     _notice(quiet, "Running command {}", _format_command(command))
 
     if input is not None:
@@ -1341,7 +1502,7 @@ def run(command, stdin=None, stdout=None, stderr=None, input=None, output=None,
         stdin = _subprocess.PIPE
 
     proc = start(command, stdin=stdin, stdout=stdout, stderr=stderr, output=output,
-                 stash=stash, shell=shell, quiet=True)
+                 stash=stash, shell=shell, env=env, quiet=True)
 
     proc.stdout_result, proc.stderr_result = proc.communicate(input=input)
 
@@ -1354,11 +1515,11 @@ def run(command, stdin=None, stdout=None, stderr=None, input=None, output=None,
     return wait(proc, check=check, quiet=True)
 
 # input=<string> - Pipe the given input into the process
-def call(command, input=None, shell=False, quiet=False):
+def call(command, input=None, shell=False, env=None, quiet=False):
     _notice(quiet, "Calling {}", _format_command(command))
 
     proc = run(command, stdin=_subprocess.PIPE, stdout=_subprocess.PIPE, stderr=_subprocess.PIPE,
-               input=input, shell=shell, check=True, quiet=True)
+               input=input, shell=shell, env=env, check=True, quiet=True)
 
     return proc.stdout_result
 
@@ -1422,6 +1583,13 @@ class PlanoProcessError(_subprocess.CalledProcessError, PlanoError):
     def __init__(self, proc):
         super().__init__(proc.exit_code, _format_command(proc.args, represent=False))
 
+# Processes that have exited no longer need to be killed on SIGTERM
+def _remove_child_process(proc):
+    try:
+        _child_processes.remove(proc)
+    except ValueError:
+        pass
+
 def _default_sigterm_handler(signum, frame):
     for proc in _child_processes:
         if proc.poll() is None:
@@ -1492,9 +1660,13 @@ def capitalize(string):
     return string[0].upper() + string[1:]
 
 def base64_encode(string):
+    import base64 as _base64
+
     return _base64.b64encode(string)
 
 def base64_decode(string):
+    import base64 as _base64
+
     return _base64.b64decode(string)
 
 def url_encode(string):
@@ -1563,9 +1735,13 @@ def get_time():
 
 # Python UTC time
 def get_datetime():
+    import datetime as _datetime
+
     return _datetime.datetime.now(tz=_datetime.timezone.utc)
 
 def parse_timestamp(timestamp, format="%Y-%m-%dT%H:%M:%SZ"):
+    import datetime as _datetime
+
     if timestamp is None:
         return None
 
@@ -1683,6 +1859,9 @@ class Timer:
 
 # Length in bytes, renders twice as long in hex
 def get_unique_id(bytes=16):
+    import binascii as _binascii
+    import uuid as _uuid
+
     assert bytes >= 1
     assert bytes <= 16
 
@@ -1709,6 +1888,8 @@ def is_empty(value):
     return value in (None, "", (), [], {})
 
 def pformat(value):
+    import pprint as _pprint
+
     return _pprint.pformat(value, width=120)
 
 def format_empty(value, replacement):
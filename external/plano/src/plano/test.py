@@ -21,12 +21,13 @@ from .main import *
 from .command import *
 
 import argparse as _argparse
-import asyncio as _asyncio
 import fnmatch as _fnmatch
 import functools as _functools
 import importlib as _importlib
 import inspect as _inspect
+import os as _os
 import sys as _sys
+import tempfile as _tempfile
 import traceback as _traceback
 
 class PlanoTestCommand(BaseCommand):
@@ -55,6 +56,12 @@ class PlanoTestCommand(BaseCommand):
                                  help="Exit on the first failure encountered in a test run")
         self.parser.add_argument("--iterations", metavar="COUNT", type=int, default=1,
                                  help="Run the tests COUNT times (default 1)")
+        self.parser.add_argument("-j", "--jobs", metavar="COUNT", type=int, default=1,
+                                 help="Run up to COUNT tests at once in separate processes (default 1)")
+        self.parser.add_argument("--shard", metavar="INDEX/COUNT",
+                                 help="Run only shard INDEX of COUNT shards, balanced by recorded test timings")
+        self.parser.add_argument("--timings", metavar="FILE", default=ENV.get("PLANO_TEST_TIMINGS"),
+                                 help="Read and record test timings in FILE (default $PLANO_TEST_TIMINGS)")
         self.parser.add_argument("--verbose", action="store_true",
                                  help="Print detailed logging to the console")
         self.parser.add_argument("--quiet", action="store_true",
@@ -81,6 +88,9 @@ class PlanoTestCommand(BaseCommand):
         self.timeout = args.timeout
         self.fail_fast = args.fail_fast
         self.iterations = args.iterations
+        self.jobs = args.jobs
+        self.shard = args.shard
+        self.timings_file = args.timings
         self.verbose = args.verbose
         self.quiet = args.quiet
 
@@ -100,6 +110,7 @@ class PlanoTestCommand(BaseCommand):
                       exclude=self.exclude_patterns,
                       enable=self.enable_patterns, unskip=self.unskip_patterns,
                       test_timeout=self.timeout, fail_fast=self.fail_fast,
+                      jobs=self.jobs, shard=self.shard, timings_file=self.timings_file,
                       verbose=self.verbose, quiet=self.quiet)
 
 class PlanoTestSkipped(Exception):
@@ -130,6 +141,7 @@ def test(_function=None, name=None, module=None, timeout=None, disabled=False):
                 ret = self.function()
 
                 if _inspect.iscoroutine(ret):
+                    import asyncio as _asyncio
                     _asyncio.run(ret)
             except SystemExit as e:
                 error(e)
@@ -218,7 +230,7 @@ def print_tests(modules):
             print(" ".join((str(test), flags)).strip())
 
 def run_tests(modules, include="*", exclude=(), enable=(), unskip=(), test_timeout=300,
-              fail_fast=False, verbose=False, quiet=False):
+              fail_fast=False, jobs=1, shard=None, timings_file=None, verbose=False, quiet=False):
     if _inspect.ismodule(modules):
         modules = (modules,)
 
@@ -234,7 +246,14 @@ def run_tests(modules, include="*", exclude=(), enable=(), unskip=(), test_timeo
     if is_string(unskip):
         enable = (unskip,)
 
-    test_run = TestRun(test_timeout=test_timeout, fail_fast=fail_fast, verbose=verbose, quiet=quiet)
+    if jobs < 1:
+        raise PlanoError("The number of jobs must be at least 1")
+
+    if shard is not None:
+        shard = _parse_shard(shard)
+
+    test_run = TestRun(test_timeout=test_timeout, fail_fast=fail_fast, jobs=jobs, shard=shard,
+                       timings_file=timings_file, verbose=verbose, quiet=quiet)
 
     if verbose:
         notice("Starting {}", test_run)
@@ -245,45 +264,38 @@ def run_tests(modules, include="*", exclude=(), enable=(), unskip=(), test_timeo
             ("Modules", format_empty(", ".join([x.__name__ for x in modules]), "[none]")),
             ("Test timeout", format_duration(test_timeout)),
             ("Fail fast", fail_fast),
+            ("Jobs", jobs),
+            ("Shard", "{}/{}".format(*shard) if shard is not None else "[none]"),
         )
 
         print_properties(props)
         print()
 
-    stop = False
+    selections = list()
 
     for module in modules:
-        if stop:
-            break
-
-        if verbose:
-            notice("Running tests from module {} (file {})", repr(module.__name__), repr(module.__file__))
-        elif not quiet:
-            cprint("=== Module {} ===".format(repr(module.__name__)), color="cyan")
-
-        if not hasattr(module, "_plano_tests"):
-            warning("Module {} has no tests", repr(module.__name__))
-            continue
-
-        for test in module._plano_tests:
-            if stop:
-                break
+        if hasattr(module, "_plano_tests"):
+            selections.append((module, _select_tests(module, include, exclude, enable, unskip)))
+        else:
+            selections.append((module, None))
 
-            if test.disabled and not any([_fnmatch.fnmatchcase(test.name, x) for x in enable]):
-                continue
+    if shard is not None:
+        selections = _select_shard(selections, shard, test_run.read_timings())
 
-            included = any([_fnmatch.fnmatchcase(test.name, x) for x in include])
-            excluded = any([_fnmatch.fnmatchcase(test.name, x) for x in exclude])
-            unskipped = any([_fnmatch.fnmatchcase(test.name, x) for x in unskip])
+    try:
+        if jobs == 1:
+            _run_tests_serially(test_run, selections)
+        else:
+            _run_tests_in_parallel(test_run, selections)
+    finally:
+        test_run.write_timings()
 
-            if included and not excluded:
-                test_run.tests.append(test)
-                stop = _run_test(test_run, test, unskipped)
+    total = len(test_run.tests)
 
-        if not verbose and not quiet:
-            print()
+    if total == 0 and shard is not None:
+        notice("Shard {}/{} has no tests", *shard)
+        return
 
-    total = len(test_run.tests)
     skipped = len(test_run.skipped_tests)
     failed = len(test_run.failed_tests)
 
@@ -329,90 +341,349 @@ def run_tests(modules, include="*", exclude=(), enable=(), unskip=(), test_timeo
     if failed != 0:
         raise PlanoError(result_message)
 
+def _select_tests(module, include, exclude, enable, unskip):
+    selected = list()
+
+    for test in module._plano_tests:
+        if test.disabled and not any([_fnmatch.fnmatchcase(test.name, x) for x in enable]):
+            continue
+
+        included = any([_fnmatch.fnmatchcase(test.name, x) for x in include])
+        excluded = any([_fnmatch.fnmatchcase(test.name, x) for x in exclude])
+        unskipped = any([_fnmatch.fnmatchcase(test.name, x) for x in unskip])
+
+        if included and not excluded:
+            selected.append((test, unskipped))
+
+    return selected
+
+def _print_module_header(test_run, module):
+    if test_run.verbose:
+        notice("Running tests from module {} (file {})", repr(module.__name__), repr(module.__file__))
+    elif not test_run.quiet:
+        cprint("=== Module {} ===".format(repr(module.__name__)), color="cyan")
+
+def _parse_shard(shard):
+    if is_string(shard):
+        try:
+            shard = tuple(int(x) for x in shard.split("/"))
+        except ValueError:
+            raise PlanoError("Shard {} is not in the form INDEX/COUNT".format(repr(shard)))
+
+    if len(shard) != 2 or not 1 <= shard[0] <= shard[1]:
+        raise PlanoError("Shard {} is not in the form INDEX/COUNT, with INDEX from 1 to COUNT".format(repr(shard)))
+
+    return shard
+
+# Tests are assigned to shards longest first, each going to the shard
+# with the least total time so far.  Tests without recorded timings
+# count as the mean of the known ones.  With no timings at all, tests
+# are dealt out round-robin.
+def _select_shard(selections, shard, timings):
+    index, count = shard
+    keys = [_get_test_key(test) for module, selected in selections for test, unskipped in selected or ()]
+    known = [timings[x] for x in keys if x in timings]
+    assigned = set()
+
+    if known:
+        default = sum(known) / len(known)
+        durations = [timings.get(x, default) for x in keys]
+        loads = [0.0] * count
+
+        for i in sorted(range(len(keys)), key=lambda i: (-durations[i], i)):
+            shard_index = min(range(count), key=lambda x: (loads[x], x))
+            loads[shard_index] += durations[i]
+
+            if shard_index == index - 1:
+                assigned.add(keys[i])
+    else:
+        assigned = set(keys[index - 1::count])
+
+    return [(module, [x for x in selected if _get_test_key(x[0]) in assigned] if selected is not None else None)
+            for module, selected in selections]
+
+def _get_test_key(test):
+    return "{}:{}".format(test.module.__name__, test.name)
+
+def _run_tests_serially(test_run, selections):
+    stop = False
+
+    for module, selected in selections:
+        if stop:
+            break
+
+        _print_module_header(test_run, module)
+
+        if selected is None:
+            warning("Module {} has no tests", repr(module.__name__))
+            continue
+
+        for test, unskipped in selected:
+            if stop:
+                break
+
+            test_run.tests.append(test)
+            stop = _run_test(test_run, test, unskipped)
+
+        if not test_run.verbose and not test_run.quiet:
+            print()
+
+# Each test runs in its own forked process with a private TMPDIR and
+# its output captured to a file.  Results are reported in the same
+# order a serial run would use, as soon as all earlier tests are done.
+def _run_tests_in_parallel(test_run, selections):
+    import multiprocessing as _multiprocessing
+    import multiprocessing.connection as _multiprocessing_connection
+
+    context = _multiprocessing.get_context("fork")
+    entries = list()
+
+    for module, selected in selections:
+        if selected is None:
+            warning("Module {} has no tests", repr(module.__name__))
+            continue
+
+        for test, unskipped in selected:
+            entries.append((module, test, unskipped))
+
+    processes = dict()
+    results = dict()
+    next_index = 0
+    report_index = 0
+    current_module = None
+    stop = False
+
+    def report(index):
+        nonlocal current_module, stop
+
+        module, test, unskipped = entries[index]
+        result = results[index]
+
+        if result["status"] == "INTERRUPTED":
+            raise KeyboardInterrupt()
+
+        if module is not current_module:
+            if current_module is not None and not test_run.verbose and not test_run.quiet:
+                print()
+
+            _print_module_header(test_run, module)
+            current_module = module
+
+        test_run.tests.append(test)
+
+        if test_run.verbose:
+            notice("Running {}", test)
+            _print_test_output(result["output_file"], prefix="")
+        elif not test_run.quiet:
+            print("{:.<65} ".format(test.name + " "), end="")
+
+        if _report_test_result(test_run, test, result, result["output_file"]):
+            stop = True
+
+    with temp_dir(prefix="plano-test-") as run_dir:
+        try:
+            while report_index < len(entries) and not stop:
+                while len(processes) < test_run.jobs and next_index < len(entries):
+                    module, test, unskipped = entries[next_index]
+                    test_dir = make_dir(join(run_dir, str(next_index)), quiet=True)
+
+                    flush()
+
+                    process = context.Process(target=_run_test_process, args=(test_run, test, unskipped, test_dir))
+                    process.start()
+
+                    processes[next_index] = process
+                    next_index += 1
+
+                _multiprocessing_connection.wait([x.sentinel for x in processes.values()])
+
+                for index, process in list(processes.items()):
+                    if process.is_alive():
+                        continue
+
+                    process.join()
+                    del processes[index]
+
+                    results[index] = _read_test_result(join(run_dir, str(index)), process.exitcode)
+
+                    if test_run.fail_fast and results[index]["status"] == "FAILED":
+                        stop = True
+
+                while report_index in results:
+                    report(report_index)
+                    report_index += 1
+
+            # With fail fast, report whatever finished before the failure
+            for index in sorted(results):
+                if index >= report_index:
+                    report(index)
+        finally:
+            for process in processes.values():
+                process.terminate()
+
+            for process in processes.values():
+                process.join()
+
+    if current_module is not None and not test_run.verbose and not test_run.quiet:
+        print()
+
+def _run_test_process(test_run, test, unskipped, test_dir):
+    output_file = join(test_dir, "output")
+    tmp_dir = make_dir(join(test_dir, "tmp"), quiet=True)
+
+    _os.environ["TMPDIR"] = tmp_dir
+    _tempfile.tempdir = None
+
+    with open(output_file, "w") as output:
+        _os.dup2(output.fileno(), 1)
+        _os.dup2(output.fileno(), 2)
+
+        try:
+            result = _execute_test(test_run, test, unskipped)
+        except KeyboardInterrupt:
+            result = {"status": "INTERRUPTED", "elapsed_time": 0}
+
+        flush()
+
+    write_json(join(test_dir, "result.json"), result)
+
+def _read_test_result(test_dir, exitcode):
+    result_file = join(test_dir, "result.json")
+
+    if exists(result_file):
+        result = read_json(result_file)
+    else:
+        message = "Test process exited with code {} before reporting a result".format(exitcode)
+        result = {
+            "status": "FAILED",
+            "elapsed_time": 0,
+            "timeout": False,
+            "error": "> " + message,
+            "traceback": message + "\n",
+        }
+
+    result["output_file"] = join(test_dir, "output")
+
+    return result
+
+def _execute_test(test_run, test, unskipped):
+    timeout = nvl(test.timeout, test_run.test_timeout)
+    timer = None
+
+    try:
+        with Timer(timeout=timeout) as timer:
+            test(test_run, unskipped)
+    except KeyboardInterrupt:
+        raise
+    except PlanoTestSkipped as e:
+        return {"status": "SKIPPED", "elapsed_time": timer.elapsed_time, "reason": str(e)}
+    except Exception as e:
+        return {
+            "status": "FAILED",
+            "elapsed_time": timer.elapsed_time if timer is not None else 0,
+            "timeout": isinstance(e, PlanoTimeout),
+            "error": _format_test_error(e),
+            "traceback": _traceback.format_exc(),
+        }
+
+    return {"status": "PASSED", "elapsed_time": timer.elapsed_time}
+
 def _run_test(test_run, test, unskipped):
     if test_run.verbose:
         notice("Running {}", test)
     elif not test_run.quiet:
         print("{:.<65} ".format(test.name + " "), end="")
 
-    timeout = nvl(test.timeout, test_run.test_timeout)
-
     with temp_file() as output_file:
-        try:
-            with Timer(timeout=timeout) as timer:
-                if test_run.verbose:
-                    test(test_run, unskipped)
-                else:
-                    with output_redirected(output_file, quiet=True):
-                        test(test_run, unskipped)
-        except KeyboardInterrupt:
-            raise
-        except PlanoTestSkipped as e:
-            test_run.skipped_tests.append(test)
-
-            if test_run.verbose:
-                notice("{} SKIPPED ({})", test, format_duration(timer.elapsed_time))
-            elif not test_run.quiet:
-                _print_test_result("SKIPPED", timer, "yellow")
-                print("Reason: {}".format(str(e)))
-        except Exception as e:
-            test_run.failed_tests.append(test)
-
-            if test_run.verbose:
-                _traceback.print_exc()
-
-                if isinstance(e, PlanoTimeout):
-                    error("{} **FAILED** (TIMEOUT) ({})", test, format_duration(timer.elapsed_time))
-                else:
-                    error("{} **FAILED** ({})", test, format_duration(timer.elapsed_time))
-            elif not test_run.quiet:
-                if isinstance(e, PlanoTimeout):
-                    _print_test_result("**FAILED** (TIMEOUT)", timer, color="red", bright=True)
-                else:
-                    _print_test_result("**FAILED**", timer, color="red", bright=True)
-
-                _print_test_error(e)
-                _print_test_output(output_file)
-
-            if test_run.fail_fast:
-                return True
+        if test_run.verbose:
+            result = _execute_test(test_run, test, unskipped)
         else:
-            test_run.passed_tests.append(test)
+            with output_redirected(output_file, quiet=True):
+                result = _execute_test(test_run, test, unskipped)
+
+        return _report_test_result(test_run, test, result, output_file)
+
+def _report_test_result(test_run, test, result, output_file):
+    status = result["status"]
+    elapsed_time = result["elapsed_time"]
+
+    if status != "SKIPPED":
+        test_run.timings[_get_test_key(test)] = elapsed_time
+
+    if status == "SKIPPED":
+        test_run.skipped_tests.append(test)
+
+        if test_run.verbose:
+            notice("{} SKIPPED ({})", test, format_duration(elapsed_time))
+        elif not test_run.quiet:
+            _print_test_result("SKIPPED", elapsed_time, "yellow")
+            print("Reason: {}".format(result["reason"]))
+    elif status == "FAILED":
+        test_run.failed_tests.append(test)
+
+        if test_run.verbose:
+            _sys.stderr.write(result["traceback"])
+
+            if result["timeout"]:
+                error("{} **FAILED** (TIMEOUT) ({})", test, format_duration(elapsed_time))
+            else:
+                error("{} **FAILED** ({})", test, format_duration(elapsed_time))
+        elif not test_run.quiet:
+            if result["timeout"]:
+                _print_test_result("**FAILED** (TIMEOUT)", elapsed_time, color="red", bright=True)
+            else:
+                _print_test_result("**FAILED**", elapsed_time, color="red", bright=True)
+
+            _print_test_error(result["error"])
+            _print_test_output(output_file)
+
+        return test_run.fail_fast
+    else:
+        test_run.passed_tests.append(test)
 
-            if test_run.verbose:
-                notice("{} PASSED ({})", test, format_duration(timer.elapsed_time))
-            elif not test_run.quiet:
-                _print_test_result("PASSED", timer)
+        if test_run.verbose:
+            notice("{} PASSED ({})", test, format_duration(elapsed_time))
+        elif not test_run.quiet:
+            _print_test_result("PASSED", elapsed_time)
 
-def _print_test_result(status, timer, color="white", bright=False):
-    cprint("{:<7}".format(status), color=color, bright=bright, end="")
-    print("{:>6}".format(format_duration(timer.elapsed_time, align=True)))
+    return False
 
-def _print_test_error(e):
-    cprint("--- Error ---", color="yellow")
+def _print_test_result(status, elapsed_time, color="white", bright=False):
+    cprint("{:<7}".format(status), color=color, bright=bright, end="")
+    print("{:>6}".format(format_duration(elapsed_time, align=True)))
 
+def _format_test_error(e):
     if isinstance(e, PlanoProcessError):
-        print("> {}".format(str(e)))
-    else:
-        lines = _traceback.format_exc().rstrip().split("\n")
-        lines = ["> {}".format(x) for x in lines]
+        return "> {}".format(str(e))
+
+    lines = _traceback.format_exc().rstrip().split("\n")
+    lines = ["> {}".format(x) for x in lines]
+
+    return "\n".join(lines)
 
-        print("\n".join(lines))
+def _print_test_error(error):
+    cprint("--- Error ---", color="yellow")
+    print(error)
 
-def _print_test_output(output_file):
+def _print_test_output(output_file, prefix="> "):
     if get_file_size(output_file) == 0:
         return
 
-    cprint("--- Output ---", color="yellow")
+    if prefix:
+        cprint("--- Output ---", color="yellow")
 
     with open(output_file, "r") as out:
         for line in out:
-            print("> {}".format(line), end="")
+            print("{}{}".format(prefix, line), end="")
 
 class TestRun:
-    def __init__(self, test_timeout=None, fail_fast=False, verbose=False, quiet=False):
+    def __init__(self, test_timeout=None, fail_fast=False, jobs=1, shard=None, timings_file=None,
+                 verbose=False, quiet=False):
         self.test_timeout = test_timeout
         self.fail_fast = fail_fast
+        self.jobs = jobs
+        self.shard = shard
+        self.timings_file = timings_file
         self.verbose = verbose
         self.quiet = quiet
 
@@ -420,9 +691,31 @@ class TestRun:
         self.skipped_tests = list()
         self.failed_tests = list()
         self.passed_tests = list()
+        self.timings = dict()
 
     def __repr__(self):
         return format_repr(self)
 
+    def read_timings(self):
+        if self.timings_file is None or not exists(self.timings_file):
+            return dict()
+
+        try:
+            return read_json(self.timings_file)
+        except ValueError:
+            warning("Ignoring unreadable test timings file {}", repr(self.timings_file))
+            return dict()
+
+    # Timings from earlier runs are kept for tests that did not run
+    # this time, so each shard can update a shared file
+    def write_timings(self):
+        if self.timings_file is None or not self.timings:
+            return
+
+        timings = self.read_timings()
+        timings.update(self.timings)
+
+        write_json(self.timings_file, timings)
+
 def _main(): # pragma: nocover
     PlanoTestCommand().main()
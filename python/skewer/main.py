@@ -17,16 +17,118 @@
 # under the License.
 #
 
+import atexit
+import codecs
+import collections
+import contextlib
+import contextvars
+import fcntl
 import inspect
+import json
+import math
+import os
+import pickle
+import re
+import signal
+import subprocess
+import sys
+import threading
 
 from plano import *
+from plano.github import convert_github_markdown, format_github_markdown_html
+
+# Some modules are imported where they are used, to keep the startup
+# of plano commands fast: hashlib, http.client, multiprocessing, and
+# skewer.markdown
 
 __all__ = [
-    "generate_readme", "run_steps", "Minikube",
+    "generate_readme", "generate_readmes", "render_readme", "run_steps", "run_farm", "cassette", "Minikube",
 ]
 
-standard_text = read_yaml(join(get_parent_dir(__file__), "standardtext.yaml"))
-standard_steps = read_yaml(join(get_parent_dir(__file__), "standardsteps.yaml"))
+standard_text_file = join(get_parent_dir(__file__), "standardtext.yaml")
+standard_steps_file = join(get_parent_dir(__file__), "standardsteps.yaml")
+markdown_code_file = join(get_parent_dir(__file__), "markdown.py")
+
+_standard_data = dict()
+
+# The standard text and steps are loaded on first use.  Parsing the
+# YAML is slow, so the parsed data is cached in a pickle file keyed by
+# the YAML file's modification time and size.
+def load_standard_data(yaml_file):
+    try:
+        return _standard_data[yaml_file]
+    except KeyError:
+        pass
+
+    stat = os.stat(yaml_file)
+    cache_key = hash_strings(get_absolute_path(yaml_file), str(stat.st_mtime_ns), str(stat.st_size))
+    cache_file = join(get_cache_dir(), "standard", f"{get_name_stem(yaml_file)}-{cache_key[:16]}.pickle")
+
+    try:
+        with open(cache_file, "rb") as f:
+            data = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        data = read_yaml(yaml_file)
+        temp_file = f"{cache_file}.{os.getpid()}"
+
+        try:
+            make_parent_dir(cache_file, quiet=True)
+
+            with open(temp_file, "wb") as f:
+                pickle.dump(data, f)
+
+            os.replace(temp_file, cache_file)
+        except OSError:
+            pass
+
+    _standard_data[yaml_file] = data
+
+    return data
+
+def get_standard_text():
+    return load_standard_data(standard_text_file)
+
+def get_standard_steps():
+    return load_standard_data(standard_steps_file)
+
+def __getattr__(name):
+    if name == "standard_text":
+        return get_standard_text()
+
+    if name == "standard_steps":
+        return get_standard_steps()
+
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+def get_cache_dir():
+    if "SKEWER_CACHE_DIR" in ENV:
+        return ENV["SKEWER_CACHE_DIR"]
+
+    return join(ENV.get("XDG_CACHE_HOME", join(get_home_dir(), ".cache")), "skewer")
+
+def hash_strings(*strings):
+    import hashlib
+
+    digest = hashlib.sha256()
+
+    for string in strings:
+        digest.update(string.encode("utf-8"))
+        digest.update(b"\0")
+
+    return digest.hexdigest()
+
+def hash_files(*files):
+    import hashlib
+
+    digest = hashlib.sha256()
+
+    for file in files:
+        with open(expand(file), "rb") as f:
+            digest.update(f.read())
+
+        digest.update(b"\0")
+
+    return digest.hexdigest()
 
 def check_environment():
     check_program("base64")
@@ -35,34 +137,611 @@ def check_environment():
     check_program("skupper")
 
 def resource_exists(resource):
-    return run(f"kubectl get {resource}", output=DEVNULL, check=False, quiet=True).exit_code == 0
+    def query():
+        site, client = get_current_kube_client()
+
+        if client is not None and client.supports(resource):
+            return client.get_resource(resource, site.namespace) is not None
+
+        return run(f"{kubectl()} get {resource}", output=DEVNULL, env=get_site_env(), check=False,
+                   quiet=True).exit_code == 0
+
+    return recorded("resource_exists", resource, query)
 
 def get_resource_json(resource, jsonpath=""):
-    return call(f"kubectl get {resource} -o jsonpath='{{{jsonpath}}}'", quiet=True)
+    def query():
+        site, client = get_current_kube_client()
+
+        if client is not None and client.supports(resource, jsonpath):
+            return client.get_resource_json(resource, site.namespace, jsonpath)
+
+        return call(f"{kubectl()} get {resource} -o jsonpath='{{{jsonpath}}}'", env=get_site_env(), quiet=True)
+
+    return recorded("get_resource_json", f"{resource} {jsonpath}", query)
+
+# The current site is local to the thread or asyncio task, so sites
+# can be used from several threads at once
+_current_sites = contextvars.ContextVar("skewer_current_sites", default=())
+_kube_clients = dict()
+_kube_clients_lock = threading.Lock()
+
+def get_current_site():
+    sites = _current_sites.get()
+    return sites[-1][0] if sites else None
+
+# The environment for commands run in the current site, to pass to
+# plano's run, call, and start.  It is None outside of any site.
+def get_site_env():
+    site = get_current_site()
+
+    if site is None:
+        return None
+
+    return site.get_env()
+
+# The kubectl command with the kubeconfig and namespace of the current
+# site given explicitly
+def kubectl():
+    site = get_current_site()
+
+    if site is None or site.platform != "kubernetes":
+        return "kubectl"
+
+    return f"kubectl --kubeconfig {site.get_env()['KUBECONFIG']} --namespace {site.namespace}"
+
+# Returns the current site and a client for its kubeconfig, or a
+# pair of None values if the current site is not a Kubernetes site
+def get_current_kube_client():
+    site = get_current_site()
+
+    if site is None or site.platform != "kubernetes":
+        return None, None
+
+    kubeconfig = site.get_env()["KUBECONFIG"]
+
+    with _kube_clients_lock:
+        try:
+            client = _kube_clients[kubeconfig]
+        except KeyError:
+            client = _kube_clients[kubeconfig] = KubeClient(kubeconfig)
+
+    return site, client
+
+def stop_kube_clients():
+    with _kube_clients_lock:
+        for client in _kube_clients.values():
+            client.stop()
+
+        _kube_clients.clear()
+
+# Resource queries outside run_steps, from plano commands, tests, or
+# scripts, also start proxies.  Stop them when the process exits.
+atexit.register(stop_kube_clients)
+
+_span_file = None
+
+# Times a step, site block, command, or await.  Finished spans are
+# appended as JSON lines to the span file of the current tracing
+# context, so spans from forked workers are included.
+class span:
+    def __init__(self, name, category, **args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.timer = Timer()
+
+    def __enter__(self):
+        self.timer.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.stop()
+
+        if _span_file is None:
+            return
+
+        record = {
+            "name": self.name,
+            "category": self.category,
+            "start": self.timer.start_time,
+            "duration": self.timer.elapsed_time,
+            "pid": os.getpid(),
+            "failed": exc_type is not None,
+            "args": self.args,
+        }
+
+        with open(_span_file, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+# The outermost tracing context owns the span file.  On exit, it
+# writes timeline.json and trace.json (Chrome trace events) to the
+# work dir and prints the slowest spans.
+class tracing:
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        self.owner = False
+
+    def __enter__(self):
+        global _span_file
+
+        if _span_file is None:
+            _span_file = make_temp_file(prefix="skewer-spans-", suffix=".jsonl")
+            self.owner = True
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _span_file
+
+        if not self.owner:
+            return
+
+        try:
+            spans = read_spans(_span_file)
+            write_trace_files(spans, self.work_dir)
+            print_slowest_spans(spans)
+
+            if _history is not None:
+                _history.add_spans(spans)
+        finally:
+            remove(_span_file, quiet=True)
+            _span_file = None
+
+def read_spans(span_file, offset=0):
+    with open(span_file) as f:
+        f.seek(offset)
+        return [json.loads(x) for x in f]
+
+def write_trace_files(spans, work_dir):
+    spans = sorted(spans, key=lambda x: x["start"])
+    start_time = spans[0]["start"] if spans else 0
+
+    timeline = [dict(x, offset=x["start"] - start_time) for x in spans]
+
+    trace_events = [{
+        "name": x["name"],
+        "cat": x["category"],
+        "ph": "X",
+        "ts": int(x["start"] * 1_000_000),
+        "dur": int(x["duration"] * 1_000_000),
+        "pid": x["pid"],
+        "tid": x["pid"],
+        "args": dict(x["args"], failed=x["failed"]),
+    } for x in spans]
+
+    write_json(join(work_dir, "timeline.json"), timeline)
+    write_json(join(work_dir, "trace.json"), {"traceEvents": trace_events, "displayTimeUnit": "ms"})
+
+    notice(f"Wrote the timeline and trace files to '{work_dir}'")
+
+def print_slowest_spans(spans, count=10):
+    spans = [x for x in spans if x["category"] not in ("run", "step", "site")]
+    spans = sorted(spans, key=lambda x: x["duration"], reverse=True)[:count]
+
+    if not spans:
+        return
+
+    print()
+    print("Slowest operations:")
+    print()
+
+    for x in spans:
+        site = f" (site '{x['args']['site']}')" if "site" in x["args"] else ""
+        print(f"  {format_duration(x['duration'], align=True):>6}  {x['category']:<8} {x['name']}{site}")
+
+    print()
+
+_cassette = None
+_current_step_number = contextvars.ContextVar("skewer_current_step_number", default=None)
+
+# Records the results of the commands, resource queries, and awaits of
+# a run to a file of JSON lines, or replays them from the file without
+# running anything.  Results are keyed by site, step, kind, and key, and
+# repeated calls with the same key get the recorded results in order.
+class cassette:
+    def __init__(self, file, mode, kubeconfigs=[]):
+        assert mode in ("record", "replay"), mode
+
+        self.file = file
+        self.mode = mode
+        self.kubeconfigs = kubeconfigs
+        self.entries = dict()
+
+    def __enter__(self):
+        global _cassette
+
+        assert _cassette is None
+
+        if self.mode == "record":
+            notice(f"Recording to cassette '{self.file}'")
+            write(self.file, json.dumps({"kubeconfigs": self.kubeconfigs}) + "\n")
+        else:
+            notice(f"Replaying from cassette '{self.file}'")
+
+            header, *entries = [json.loads(x) for x in read_lines(self.file)]
+
+            self.kubeconfigs = header["kubeconfigs"]
+
+            for entry in entries:
+                key = entry["site"], entry["step"], entry["kind"], entry["key"]
+                self.entries.setdefault(key, list()).append(entry)
+
+        _cassette = self
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _cassette
+        _cassette = None
+
+    def call(self, kind, key, function):
+        site = get_current_site()
+        site = site.name if site is not None else None
+        step_number = _current_step_number.get()
+
+        if self.mode == "replay":
+            try:
+                entries = self.entries[(site, step_number, kind, key)]
+            except KeyError:
+                fail(f"The cassette has no result for {kind} '{key}' (site {site}, step {step_number})")
+
+            entry = entries.pop(0) if len(entries) > 1 else entries[0]
+
+            if "error" in entry:
+                fail(entry["error"])
+
+            return entry["result"]
+
+        start_time = get_time()
+        entry = {"site": site, "step": step_number, "kind": kind, "key": key}
+
+        try:
+            entry["result"] = function()
+        except PlanoError as e:
+            entry["error"] = str(e)
+            raise
+        finally:
+            entry["duration"] = get_time() - start_time
+
+            with open(self.file, "a") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+
+        return entry["result"]
+
+def recorded(kind, key, function):
+    if _cassette is None:
+        return function()
+
+    return _cassette.call(kind, key, function)
+
+def is_replaying():
+    return _cassette is not None and _cassette.mode == "replay"
+
+_history = None
+
+# The durations of the awaits and commands of past runs, kept per
+# skewer file in the cache dir.  Spans from the tracing context are
+# added on exit, except for failed ones, and the latest samples for
+# each site and operation are saved.  Inside an outer tracing context,
+# as with Minikube, the spans written since entering are read from
+# the span file instead.
+#
+# With adaptive timeouts, an operation with enough samples gets a
+# timeout of a high percentile of its durations times a safety
+# factor.  The timeout is never below the floor or above the default,
+# so a broken run fails in minutes instead of idling.
+class history:
+    max_samples = 20
+    min_samples = 3
+    percentile = 0.95
+    factor = 3
+    floor = 30
+
+    def __init__(self, file, adaptive=True):
+        self.file = file
+        self.adaptive = adaptive
+        self.durations = dict()
+        self.span_offset = None
+
+    def __enter__(self):
+        global _history
+
+        assert _history is None
+
+        if is_file(self.file):
+            try:
+                self.durations = read_json(self.file)
+            except ValueError:
+                warning(f"Ignoring the unreadable history file '{self.file}'")
+
+        if _span_file is not None:
+            self.span_offset = get_file_size(_span_file)
+
+        _history = self
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _history
+        _history = None
+
+        if _span_file is not None and self.span_offset is not None:
+            self.add_spans(read_spans(_span_file, self.span_offset))
+
+        write_json(self.file, self.durations)
+
+    def add_spans(self, spans):
+        for x in spans:
+            if x["category"] not in ("await", "command") or x["failed"]:
+                continue
+
+            key = get_history_key(x["args"].get("key", x["name"]), x["args"].get("site"))
+            durations = self.durations.setdefault(key, list())
+            durations.append(round(x["duration"], 3))
+
+            del durations[:-self.max_samples]
+
+    def get_timeout(self, key, default=None):
+        durations = sorted(self.durations.get(key, []))
+
+        if len(durations) < self.min_samples:
+            return default
+
+        timeout = max(self.floor, get_percentile(durations, self.percentile) * self.factor)
+
+        if default is not None:
+            timeout = min(default, timeout)
+
+        return timeout
+
+# The nearest-rank percentile of sorted values
+def get_percentile(values, percentile):
+    return values[max(0, math.ceil(percentile * len(values)) - 1)]
+
+def get_history_file(skewer_file):
+    return join(get_cache_dir(), "history", f"{hash_strings(get_absolute_path(skewer_file))}.json")
+
+def get_history_key(name, site_name):
+    return f"{site_name}: {name}"
+
+# Returns the timeout for an await or command on a site.  Without
+# adaptive timeouts or enough history, it returns the default.
+def get_timeout(name, site_name, default=None):
+    if _history is None or not _history.adaptive or is_replaying():
+        return default
+
+    timeout = _history.get_timeout(get_history_key(name, site_name), default)
+
+    if timeout != default:
+        debug(f"Using a timeout of {format_duration(timeout)} for '{name}' (site '{site_name}') from past runs")
+
+    return timeout
+
+# Runs a step command and returns its exit code.  When recording, the
+# output is captured so it can be replayed.  A command still running
+# after the timeout is stopped, and the run fails.  With check, a
+# command that fails raises PlanoProcessError, or, with a cassette,
+# fails the run.
+def run_step_command(command, key, timeout=None, check=False):
+    if _cassette is None:
+        proc = run_shell_command(command, timeout=timeout)
+
+        if check and proc.exit_code > 0:
+            raise PlanoProcessError(proc)
+
+        return proc.exit_code
+
+    def run_and_capture():
+        with temp_file() as output_file:
+            exit_code = run_shell_command(command, output=output_file, timeout=timeout).exit_code
+            output = read(output_file)
+
+        return exit_code, output
+
+    if is_replaying():
+        notice(f"Replaying command '{key}'")
+
+    exit_code, output = recorded("run", key, run_and_capture)
+
+    if is_replaying():
+        print(output, end="")
+
+    if check and exit_code > 0:
+        fail(f"Command '{command}' returned non-zero exit status {exit_code}.")
+
+    return exit_code
+
+# Runs a shell command with the env of the current site.  If there is
+# an output file, the output goes to it and is copied to the console
+# as it arrives.  Commands often leave background processes holding
+# their output open, so the copying stops when the command exits.
+def run_shell_command(command, output=None, timeout=None):
+    if output is None and timeout is None:
+        return run(command, shell=True, env=get_site_env(), check=False)
+
+    if timeout is None:
+        notice(f"Running command '{command}'")
+    else:
+        notice(f"Running command '{command}' (timeout {format_duration(timeout)})")
+
+    proc = start(command, shell=True, env=get_site_env(), output=output, quiet=True)
+    deadline = None if timeout is None else get_time() + timeout
+
+    with open(output, "rb") if output is not None else contextlib.nullcontext() as output_file:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        def copy_output():
+            if output_file is not None:
+                print(decoder.decode(output_file.read()), end="", flush=True)
+
+        while True:
+            try:
+                proc.wait(timeout=0.1)
+                break
+            except subprocess.TimeoutExpired:
+                copy_output()
+
+            if deadline is not None and get_time() > deadline:
+                stop(proc, quiet=True)
+                copy_output()
+                fail(f"Command '{command}' timed out after {format_duration(timeout)}")
+
+        copy_output()
+
+    return wait(proc, quiet=True)
+
+# Returns true when the condition is met.  Returns false if kubectl
+# cannot wait for the condition, so the caller can fall back to
+# polling.
+def kubectl_wait(resource, condition, timeout=300):
+    def wait():
+        proc = run(f"{kubectl()} wait --for '{condition}' --timeout {max(1, int(timeout))}s {resource}",
+                   stdout=DEVNULL, stderr=subprocess.PIPE, env=get_site_env(), check=False, quiet=True)
+
+        if proc.exit_code == 0:
+            return True
+
+        if "timed out waiting" in proc.stderr_result:
+            fail(f"Timed out waiting for {resource}")
+
+        return False
+
+    return recorded("kubectl_wait", f"{resource} {condition}", wait)
+
+# Poll with exponential backoff, like Plano's await_port
+def await_condition(condition, timeout, timeout_message, max_period=2):
+    start_time = get_time()
+    period = 0.03125
+
+    while not condition():
+        if get_time() - start_time > timeout:
+            fail(timeout_message() if callable(timeout_message) else timeout_message)
+
+        if not is_replaying():
+            sleep(period, quiet=True)
+        period = min(max_period, period * 2)
 
 def await_resource(resource, timeout=300):
     assert "/" in resource, resource
 
     start_time = get_time()
 
-    while True:
-        notice(f"Waiting for {resource} to become available")
+    notice(f"Waiting for {resource} to become available")
 
-        if resource_exists(resource):
-            break
+    if not kubectl_wait(resource, "create", timeout=timeout):
+        await_condition(lambda: resource_exists(resource), timeout, f"Timed out waiting for {resource}")
 
-        if get_time() - start_time > timeout:
-            fail(f"Timed out waiting for {resource}")
+    if resource.startswith("deployment/"):
+        timeout = max(1, int(timeout - (get_time() - start_time)))
 
-        sleep(5, quiet=True)
+        def wait():
+            run(f"{kubectl()} wait --for condition=available --timeout {timeout}s {resource}",
+                env=get_site_env(), quiet=True, stash=True)
+            return True
 
-    if resource.startswith("deployment/"):
         try:
-            run(f"kubectl wait --for condition=available --timeout {timeout}s {resource}", quiet=True, stash=True)
+            recorded("kubectl_wait", f"{resource} condition=available", wait)
         except:
-            run(f"kubectl logs {resource}")
+            run_step_command(f"{kubectl()} logs {resource}", f"kubectl logs {resource}")
             raise
 
+# The short names and plurals kubectl accepts for the kinds commonly
+# awaited, mapped to the kind as it appears in the 'kind' field
+_kind_aliases = {
+    "configmap": ("cm", "configmaps"),
+    "cronjob": ("cj", "cronjobs"),
+    "daemonset": ("ds", "daemonsets"),
+    "deployment": ("deploy", "deployments"),
+    "endpoints": ("ep",),
+    "ingress": ("ing", "ingresses"),
+    "job": ("jobs",),
+    "namespace": ("ns", "namespaces"),
+    "persistentvolumeclaim": ("pvc", "persistentvolumeclaims"),
+    "pod": ("po", "pods"),
+    "replicaset": ("rs", "replicasets"),
+    "route": ("routes",),
+    "secret": ("secrets",),
+    "service": ("svc", "services"),
+    "serviceaccount": ("sa", "serviceaccounts"),
+    "statefulset": ("sts", "statefulsets"),
+}
+
+_kinds = {alias: kind for kind, aliases in _kind_aliases.items() for alias in (kind,) + aliases}
+
+# Returns the lower-case kind for a kind as given to kubectl.  Other
+# kinds, such as custom resources, lose any API group and may match in
+# their singular or plural form.
+def get_resource_kinds(kind):
+    kind = kind.lower()
+
+    if kind in _kinds:
+        return {_kinds[kind]}
+
+    kind = kind.split(".", 1)[0]
+
+    return {kind, kind.removesuffix("s"), kind.removesuffix("es")}
+
+# Waits for all the resources at once.  Each poll lists all the
+# needed kinds in one query and checks the pending resources against
+# the result.  Deployments must also have the Available condition.
+def await_resources(resources, timeout=300):
+    for resource in resources:
+        assert "/" in resource, resource
+
+    notice(f"Waiting for {', '.join(resources)} to become available")
+
+    kinds = [x.split("/", 1)[0].lower() for x in resources]
+    kinds = ",".join(dict.fromkeys(_kinds.get(x, x) for x in kinds))
+    pending = list(resources)
+
+    def poll():
+        available = recorded("get_resources", kinds, lambda: get_available_resources(kinds))
+
+        for resource in list(pending):
+            kind, name = resource.split("/", 1)
+
+            if any(f"{x}/{name}" in available for x in get_resource_kinds(kind)):
+                pending.remove(resource)
+
+        return not pending
+
+    try:
+        await_condition(poll, timeout, lambda: f"Timed out waiting for {', '.join(pending)}")
+    except:
+        for resource in pending:
+            kind, name = resource.split("/", 1)
+
+            if "deployment" in get_resource_kinds(kind):
+                run_step_command(f"{kubectl()} logs deployment/{name}", f"kubectl logs deployment/{name}")
+
+        raise
+
+# Returns the names, in the form 'kind/name', of the resources of the
+# given kinds that exist and, for deployments, are available.  If the
+# query fails, it returns none, so the caller polls again.
+def get_available_resources(kinds):
+    proc = run(f"{kubectl()} get {kinds} -o json", stdout=subprocess.PIPE, stderr=DEVNULL, env=get_site_env(),
+               check=False, quiet=True)
+
+    if proc.exit_code != 0:
+        return list()
+
+    data = parse_json(proc.stdout_result)
+    available = list()
+
+    for item in data.get("items", []):
+        kind = item["kind"].lower()
+
+        if kind == "deployment":
+            conditions = item.get("status", {}).get("conditions", [])
+
+            if not any(x["type"] == "Available" and x["status"] == "True" for x in conditions):
+                continue
+
+        available.append(f"{kind}/{item['metadata']['name']}")
+
+    return available
+
 def await_ingress(service, timeout=300):
     assert service.startswith("service/"), service
 
@@ -70,20 +749,16 @@ def await_ingress(service, timeout=300):
 
     await_resource(service, timeout=timeout)
 
-    while True:
-        notice(f"Waiting for hostname or IP from {service} to become available")
-
-        json = get_resource_json(service, ".status.loadBalancer.ingress")
-
-        if json != "":
-            break
+    notice(f"Waiting for hostname or IP from {service} to become available")
 
-        if get_time() - start_time > timeout:
-            fail(f"Timed out waiting for hostnmae or external IP for {service}")
+    jsonpath = ".status.loadBalancer.ingress"
+    timeout_message = f"Timed out waiting for hostname or external IP for {service}"
+    timeout = timeout - (get_time() - start_time)
 
-        sleep(5, quiet=True)
+    if not kubectl_wait(service, f"jsonpath={{{jsonpath}}}", timeout=timeout):
+        await_condition(lambda: get_resource_json(service, jsonpath) != "", timeout, timeout_message)
 
-    data = parse_json(json)
+    data = parse_json(get_resource_json(service, jsonpath))
 
     if len(data):
         if "hostname" in data[0]:
@@ -104,106 +779,647 @@ def await_http_ok(service, url_template, user=None, password=None, timeout=300):
     url = url_template.format(ip)
     insecure = url.startswith("https")
 
-    while True:
-        notice(f"Waiting for HTTP OK from {url}")
+    notice(f"Waiting for HTTP OK from {url}")
 
+    def http_ok():
         try:
             http_get(url, insecure=insecure, user=user, password=password, quiet=True)
         except PlanoError:
-            if get_time() - start_time > timeout:
-                fail(f"Timed out waiting for HTTP OK from {url}")
+            return False
 
-            sleep(5, quiet=True)
-        else:
-            break
+        return True
+
+    await_condition(lambda: recorded("http_get", url, http_ok), timeout - (get_time() - start_time),
+                    f"Timed out waiting for HTTP OK from {url}")
 
-def await_console_ok():
-    await_resource("secret/skupper-console-users")
+def await_console_ok(timeout=300):
+    start_time = get_time()
+
+    await_resource("secret/skupper-console-users", timeout=timeout)
 
     password = get_resource_json("secret/skupper-console-users", ".data.admin")
     password = base64_decode(password)
 
-    await_http_ok("service/skupper", "https://{}:8010/", user="admin", password=password)
+    await_http_ok("service/skupper", "https://{}:8010/", user="admin", password=password,
+                  timeout=timeout - (get_time() - start_time))
+
+# Sends GET requests to the URL from concurrent threads until the
+# duration is up.  Each thread keeps its own connection open between
+# requests.  Failed requests and responses other than 2xx count as
+# errors.  Returns the request rate and the latency percentiles in
+# milliseconds.
+def benchmark_http(url, duration=10, concurrency=10, timeout=10):
+    import http.client
+    import ssl
+
+    parsed_url = parse_url(url)
+    path = parsed_url.path or "/"
+
+    if parsed_url.query:
+        path = f"{path}?{parsed_url.query}"
+
+    # The example services use self-signed certificates
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+
+    def connect():
+        if parsed_url.scheme == "https":
+            return http.client.HTTPSConnection(parsed_url.hostname, parsed_url.port, timeout=timeout, context=context)
+
+        return http.client.HTTPConnection(parsed_url.hostname, parsed_url.port, timeout=timeout)
+
+    notice(f"Benchmarking {url} for {format_duration(duration)} ({concurrency} concurrent connections)")
+
+    latencies = [list() for i in range(concurrency)]
+    errors = [0] * concurrency
+
+    def send_requests(index):
+        connection = None
+
+        while get_time() < deadline:
+            request_start = get_time()
+
+            try:
+                if connection is None:
+                    connection = connect()
+
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+            except (http.client.HTTPException, OSError):
+                errors[index] += 1
+
+                if connection is not None:
+                    connection.close()
+                    connection = None
+
+                # Don't spin while the server is unreachable
+                sleep(0.1, quiet=True)
+                continue
+
+            if 200 <= response.status < 300:
+                latencies[index].append(get_time() - request_start)
+            else:
+                errors[index] += 1
+
+        if connection is not None:
+            connection.close()
+
+    start_time = get_time()
+    deadline = start_time + duration
+    threads = [threading.Thread(target=send_requests, args=(i,), daemon=True) for i in range(concurrency)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed_time = get_time() - start_time
+    latencies = sorted(x for y in latencies for x in y)
+
+    if not latencies:
+        fail(f"No successful requests to {url} ({sum(errors)} errors)")
+
+    return {
+        "url": url,
+        "duration": round(elapsed_time, 3),
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "requests_per_second": round(len(latencies) / elapsed_time, 1),
+        "latency_ms": {f"p{x}": round(get_percentile(latencies, x / 100) * 1000, 3) for x in (50, 95, 99)},
+    }
+
+# Runs a benchmark_http command.  The URL may be a template for the
+# external IP of a service, as for await_http_ok.  The result is
+# printed and added to benchmarks.json in the work dir.
+def run_http_benchmark(options, site_name, work_dir):
+    url = options["url"]
+
+    # The wait shares its history with await_ingress commands
+    if "service" in options:
+        name = f"await_ingress {options['service']}"
+
+        with span(name, "await", site=site_name):
+            url = url.format(await_ingress(options["service"], timeout=get_timeout(name, site_name, 300)))
+
+    def run_benchmark():
+        return benchmark_http(url, duration=options.get("duration", 10), concurrency=options.get("concurrency", 10))
+
+    result = dict(recorded("benchmark_http", url, run_benchmark), site=site_name, step=_current_step_number.get())
 
-def run_steps(skewer_file, kubeconfigs=[], work_dir=None, debug=False):
+    print_benchmark_result(result)
+
+    # Sites in parallel workers may add results at the same time
+    results_file = join(work_dir, "benchmarks.json")
+    lock = acquire_file_lock(f"{results_file}.lock")
+
+    try:
+        results = read_json(results_file) if is_file(results_file) else list()
+        results.append(result)
+        write_json(results_file, results)
+    finally:
+        release_file_lock(lock)
+
+    return result
+
+def print_benchmark_result(result):
+    latency = ", ".join(f"{k} {v:.1f} ms" for k, v in result["latency_ms"].items())
+
+    print()
+    print(f"Benchmark of {result['url']} (site '{result['site']}'):")
+    print()
+    print(f"  Requests:    {result['requests']} ({result['errors']} {plural('error', result['errors'])})")
+    print(f"  Throughput:  {result['requests_per_second']:.1f} requests/s")
+    print(f"  Latency:     {latency}")
+    print()
+
+# A checkpoint listing the completed steps is written to the work
+# dir after each step.  With resume, the completed steps are skipped.
+# With from_step, the steps before it are skipped.  Both leave the
+# work dir in place and defer the cleaning up step.
+def run_steps(skewer_file, kubeconfigs=[], work_dir=None, debug=False, parallel_sites=False,
+              from_step=None, resume=False, defer_cleanup=False, cleanup_only=False, background_cleanup=False,
+              adaptive_timeouts=True):
     notice(f"Running steps (skewer_file='{skewer_file}')")
 
-    check_environment()
+    if not is_replaying():
+        check_environment()
 
     model = Model(skewer_file, kubeconfigs)
     model.check()
 
+    continuing = resume or from_step is not None or cleanup_only
+
     if work_dir is None:
         work_dir = join(get_user_temp_dir(), "skewer")
-        remove(work_dir, quiet=True)
+
+        if not continuing:
+            remove(work_dir, quiet=True)
+
         make_dir(work_dir, quiet=True)
 
-    try:
-        for step in model.steps:
-            if step.name == "cleaning_up":
+    checkpoint_file = join(work_dir, "checkpoint.json")
+    completed_steps = list()
+
+    if resume:
+        completed_steps = read_checkpoint(checkpoint_file, model)
+    elif from_step is not None:
+        if not 1 <= from_step <= len(model.steps):
+            fail(f"Step {from_step} is not in the range of steps (1 to {len(model.steps)})")
+
+        completed_steps = [x.number for x in model.steps[:from_step - 1]]
+
+    if resume or from_step is not None:
+        defer_cleanup = True
+
+    def step_completed(step):
+        completed_steps.append(step.number)
+        write_checkpoint(checkpoint_file, model, completed_steps)
+
+    if not continuing:
+        await_namespace_cleanup(model)
+
+    # Replayed runs take no real time, so they leave the history alone
+    if is_replaying():
+        run_history = contextlib.nullcontext()
+    else:
+        run_history = history(get_history_file(skewer_file), adaptive=adaptive_timeouts)
+
+    with run_history, tracing(work_dir), span(f"run '{skewer_file}'", "run"):
+        try:
+            steps = [x for x in model.steps if x.name != "cleaning_up" and x.number not in completed_steps]
+
+            if cleanup_only:
+                steps = []
+
+            for step in model.steps:
+                if step.number in completed_steps:
+                    notice(f"Skipping {step} (completed)")
+
+            if any(x.depends_on for x in steps):
+                run_step_graph(model, steps, work_dir, parallel_sites=parallel_sites, step_completed=step_completed)
+            else:
+                for step in steps:
+                    run_step(model, step, work_dir, parallel_sites=parallel_sites)
+                    step_completed(step)
+
+            if "SKEWER_DEMO" in ENV:
+                pause_for_demo(model)
+        except:
+            if debug:
+                print_debug_output(model, work_dir)
+
+            raise
+        finally:
+            try:
+                if defer_cleanup:
+                    notice("Deferring the cleaning up step")
+                else:
+                    for step in model.steps:
+                        if step.name == "cleaning_up":
+                            if background_cleanup:
+                                run_background_cleanup(model, step, work_dir)
+                            else:
+                                run_step(model, step, work_dir, check=False, parallel_sites=parallel_sites)
+
+                            break
+
+                    remove(checkpoint_file, quiet=True)
+            finally:
+                stop_kube_clients()
+
+# Instead of waiting on the cleanup commands for Kubernetes sites,
+# start deleting their namespaces and return.  The cleanup commands
+# for other sites run as usual.
+def run_background_cleanup(model, step, work_dir):
+    notice(f"Running {step} in the background")
+
+    _current_step_number.set(step.number)
+
+    with span(f"{step} (background)", "step", step=step.number):
+        for site_name, commands in step.commands:
+            site = model.get_site(site_name)
+
+            if site.platform != "kubernetes":
+                run_site_commands(model, site_name, commands, work_dir, check=False)
                 continue
 
-            run_step(model, step, work_dir)
+            if is_replaying():
+                continue
 
-        if "SKEWER_DEMO" in ENV:
-            pause_for_demo(model)
-    except:
-        if debug:
-            print_debug_output(model)
+            run(f"kubectl delete namespace {site.namespace} --ignore-not-found --wait=false",
+                stdout=DEVNULL, env=site.get_env(), check=False, quiet=True)
 
-        raise
+# A background cleanup leaves the namespaces terminating.  Before the
+# steps create them again, wait for them to go.  The lock makes
+# concurrent runs on the same machine check one at a time.
+def await_namespace_cleanup(model, timeout=300):
+    sites = [x for _, x in model.sites if x.platform == "kubernetes"]
+
+    if not sites or is_replaying():
+        return
+
+    lock = acquire_file_lock(join(get_user_temp_dir(), "skewer-namespaces.lock"))
+
+    try:
+        for site in sites:
+            with site:
+                def is_deleted():
+                    proc = run(f"{kubectl()} get namespace {site.namespace} -o jsonpath={{.status.phase}}",
+                               stdout=subprocess.PIPE, stderr=DEVNULL, env=get_site_env(), check=False, quiet=True)
+
+                    return proc.exit_code != 0 or proc.stdout_result.strip() != "Terminating"
+
+                if is_deleted():
+                    continue
+
+                notice(f"Waiting for namespace '{site.namespace}' from an earlier run to be deleted")
+
+                await_condition(is_deleted, timeout,
+                                f"Timed out waiting for namespace '{site.namespace}' to be deleted")
     finally:
-        for step in model.steps:
-            if step.name == "cleaning_up":
-                run_step(model, step, work_dir, check=False)
-                break
+        release_file_lock(lock)
+
+def read_checkpoint(checkpoint_file, model):
+    if not is_file(checkpoint_file):
+        fail(f"There is no checkpoint to resume from ('{checkpoint_file}')")
+
+    checkpoint = read_json(checkpoint_file)
+
+    if checkpoint["skewer_file"] != get_absolute_path(model.skewer_file):
+        fail(f"The checkpoint is for a different skewer file ('{checkpoint['skewer_file']}')")
+
+    if checkpoint["step_titles"] != [x.title for x in model.steps]:
+        fail("The steps have changed since the checkpoint was written")
+
+    return checkpoint["completed_steps"]
+
+def write_checkpoint(checkpoint_file, model, completed_steps):
+    write_json(checkpoint_file, {
+        "skewer_file": get_absolute_path(model.skewer_file),
+        "step_titles": [x.title for x in model.steps],
+        "completed_steps": sorted(completed_steps),
+    })
 
-def run_step(model, step, work_dir, check=True):
+def run_step(model, step, work_dir, check=True, parallel_sites=False):
     if not step.commands:
         return
 
-    notice(f"Running {step}")
+    notice(f"Running {step}")
+
+    site_commands = list(step.commands)
+    _current_step_number.set(step.number)
+
+    with span(str(step), "step", step=step.number):
+        if parallel_sites and len(site_commands) > 1:
+            run_site_commands_in_parallel(model, step, site_commands, work_dir, check=check)
+            return
+
+        for site_name, commands in site_commands:
+            run_site_commands(model, site_name, commands, work_dir, check=check)
+
+def run_site_commands(model, site_name, commands, work_dir, check=True):
+    with model.get_site(site_name) as site, span(f"site '{site_name}'", "site", site=site_name):
+        if site.platform == "kubernetes" and not is_replaying():
+            _, client = get_current_kube_client()
+            client.set_current_namespace(site.namespace)
+
+        for command in commands:
+            if command.apply == "readme":
+                continue
+
+            if command.await_resource:
+                name = f"await_resource {command.await_resource}"
+
+                with span(name, "await", site=site_name):
+                    await_resource(command.await_resource, timeout=get_timeout(name, site_name, 300))
+
+            if command.await_resources:
+                name = f"await_resources {' '.join(command.await_resources)}"
+
+                with span(name, "await", site=site_name):
+                    await_resources(command.await_resources, timeout=get_timeout(name, site_name, 300))
+
+            if command.await_ingress:
+                name = f"await_ingress {command.await_ingress}"
+
+                with span(name, "await", site=site_name):
+                    await_ingress(command.await_ingress, timeout=get_timeout(name, site_name, 300))
+
+            if command.await_http_ok:
+                name = f"await_http_ok {command.await_http_ok[0]}"
+
+                with span(name, "await", site=site_name):
+                    await_http_ok(*command.await_http_ok, timeout=get_timeout(name, site_name, 300))
+
+            if command.await_console_ok:
+                name = "await_console_ok"
+
+                with span(name, "await", site=site_name):
+                    await_console_ok(timeout=get_timeout(name, site_name, 300))
+
+            if command.await_port:
+                name = f"await_port {command.await_port}"
+                timeout = get_timeout(name, site_name, 300)
+
+                with span(name, "await", site=site_name):
+                    recorded("await_port", command.await_port, lambda: await_port(command.await_port, timeout=timeout))
+
+            if command.benchmark_http:
+                with span(f"benchmark_http {command.benchmark_http['url']}", "benchmark", site=site_name):
+                    run_http_benchmark(command.benchmark_http, site_name, work_dir)
+
+            if command.run:
+                name = command.run.splitlines()[0]
+                command_string = command.run.replace("~", work_dir)
+
+                # The history key is the whole command, since commands
+                # can share a first line
+                with span(name, "command", site=site_name, key=command.run):
+                    exit_code = run_step_command(command_string, command.run,
+                                                 timeout=get_timeout(command.run, site_name),
+                                                 check=check and not command.expect_failure)
+
+                if command.expect_failure and exit_code == 0:
+                    fail("A command expected to fail did not fail")
+
+# Steps with 'depends_on' wait only for the named steps.  Steps
+# without it wait for all the steps before them.  Each step runs in
+# its own worker process as soon as the steps it depends on are done.
+def run_step_graph(model, steps, work_dir, check=True, parallel_sites=False, step_completed=None):
+    import multiprocessing.connection
+
+    output_dir = make_dir(join(work_dir, "output"), quiet=True)
+    dependencies = dict()
+
+    for i, step in enumerate(steps):
+        if step.depends_on:
+            dependencies[step.number] = {x.number for x in steps if x.name in step.depends_on}
+        else:
+            dependencies[step.number] = {x.number for x in steps[:i]}
+
+    pending_steps = list(steps)
+    running_steps = dict()
+    completed_steps = set()
+    failed_steps = list()
+
+    try:
+        while pending_steps or running_steps:
+            if not failed_steps:
+                for step in list(pending_steps):
+                    if dependencies[step.number] <= completed_steps:
+                        output_file = join(output_dir, f"step-{step.number}.txt")
+                        worker = _start_worker(run_step, (model, step, work_dir, check, parallel_sites), output_file)
+
+                        running_steps[worker.sentinel] = step, worker, output_file
+                        pending_steps.remove(step)
+
+            if not running_steps:
+                break
+
+            for sentinel in multiprocessing.connection.wait(list(running_steps)):
+                step, worker, output_file = running_steps.pop(sentinel)
+                worker.join()
+
+                _print_worker_output(f"step {step.number}", output_file)
+
+                if worker.exitcode == 0:
+                    completed_steps.add(step.number)
+
+                    if step_completed is not None:
+                        step_completed(step)
+                else:
+                    failed_steps.append(step)
+    finally:
+        for _, worker, _ in running_steps.values():
+            worker.terminate()
+            worker.join()
+
+    if failed_steps:
+        fail(capitalize(f"{', '.join(map(str, failed_steps))} failed"))
+
+# Each site gets its own worker process, so the working env and
+# logging context of one site cannot leak into another.  Output is
+# buffered per site and printed once all the sites are done.
+def run_site_commands_in_parallel(model, step, site_commands, work_dir, check=True):
+    output_dir = make_dir(join(work_dir, "output"), quiet=True)
+    workers = list()
+
+    try:
+        for site_name, commands in site_commands:
+            output_file = join(output_dir, f"step-{step.number}-{site_name}.txt")
+            worker = _start_worker(run_site_commands, (model, site_name, commands, work_dir, check), output_file)
+
+            workers.append((site_name, worker, output_file))
+
+        for _, worker, _ in workers:
+            worker.join()
+    finally:
+        for _, worker, _ in workers:
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+
+    failed_sites = list()
+
+    for site_name, worker, output_file in workers:
+        _print_worker_output(site_name, output_file)
+
+        if worker.exitcode != 0:
+            failed_sites.append(site_name)
+
+    if failed_sites:
+        fail(f"{step} failed for {plural('site', len(failed_sites))} {', '.join(failed_sites)}")
+
+def _start_worker(function, args, output_file):
+    import multiprocessing
+
+    flush()
+
+    worker = multiprocessing.get_context("fork").Process(target=_run_worker, args=(function, args, output_file))
+    worker.start()
+
+    return worker
+
+def _run_worker(function, args, output_file):
+    with output_redirected(output_file, quiet=True):
+        try:
+            function(*args)
+        except PlanoError as e:
+            error(str(e))
+            exit(1)
+        except Exception as e:
+            error(e)
+            exit(1)
+        finally:
+            stop_kube_clients()
+
+def _print_worker_output(label, output_file):
+    label = cformat(f"{label}:", color="yellow")
+
+    for line in read_lines(output_file):
+        print(f"{label} {line}", end="")
+
+    flush()
+
+# Test many example directories at once.  Each example gets its own
+# worker process, Minikube profile, work dir, and tunnel.
+def run_farm(example_dirs, jobs=4, output_dir=None):
+    import multiprocessing.connection
+
+    assert jobs >= 1, jobs
+
+    notice(f"Running the example farm (examples={len(example_dirs)}, jobs={jobs})")
+
+    if output_dir is None:
+        output_dir = join(get_user_temp_dir(), "skewer-farm")
+
+    remove(output_dir, quiet=True)
+    make_dir(output_dir, quiet=True)
+
+    pending_examples = [(i, get_absolute_path(x)) for i, x in enumerate(example_dirs, 1)]
+    running_examples = dict()
+    results = dict()
+
+    try:
+        while pending_examples or running_examples:
+            while pending_examples and len(running_examples) < jobs:
+                i, example_dir = pending_examples.pop(0)
+                profile = f"skewer-farm-{i}"
+                output_file = join(output_dir, f"{i}-{get_base_name(example_dir)}.txt")
+                worker = _start_worker(_run_farm_example, (example_dir, profile), output_file)
+
+                notice(f"Started example {i} '{example_dir}' (profile '{profile}')")
+
+                running_examples[worker.sentinel] = i, example_dir, worker, output_file, get_time()
+
+            for sentinel in multiprocessing.connection.wait(list(running_examples)):
+                i, example_dir, worker, output_file, start_time = running_examples.pop(sentinel)
+                worker.join()
+
+                results[i] = example_dir, worker.exitcode == 0, get_time() - start_time, output_file
+
+                notice(f"Finished example {i} '{example_dir}' ({'PASSED' if results[i][1] else 'FAILED'})")
+    finally:
+        for _, _, worker, _, _ in running_examples.values():
+            worker.terminate()
+            worker.join()
+
+    failed = [x for x in results.values() if not x[1]]
+
+    for example_dir, passed, duration, output_file in failed:
+        _print_worker_output(get_base_name(example_dir), output_file)
+
+    print()
+    print("Farm summary:")
+    print()
+
+    for i, result in sorted(results.items()):
+        example_dir, passed, duration, output_file = result
+        status = cformat("PASSED", color="green") if passed else cformat("FAILED", color="red", bright=True)
+
+        print(f"  {status}  {format_duration(duration, align=True):>6}  {example_dir}  ({output_file})")
+
+    print()
+    print(f"  Total: {len(results)}, failed: {len(failed)}")
+    print()
+
+    if failed:
+        fail(f"{len(failed)} of {len(results)} {plural('example', len(results))} failed")
 
-    for site_name, commands in step.commands:
-        with dict(model.sites)[site_name] as site:
-            if site.platform == "kubernetes":
-                run(f"kubectl config set-context --current --namespace {site.namespace}", stdout=DEVNULL, quiet=True)
+def _run_farm_example(example_dir, profile):
+    with working_dir(example_dir):
+        generate_readme("skewer.yaml", make_temp_file())
 
-            for command in commands:
-                if command.apply == "readme":
-                    continue
+        with Minikube("skewer.yaml", profile=profile) as mk:
+            run_steps("skewer.yaml", kubeconfigs=mk.kubeconfigs, work_dir=mk.work_dir)
+
+# Blocks until no other process holds the lock
+def acquire_file_lock(lock_file):
+    make_parent_dir(lock_file, quiet=True)
 
-                if command.await_resource:
-                    await_resource(command.await_resource)
+    fd = os.open(lock_file, os.O_RDWR | os.O_CREAT)
 
-                if command.await_ingress:
-                    await_ingress(command.await_ingress)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        notice(f"Waiting for another run to release the lock on '{lock_file}'")
+        fcntl.flock(fd, fcntl.LOCK_EX)
 
-                if command.await_http_ok:
-                    await_http_ok(*command.await_http_ok)
+    return fd
 
-                if command.await_console_ok:
-                    await_console_ok()
+def release_file_lock(fd):
+    os.close(fd)
 
-                if command.await_port:
-                    await_port(command.await_port, timeout=300)
+def is_process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
 
-                if command.run:
-                    proc = run(command.run.replace("~", work_dir), shell=True, check=False)
+    return True
 
-                    if command.expect_failure:
-                        if proc.exit_code == 0:
-                            fail("A command expected to fail did not fail")
+# The PID of a tunnel from an earlier run may since have gone to an
+# unrelated process, so check the command line as well
+def is_tunnel_running(pid, profile):
+    if not is_process_running(pid):
+        return False
 
-                        continue
+    proc = run(["ps", "-o", "command=", "-p", str(pid)], stdout=subprocess.PIPE, stderr=DEVNULL, check=False,
+               quiet=True)
+    args = proc.stdout_result.split()
 
-                    if check and proc.exit_code > 0:
-                        raise PlanoProcessError(proc)
+    return any(get_base_name(x) == "minikube" for x in args) and "tunnel" in args and profile in args
 
 def pause_for_demo(model):
     notice("Pausing for demo time")
 
-    first_site = [x for _, x in model.sites][0]
+    _, first_site = model.sites[0]
     console_url = None
     password = None
     frontend_url = None
@@ -250,51 +1466,306 @@ def pause_for_demo(model):
         while input("Are you done (yes)? ") != "yes": # pragma: nocover
             pass
 
-def print_debug_output(model):
+def get_debug_commands(site):
+    commands = list()
+
+    if site.platform == "kubernetes":
+        commands += [
+            "kubectl get services",
+            "kubectl get deployments",
+            "kubectl get statefulsets",
+            "kubectl get pods",
+            "kubectl get events",
+        ]
+
+    commands += [
+        "skupper version",
+        "skupper status",
+        "skupper link status",
+        "skupper service status",
+        "skupper network status",
+        "skupper debug events",
+    ]
+
+    if site.platform == "kubernetes":
+        commands += [
+            "kubectl logs deployment/skupper-router",
+            "kubectl logs deployment/skupper-service-controller",
+        ]
+
+    return commands
+
+# Runs the debug commands for all the sites at once.  Each command's
+# output is read by a thread that keeps only the last max_output_size
+# bytes, so large logs do not use unbounded memory.  Commands still
+# running after the timeout are killed.  The outputs are written to
+# separate files in the bundle dir, which is then archived.
+#
+# Returns the archive file and a list of (site name, command, output
+# file) tuples.
+def collect_debug_bundle(model, bundle_dir, timeout=30, max_output_size=1024 * 1024):
+    remove(bundle_dir, quiet=True)
+
+    jobs = list()
+
+    for _, site in model.sites:
+        with site:
+            for command in get_debug_commands(site):
+                output_file = join(bundle_dir, site.name, string_replace(command, r"\W+", "-") + ".txt")
+                tail = _OutputTail(max_output_size)
+
+                try:
+                    proc = start(command, stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 env=site.get_env(), quiet=True)
+                except PlanoError as e:
+                    tail.append(f"{e}\n".encode())
+                    jobs.append((site.name, command, output_file, None, None, tail))
+                    continue
+
+                thread = threading.Thread(target=tail.read, args=(proc.stdout,), daemon=True)
+                thread.start()
+
+                jobs.append((site.name, command, output_file, proc, thread, tail))
+
+    deadline = get_time() + timeout
+    results = list()
+
+    for site_name, command, output_file, proc, thread, tail in jobs:
+        if thread is not None:
+            thread.join(max(0, deadline - get_time()))
+
+            if thread.is_alive():
+                kill(proc, quiet=True)
+                thread.join()
+                tail.append(f"\n[Killed after {timeout} seconds]\n".encode())
+
+            proc.wait()
+
+        make_parent_dir(output_file, quiet=True)
+
+        with open(output_file, "wb") as f:
+            f.write(tail.get_output())
+
+        results.append((site_name, command, output_file))
+
+    archive_file = make_archive(bundle_dir, output_file=f"{bundle_dir}.tar.gz", quiet=True)
+
+    return archive_file, results
+
+class _OutputTail:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.chunks = collections.deque()
+        self.size = 0
+        self.dropped_size = 0
+
+    def read(self, pipe):
+        with pipe:
+            for chunk in iter(lambda: pipe.read1(65536), b""):
+                self.append(chunk)
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+
+        while self.size > self.max_size:
+            excess = self.size - self.max_size
+            first = self.chunks[0]
+
+            if len(first) <= excess:
+                self.chunks.popleft()
+                self.size -= len(first)
+                self.dropped_size += len(first)
+            else:
+                self.chunks[0] = first[excess:]
+                self.size -= excess
+                self.dropped_size += excess
+
+    def get_output(self):
+        output = b"".join(self.chunks)
+
+        if self.dropped_size:
+            output = f"[{self.dropped_size} bytes omitted]\n".encode() + output
+
+        return output
+
+def print_debug_output(model, work_dir, timeout=30, max_print_size=16 * 1024):
     print("TROUBLE!")
     print("-- Start of debug output")
 
-    for _, site in model.sites:
-        print(f"---- Debug output for site '{site.name}'")
+    archive_file, results = collect_debug_bundle(model, join(get_absolute_path(work_dir), "debug"), timeout=timeout)
+    current_site_name = None
 
-        with site:
-            if site.platform == "kubernetes":
-                run("kubectl get services", check=False)
-                run("kubectl get deployments", check=False)
-                run("kubectl get statefulsets", check=False)
-                run("kubectl get pods", check=False)
-                run("kubectl get events", check=False)
-
-            run("skupper version", check=False)
-            run("skupper status", check=False)
-            run("skupper link status", check=False)
-            run("skupper service status", check=False)
-            run("skupper network status", check=False)
-            run("skupper debug events", check=False)
+    for site_name, command, output_file in results:
+        if site_name != current_site_name:
+            print(f"---- Debug output for site '{site_name}'")
+            current_site_name = site_name
 
-            if site.platform == "kubernetes":
-                run("kubectl logs deployment/skupper-router", check=False)
-                run("kubectl logs deployment/skupper-service-controller", check=False)
+        with open(output_file, "rb") as f:
+            f.seek(max(0, get_file_size(output_file) - max_print_size))
+            output = f.read().decode("utf-8", errors="replace")
 
-    print("-- End of debug output")
+        print(f"$ {command}")
+        print(output, end="" if output.endswith("\n") else "\n")
 
+    print(f"-- End of debug output (full output in '{archive_file}')")
+
+# The generated content is cached by the hashes of the skewer file,
+# the standard steps and text, and the Skewer code, including the
+# Markdown module for the heading fragments.  Step sections are
+# cached by the hashes of their resolved data.
 def generate_readme(skewer_file, output_file):
     notice(f"Generating the readme (skewer_file='{skewer_file}', output_file='{output_file}')")
 
-    model = Model(skewer_file)
-    model.check()
+    cache_file = join(get_cache_dir(), "readmes", f"{hash_strings(get_absolute_path(skewer_file))}.json")
+    cache = read_readme_cache(cache_file)
+    input_key = hash_files(skewer_file, standard_steps_file, standard_text_file, __file__, markdown_code_file)
+    unchanged = cache.get("input_key") == input_key
 
-    out = list()
+    if unchanged and cache.get("workflow_url") == generate_workflow_url(cache.get("workflow")):
+        notice("The inputs are unchanged.  Using the cached readme.")
+
+        content = cache["content"]
+    else:
+        model = Model(skewer_file)
+        model.check()
+
+        workflow_url = generate_workflow_url(model.workflow)
+        content, step_texts = generate_readme_content(model, workflow_url, cache.get("steps", dict()))
+
+        write_json(cache_file, {
+            "input_key": input_key,
+            "workflow": model.workflow,
+            "workflow_url": workflow_url,
+            "content": content,
+            "steps": step_texts,
+        })
+
+    if is_file(output_file) and read(output_file) == content:
+        notice(f"The output file '{output_file}' is unchanged")
+        return
+
+    write(output_file, content)
+
+# Generate the readmes for all the examples under a directory.  The
+# standard steps and text are loaded and the cache directory made
+# once, before the worker processes are forked.
+def generate_readmes(dir=".", jobs=None):
+    import multiprocessing
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    assert jobs >= 1, jobs
+
+    skewer_files = find(dir, "skewer.yaml")
+    skewer_files = [x for x in skewer_files if "external" not in get_relative_path(x, dir).split(os.sep)[:-1]]
+
+    notice(f"Generating readmes (dir='{dir}', files={len(skewer_files)}, jobs={jobs})")
+
+    start_time = get_time()
+    errors = list()
+
+    get_standard_steps()
+    get_standard_text()
+
+    make_dir(join(get_cache_dir(), "readmes"), quiet=True)
+
+    with multiprocessing.get_context("fork").Pool(jobs) as pool:
+        for skewer_file, error_message, duration in pool.imap(_generate_readme_in_dir, skewer_files):
+            if error_message is None:
+                status = cformat("OK    ", color="green")
+            else:
+                status = cformat("FAILED", color="red", bright=True)
+                errors.append((skewer_file, error_message))
+
+            print(f"  {status}  {format_duration(duration, align=True):>6}  {skewer_file}")
+
+    print()
+    print(f"  Total: {len(skewer_files)}, failed: {len(errors)}, time: {format_duration(get_time() - start_time)}")
+    print()
+
+    if errors:
+        for skewer_file, error_message in errors:
+            print(f"{skewer_file}: {error_message}")
+
+        print()
 
-    def generate_workflow_url(workflow):
-        result = parse_url(workflow)
+        fail(f"{len(errors)} of {len(skewer_files)} {plural('readme', len(skewer_files))} failed to generate")
 
-        if result.scheme:
-            return workflow
+def _generate_readme_in_dir(skewer_file):
+    start_time = get_time()
+
+    try:
+        with logging_disabled(), working_dir(get_parent_dir(get_absolute_path(skewer_file)), quiet=True):
+            generate_readme("skewer.yaml", "README.md")
+    except PlanoError as e:
+        return skewer_file, str(e), get_time() - start_time
+    except Exception as e:
+        return skewer_file, f"{type(e).__name__}: {e}", get_time() - start_time
+
+    return skewer_file, None, get_time() - start_time
+
+# The offline renderer is the default.  Set github_api to use the
+# GitHub Markdown API instead.  The rendered HTML is cached by the
+# hashes of the Markdown and the renderer code.
+def render_readme(markdown_file="README.md", html_file="README.html", github_api=False):
+    from .markdown import convert_markdown
+
+    notice(f"Rendering the readme (markdown_file='{markdown_file}', html_file='{html_file}')")
+
+    markdown = read(markdown_file)
+
+    if github_api:
+        html = convert_github_markdown(markdown)
+    else:
+        cache_file = join(get_cache_dir(), "html", f"{hash_strings(get_absolute_path(markdown_file))}.json")
+        cache = read_readme_cache(cache_file)
+        input_key = hash_strings(markdown, hash_files(markdown_code_file))
+
+        if cache.get("input_key") == input_key:
+            notice("The Markdown is unchanged.  Using the cached HTML.")
+
+            html = cache["html"]
+        else:
+            html = format_github_markdown_html(convert_markdown(markdown))
+
+            write_json(cache_file, {
+                "input_key": input_key,
+                "html": html,
+            })
+
+    if is_file(html_file) and read(html_file) == html:
+        notice(f"The output file '{html_file}' is unchanged")
+        return
+
+    write(html_file, html)
+
+def read_readme_cache(cache_file):
+    try:
+        return read_json(cache_file)
+    except (OSError, ValueError):
+        return dict()
+
+def generate_workflow_url(workflow):
+    if not workflow:
+        return None
+
+    result = parse_url(workflow)
+
+    if result.scheme:
+        return workflow
 
-        owner, repo = get_github_owner_repo()
+    owner, repo = get_github_owner_repo()
 
-        return f"https://github.com/{owner}/{repo}/actions/workflows/{workflow}"
+    return f"https://github.com/{owner}/{repo}/actions/workflows/{workflow}"
+
+# Returns the readme content and the step texts by their cache keys
+def generate_readme_content(model, workflow_url, cached_step_texts={}):
+    from .markdown import get_heading_fragment
+
+    out = list()
+    step_texts = dict()
 
     def generate_step_heading(step):
         if step.numbered:
@@ -306,12 +1777,7 @@ def generate_readme(skewer_file, output_file):
         if not condition:
             return
 
-        fragment = string_replace(heading, r"[ -]", "_")
-        fragment = string_replace(fragment, r"[\W]", "")
-        fragment = string_replace(fragment, "_", "-")
-        fragment = fragment.lower()
-
-        out.append(f"* [{heading}](#{fragment})")
+        out.append(f"* [{heading}](#{get_heading_fragment(heading)})")
 
     def append_section(heading, text):
         if not text:
@@ -328,16 +1794,15 @@ def generate_readme(skewer_file, output_file):
     out.append(f"# {model.title}")
     out.append("")
 
-    if model.workflow:
-        url = generate_workflow_url(model.workflow)
-        out.append(f"[![main]({url}/badge.svg)]({url})")
+    if workflow_url:
+        out.append(f"[![main]({workflow_url}/badge.svg)]({workflow_url})")
         out.append("")
 
     if model.subtitle:
         out.append(f"#### {model.subtitle}")
         out.append("")
 
-    out.append(standard_text["example_suite"].strip())
+    out.append(get_standard_text()["example_suite"].strip())
     out.append("")
     out.append("#### Contents")
     out.append("")
@@ -357,9 +1822,18 @@ def generate_readme(skewer_file, output_file):
     append_section("Overview", model.overview)
     append_section("Prerequisites", model.prerequisites)
 
+    code_hash = hash_files(__file__, markdown_code_file)
+
     for step in model.steps:
         heading = generate_step_heading(step)
-        text = generate_readme_step(model, step)
+        key = hash_strings(json.dumps([step.data, model.data["sites"]], sort_keys=True, default=str), code_hash)
+
+        try:
+            text = cached_step_texts[key]
+        except KeyError:
+            text = generate_readme_step(model, step)
+
+        step_texts[key] = text
 
         append_section(heading, text)
 
@@ -367,7 +1841,7 @@ def generate_readme(skewer_file, output_file):
     append_section("Next steps", model.next_steps)
     append_section("About this example", model.about_this_example)
 
-    write(output_file, "\n".join(out).strip() + "\n")
+    return "\n".join(out).strip() + "\n", step_texts
 
 def generate_readme_step(model, step):
     notice(f"Generating {step}")
@@ -379,7 +1853,7 @@ def generate_readme_step(model, step):
         out.append("")
 
     for site_name, commands in step.commands:
-        site = dict(model.sites)[site_name]
+        site = model.get_site(site_name)
         outputs = list()
 
         out.append(f"_**{site.title}:**_")
@@ -426,28 +1900,28 @@ def apply_kubeconfigs(model, kubeconfigs):
 def apply_standard_steps(model):
     notice("Applying standard steps")
 
-    for step in model.steps:
-        if "standard" not in step.data:
+    for step_data in model.data["steps"]:
+        if "standard" not in step_data:
             continue
 
-        standard_step_name = step.data["standard"]
+        standard_step_name = step_data["standard"]
 
         try:
-            standard_step_data = standard_steps[standard_step_name]
+            standard_step_data = get_standard_steps()[standard_step_name]
         except KeyError:
             fail(f"Standard step '{standard_step_name}' not found")
 
-        del step.data["standard"]
+        del step_data["standard"]
 
         def apply_attribute(name, default=None):
             standard_value = standard_step_data.get(name, default)
-            value = step.data.get(name, standard_value)
+            value = step_data.get(name, standard_value)
 
             if is_string(value):
                 if standard_value is not None:
                     value = value.replace("@default@", str(nvl(standard_value, "")).strip())
 
-                for i, site in enumerate([x for _, x in model.sites]):
+                for i, (_, site) in enumerate(model.sites):
                     value = value.replace(f"@site{i}@", site.title)
 
                     if site.namespace:
@@ -455,7 +1929,7 @@ def apply_standard_steps(model):
 
                 value = value.strip()
 
-            step.data[name] = value
+            step_data[name] = value
 
         apply_attribute("name")
         apply_attribute("title")
@@ -465,23 +1939,21 @@ def apply_standard_steps(model):
 
         platform = standard_step_data.get("platform")
 
-        if "commands" not in step.data and "commands" in standard_step_data:
-            step.data["commands"] = dict()
-
-            for i, item in enumerate(dict(model.sites).items()):
-                site_name, site = item
+        if "commands" not in step_data and "commands" in standard_step_data:
+            step_data["commands"] = dict()
 
+            for i, (site_name, site) in enumerate(model.sites):
                 if platform and site.platform != platform:
                     continue
 
                 if str(i) in standard_step_data["commands"]:
                     # Is a specific index in the standard commands?
                     commands = standard_step_data["commands"][str(i)]
-                    step.data["commands"][site_name] = resolve_command_variables(commands, site)
+                    step_data["commands"][site_name] = resolve_command_variables(commands, site)
                 elif "*" in standard_step_data["commands"]:
                     # Is "*" in the standard commands?
                     commands = standard_step_data["commands"]["*"]
-                    step.data["commands"][site_name] = resolve_command_variables(commands, site)
+                    step_data["commands"][site_name] = resolve_command_variables(commands, site)
                 else:
                     # Otherwise, omit commands for this site
                     continue
@@ -529,12 +2001,14 @@ def get_github_owner_repo():
 
     fail("Unknown origin URL format")
 
+# A callable default is called to get the default value
 def object_property(name, default=None):
     def get(obj):
-        value = obj.data.get(name, default)
+        default_value = default() if callable(default) else default
+        value = obj.data.get(name, default_value)
 
         if is_string(value):
-            value = value.replace("@default@", str(nvl(default, "")).strip())
+            value = value.replace("@default@", str(nvl(default_value, "")).strip())
             value = value.strip()
 
         return value
@@ -546,30 +2020,48 @@ def check_required_attributes(obj, *names):
         if name not in obj.data:
             fail(f"{obj} is missing required attribute '{name}'")
 
+_known_attributes = dict()
+
 def check_unknown_attributes(obj):
-    known_attributes = dict(inspect.getmembers(obj.__class__, lambda x: isinstance(x, property)))
+    try:
+        known_attributes = _known_attributes[obj.__class__]
+    except KeyError:
+        properties = {x for x, _ in inspect.getmembers(obj.__class__, lambda x: isinstance(x, property))}
+        known_attributes = _known_attributes[obj.__class__] = properties | set(obj.compiled_attributes)
 
     for name in obj.data:
         if name not in known_attributes:
             fail(f"{obj} has unknown attribute '{name}'")
 
+# The model is compiled once, after the kubeconfigs and standard steps
+# are applied.  The sites, steps, and commands are tuples of objects
+# created up front, and step numbers are computed in advance.
 class Model:
+    __slots__ = "skewer_file", "data", "sites", "steps", "sites_by_name"
+    compiled_attributes = ("sites", "steps")
+
     title = object_property("title")
     subtitle = object_property("subtitle")
     workflow = object_property("workflow", "main.yaml")
     overview = object_property("overview")
-    prerequisites = object_property("prerequisites", standard_text["prerequisites"])
+    prerequisites = object_property("prerequisites", lambda: get_standard_text()["prerequisites"])
     summary = object_property("summary")
-    next_steps = object_property("next_steps", standard_text["next_steps"])
-    about_this_example = object_property("about_this_example", standard_text["about_this_example"])
+    next_steps = object_property("next_steps", lambda: get_standard_text()["next_steps"])
+    about_this_example = object_property("about_this_example", lambda: get_standard_text()["about_this_example"])
+    preload_images = object_property("preload_images", lambda: list())
 
     def __init__(self, skewer_file, kubeconfigs=[]):
         self.skewer_file = skewer_file
         self.data = read_yaml(self.skewer_file)
 
+        self.sites = tuple((name, Site(self, data, name)) for name, data in self.data["sites"].items())
+        self.sites_by_name = dict(self.sites)
+
         apply_kubeconfigs(self, kubeconfigs)
         apply_standard_steps(self)
 
+        self.steps = tuple(Step(self, data, number) for number, data in enumerate(self.data["steps"], 1))
+
     def __repr__(self):
         return f"model '{self.skewer_file}'"
 
@@ -577,23 +2069,22 @@ class Model:
         check_required_attributes(self, "title", "sites", "steps")
         check_unknown_attributes(self)
 
+        if not isinstance(self.preload_images, list) or not all(isinstance(x, str) for x in self.preload_images):
+            fail(f"{self} attribute 'preload_images' must be a list of image names")
+
         for _, site in self.sites:
             site.check()
 
         for step in self.steps:
             step.check()
 
-    @property
-    def sites(self):
-        for name, data in self.data["sites"].items():
-            yield name, Site(self, data, name)
-
-    @property
-    def steps(self):
-        for data in self.data["steps"]:
-            yield Step(self, data)
+    def get_site(self, name):
+        return self.sites_by_name[name]
 
 class Site:
+    __slots__ = "model", "data", "name"
+    compiled_attributes = ()
+
     platform = object_property("platform")
     namespace = object_property("namespace")
     env = object_property("env", dict())
@@ -608,18 +2099,25 @@ class Site:
     def __repr__(self):
         return f"site '{self.name}'"
 
+    # Entering a site makes it the current site and adds its name to
+    # the log messages, for this thread or task only.  The site env is
+    # not applied to os.environ.  Commands get it from get_site_env().
     def __enter__(self):
-        self._logging_context = logging_context(self.name)
-        self._working_env = working_env(**self.env)
+        context = logging_context(self.name)
+        context.__enter__()
 
-        self._logging_context.__enter__()
-        self._working_env.__enter__()
+        _current_sites.set(_current_sites.get() + ((self, context),))
 
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self._working_env.__exit__(exc_type, exc_value, traceback)
-        self._logging_context.__exit__(exc_type, exc_value, traceback)
+        sites = _current_sites.get()
+        _current_sites.set(sites[:-1])
+
+        sites[-1][1].__exit__(exc_type, exc_value, traceback)
+
+    def get_env(self):
+        return {k: str(v) for k, v in self.env.items()}
 
     def check(self):
         check_required_attributes(self, "platform")
@@ -648,15 +2146,21 @@ class Site:
         return self.data.get("title", capitalize(self.name))
 
 class Step:
+    __slots__ = "model", "data", "number", "commands"
+    compiled_attributes = ("commands",)
+
     numbered = object_property("numbered", True)
     name = object_property("name")
     title = object_property("title")
     preamble = object_property("preamble")
     postamble = object_property("postamble")
 
-    def __init__(self, model, data):
+    def __init__(self, model, data, number):
         self.model = model
         self.data = data
+        self.number = number
+        self.commands = tuple((site_name, tuple(Command(model, x) for x in commands))
+                              for site_name, commands in data.get("commands", dict()).items())
 
     def __repr__(self):
         return f"step {self.number} '{self.title}'"
@@ -665,34 +2169,46 @@ class Step:
         check_required_attributes(self, "title")
         check_unknown_attributes(self)
 
-        site_names = [x.name for _, x in self.model.sites]
+        if not isinstance(self.depends_on, list) or not all(is_string(x) for x in self.depends_on):
+            fail(f"{self} attribute 'depends_on' must be a step name or a list of step names")
+
+        preceding_step_names = [x.name for x in self.model.steps[:self.number - 1]]
+
+        for step_name in self.depends_on:
+            if step_name not in preceding_step_names:
+                fail(f"{self} depends on '{step_name}', which is not the name of a preceding step")
 
         for site_name, commands in self.commands:
-            if site_name not in site_names:
+            if site_name not in self.model.sites_by_name:
                 fail(f"Unknown site name '{site_name}' in commands for {self}")
 
             for command in commands:
                 command.check()
 
     @property
-    def number(self):
-        return self.model.data["steps"].index(self.data) + 1
+    def depends_on(self):
+        value = self.data.get("depends_on", [])
 
-    @property
-    def commands(self):
-        for site_name, commands in self.data.get("commands", dict()).items():
-            yield site_name, [Command(self.model, data) for data in commands]
+        if is_string(value):
+            value = [value]
+
+        return value
 
 class Command:
+    __slots__ = "model", "data"
+    compiled_attributes = ()
+
     run = object_property("run")
     expect_failure = object_property("expect_failure", False)
     apply = object_property("apply")
     output = object_property("output")
     await_resource = object_property("await_resource")
+    await_resources = object_property("await_resources")
     await_ingress = object_property("await_ingress")
     await_http_ok = object_property("await_http_ok")
     await_console_ok = object_property("await_console_ok")
     await_port = object_property("await_port")
+    benchmark_http = object_property("benchmark_http")
 
     def __init__(self, model, data):
         self.model = model
@@ -707,11 +2223,139 @@ class Command:
     def check(self):
         check_unknown_attributes(self)
 
+        if self.benchmark_http is not None:
+            if not isinstance(self.benchmark_http, dict) or "url" not in self.benchmark_http:
+                fail(f"{self} attribute 'benchmark_http' must be a map with a 'url' field")
+
+            for name in self.benchmark_http:
+                if name not in ("url", "service", "duration", "concurrency"):
+                    fail(f"{self} attribute 'benchmark_http' has unknown field '{name}'")
+
+# Returns the container images the example uses: the --image options
+# and image fields in files passed to 'kubectl apply -f' in the test
+# commands, then any listed in the skewer file's preload_images or in
+# the SKEWER_PRELOAD_IMAGES variable (separated by spaces or commas).
+# The last is meant for the Skupper images that 'skupper init' pulls.
+#
+# Images without a tag or with the 'latest' tag are left out.  The
+# kubelet pulls them again anyway, because their default pull policy
+# is Always.
+def get_preload_images(model):
+    images = list()
+
+    for step in model.steps:
+        for _, commands in step.commands:
+            for command in commands:
+                if not command.run or command.apply == "readme":
+                    continue
+
+                images += re.findall(r"--image[= ](\S+)", command.run)
+
+                for file in re.findall(r"kubectl (?:apply|create)\b.*?\s-f\s+(\S+)", command.run):
+                    if is_file(file):
+                        images += re.findall(r"^\s*-?\s*image:\s*[\"']?([^\s\"']+)", read(file), re.MULTILINE)
+
+    images += model.preload_images
+    images += ENV.get("SKEWER_PRELOAD_IMAGES", "").replace(",", " ").split()
+
+    images = [x for x in dict.fromkeys(images) if "$" not in x]
+
+    for image in images:
+        if not has_fixed_tag(image):
+            warning(f"Not preloading image '{image}': Without a tag other than 'latest', it is pulled again")
+
+    return [x for x in images if has_fixed_tag(x)]
+
+# A digest or a tag other than 'latest'.  A colon before the last
+# slash is a registry port.
+def has_fixed_tag(image):
+    if "@" in image:
+        return True
+
+    name = image.rsplit("/", 1)[-1]
+
+    return ":" in name and name.split(":", 1)[1] != "latest"
+
+# Pulls images into a cache of image archives using Docker or Podman,
+# one thread per image, while Minikube starts.  Archives less than a
+# day old are reused without pulling.  After Minikube is up, load()
+# waits for the pulls and loads the archives into the cluster.  Any
+# failure here only means the cluster pulls the image itself, so it
+# is reported as a warning.
+class _ImagePreloader:
+    max_archive_age = 24 * 60 * 60
+
+    def __init__(self, profile, images):
+        self.profile = profile
+        self.images = images
+        self.archives = dict()
+        self.threads = list()
+
+    def start(self):
+        if not self.images:
+            return self
+
+        program = which("docker") or which("podman")
+
+        if program is None:
+            notice("Not preloading images: Neither docker nor podman is available")
+            return self
+
+        notice(f"Preloading {len(self.images)} {plural('image', len(self.images))} using {get_base_name(program)}")
+
+        for image in self.images:
+            thread = threading.Thread(target=self.fetch, args=(program, image), daemon=True)
+            thread.start()
+
+            self.threads.append(thread)
+
+        return self
+
+    def fetch(self, program, image):
+        archive = join(get_cache_dir(), "images", string_replace(image, r"[^\w.-]+", "_") + ".tar")
+
+        try:
+            with span(f"fetch image '{image}'", "image"):
+                if not is_file(archive) or get_time() - os.path.getmtime(archive) > self.max_archive_age:
+                    make_parent_dir(archive, quiet=True)
+
+                    call(f"{program} pull {image}", quiet=True)
+                    call(f"{program} save -o {archive}.{os.getpid()}.tmp {image}", quiet=True)
+
+                    os.replace(f"{archive}.{os.getpid()}.tmp", archive)
+        except PlanoError as e:
+            warning(f"Failed to fetch image '{image}': {e}")
+            return
+
+        self.archives[image] = archive
+
+    def load(self):
+        for thread in self.threads:
+            thread.join()
+
+        for image in self.images:
+            if image not in self.archives:
+                continue
+
+            try:
+                with span(f"load image '{image}'", "image"):
+                    call(f"minikube image load -p {self.profile} {self.archives[image]}", quiet=True)
+            except PlanoError as e:
+                warning(f"Failed to load image '{image}' into Minikube: {e}")
+
 class Minikube:
-    def __init__(self, skewer_file):
+    def __init__(self, skewer_file, profile="skewer", work_dir=None, reuse=False, reset=True, preload_images=True,
+                 background_cleanup=False, delete=None):
         self.skewer_file = skewer_file
+        self.profile = profile
         self.kubeconfigs = list()
-        self.work_dir = join(get_user_temp_dir(), "skewer")
+        self.work_dir = nvl(work_dir, join(get_user_temp_dir(), profile))
+        self.reuse = reuse
+        self.reset = reset
+        self.delete = nvl(delete, not reuse)
+        self.preload_images = preload_images
+        self.background_cleanup = background_cleanup
+        self.lock_file = join(get_user_temp_dir(), f"{profile}.lock")
 
     def __enter__(self):
         notice("Starting Minikube")
@@ -719,51 +2363,336 @@ class Minikube:
         check_environment()
         check_program("minikube")
 
-        profile_data = parse_json(call("minikube profile list --output json", quiet=True))
+        self.lock = acquire_file_lock(self.lock_file)
+        self.tracing = tracing(self.work_dir).__enter__()
 
-        for profile in profile_data.get("valid", []):
-            if profile["Name"] == "skewer":
-                fail("A Minikube profile 'skewer' already exists.  Delete it using 'minikube delete -p skewer'.")
+        try:
+            with span(f"start profile '{self.profile}'", "minikube"):
+                if self.reuse:
+                    self.start_reused_cluster()
+                else:
+                    self.start_cluster()
+        except:
+            try:
+                self.tracing.__exit__(*sys.exc_info())
+            finally:
+                release_file_lock(self.lock)
 
-        remove(self.work_dir, quiet=True)
-        make_dir(self.work_dir, quiet=True)
+            raise
 
-        run("minikube start -p skewer --auto-update-drivers false")
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
         try:
-            tunnel_output_file = open(f"{self.work_dir}/minikube-tunnel-output", "w")
-            self.tunnel = start("minikube tunnel -p skewer", output=tunnel_output_file)
+            if not self.delete:
+                notice(f"Keeping Minikube profile '{self.profile}' for the next run")
+                return
+
+            if self.background_cleanup:
+                self.start_reaper()
+                return
 
+            notice("Stopping Minikube")
+
+            with span(f"stop profile '{self.profile}'", "minikube"):
+                if self.reuse:
+                    self.stop_detached_tunnel()
+                else:
+                    stop(self.tunnel)
+
+                run(f"minikube delete -p {self.profile}")
+        finally:
             try:
-                model = Model(self.skewer_file)
-                model.check()
+                self.tracing.__exit__(exc_type, exc_value, traceback)
+            finally:
+                release_file_lock(self.lock)
+
+    def start_cluster(self):
+        if self.get_profile() is not None:
+            fail(f"A Minikube profile '{self.profile}' already exists.  "
+                 f"Delete it using 'minikube delete -p {self.profile}'.")
 
-                kube_sites = [x for _, x in model.sites if x.platform == "kubernetes"]
+        remove(self.work_dir, quiet=True)
+        make_dir(self.work_dir, quiet=True)
 
-                for site in kube_sites:
-                    kubeconfig = site.env["KUBECONFIG"]
-                    kubeconfig = kubeconfig.replace("~", self.work_dir)
-                    kubeconfig = expand(kubeconfig)
+        preloader = self.start_image_preloader()
 
-                    site.env["KUBECONFIG"] = kubeconfig
+        run(f"minikube start -p {self.profile} --auto-update-drivers false")
 
-                    self.kubeconfigs.append(kubeconfig)
+        preloader.load()
+
+        try:
+            tunnel_output_file = open(f"{self.work_dir}/minikube-tunnel-output", "w")
+            self.tunnel = start(f"minikube tunnel -p {self.profile}", output=tunnel_output_file)
 
-                    with site:
-                        run("minikube update-context -p skewer")
-                        check_file(ENV["KUBECONFIG"])
+            try:
+                self.update_contexts()
             except:
                 stop(self.tunnel)
                 raise
         except:
-            run("minikube delete -p skewer")
+            run(f"minikube delete -p {self.profile}")
             raise
 
-        return self
+    # Keep the cluster and tunnel from the last run.  Unless reset is
+    # false, delete the site namespaces so the steps start from a clean
+    # state.
+    def start_reused_cluster(self):
+        make_dir(self.work_dir, quiet=True)
 
-    def __exit__(self, exc_type, exc_value, traceback):
-        notice("Stopping Minikube")
+        profile = self.get_profile()
+
+        if profile is None and not self.reset:
+            fail(f"There is no Minikube profile '{self.profile}' to continue from")
+
+        if profile is None or profile.get("Status") != "Running":
+            preloader = self.start_image_preloader()
+
+            run(f"minikube start -p {self.profile} --auto-update-drivers false")
+
+            preloader.load()
+
+        self.start_detached_tunnel()
+        self.update_contexts()
+
+        if profile is not None and self.reset:
+            for site in self.kube_sites:
+                with site:
+                    notice(f"Resetting namespace '{site.namespace}'")
+                    run(f"kubectl delete namespace {site.namespace} --ignore-not-found", stdout=DEVNULL,
+                        env=site.get_env(), quiet=True)
+
+    # Stop the tunnel without waiting and hand 'minikube delete' to a
+    # detached process.  The process inherits the lock, so the next run
+    # waits for the delete to finish before it starts the profile again.
+    def start_reaper(self):
+        if self.reuse:
+            self.stop_detached_tunnel()
+        else:
+            self.tunnel.terminate()
+
+        with open(join(self.work_dir, "minikube-delete-output"), "w") as output:
+            proc = subprocess.Popen(["minikube", "delete", "-p", self.profile], stdin=subprocess.DEVNULL,
+                                    stdout=output, stderr=output, start_new_session=True, pass_fds=(self.lock,))
+
+        notice(f"Deleting Minikube profile '{self.profile}' in the background (pid {proc.pid})")
+
+    def start_image_preloader(self):
+        images = list()
+
+        if self.preload_images:
+            model = Model(self.skewer_file)
+            model.check()
+
+            images = get_preload_images(model)
+
+        return _ImagePreloader(self.profile, images).start()
+
+    def start_detached_tunnel(self):
+        pid_file = join(self.work_dir, "minikube-tunnel.pid")
+
+        if is_file(pid_file) and is_tunnel_running(int(read(pid_file)), self.profile):
+            notice(f"Reusing the Minikube tunnel (pid {read(pid_file)})")
+            return
+
+        with open(join(self.work_dir, "minikube-tunnel-output"), "w") as output:
+            proc = subprocess.Popen(["minikube", "tunnel", "-p", self.profile], stdin=subprocess.DEVNULL,
+                                    stdout=output, stderr=output, start_new_session=True)
+
+        write(pid_file, str(proc.pid))
+
+    # The tunnel runs in its own session, so signal its process group
+    def stop_detached_tunnel(self):
+        pid_file = join(self.work_dir, "minikube-tunnel.pid")
+
+        if not is_file(pid_file):
+            return
+
+        pid = int(read(pid_file))
+
+        if is_tunnel_running(pid, self.profile):
+            notice(f"Stopping the Minikube tunnel (pid {pid})")
+            os.killpg(pid, signal.SIGTERM)
+
+        remove(pid_file, quiet=True)
+
+    def update_contexts(self):
+        model = Model(self.skewer_file)
+        model.check()
+
+        self.kube_sites = [x for _, x in model.sites if x.platform == "kubernetes"]
+
+        for site in self.kube_sites:
+            kubeconfig = site.env["KUBECONFIG"]
+            kubeconfig = kubeconfig.replace("~", self.work_dir)
+            kubeconfig = expand(kubeconfig)
+
+            site.env["KUBECONFIG"] = kubeconfig
+
+            self.kubeconfigs.append(kubeconfig)
+
+            with site:
+                run(f"minikube update-context -p {self.profile}", env=site.get_env())
+                check_file(kubeconfig)
+
+    def get_profile(self):
+        profile_data = parse_json(call("minikube profile list --output json", quiet=True))
+
+        for profile in profile_data.get("valid", []):
+            if profile["Name"] == self.profile:
+                return profile
+
+# Answers resource queries over a persistent HTTP connection to one
+# 'kubectl proxy' per kubeconfig, instead of starting a new kubectl
+# process for each query.  If url is set, it talks to that API server
+# directly.
+class KubeClient:
+    resource_paths = {
+        "configmap": "/api/v1/namespaces/{namespace}/configmaps/{name}",
+        "deployment": "/apis/apps/v1/namespaces/{namespace}/deployments/{name}",
+        "namespace": "/api/v1/namespaces/{name}",
+        "pod": "/api/v1/namespaces/{namespace}/pods/{name}",
+        "secret": "/api/v1/namespaces/{namespace}/secrets/{name}",
+        "service": "/api/v1/namespaces/{namespace}/services/{name}",
+        "serviceaccount": "/api/v1/namespaces/{namespace}/serviceaccounts/{name}",
+        "statefulset": "/apis/apps/v1/namespaces/{namespace}/statefulsets/{name}",
+    }
+
+    def __init__(self, kubeconfig=None, url=None):
+        self.kubeconfig = kubeconfig
+        self.url = url
+        self.proxy = None
+        self.proxy_pid = None
+        self.connection = None
+        self.connection_pid = None
+        self.namespace = None
+        self.lock = threading.RLock()
+
+    def __repr__(self):
+        return f"kube client (kubeconfig='{self.kubeconfig}', url='{self.url}')"
+
+    def start(self):
+        if self.url is not None:
+            return
+
+        self.proxy = start(["kubectl", "proxy", "--port", "0", "--kubeconfig", self.kubeconfig],
+                           stdout=subprocess.PIPE, stderr=DEVNULL, quiet=True)
+        self.proxy_pid = get_process_id()
+
+        line = self.proxy.stdout.readline().decode("utf-8")
+
+        if not line.startswith("Starting to serve on "):
+            stop(self.proxy, quiet=True)
+            fail(f"Failed to start kubectl proxy for kubeconfig '{self.kubeconfig}'")
+
+        self.url = "http://{}".format(remove_prefix(line, "Starting to serve on ").strip())
+
+    # Forked workers inherit the client.  Only the process that
+    # started the proxy stops it.
+    def stop(self):
+        if self.connection is not None and self.connection_pid == get_process_id():
+            self.connection.close()
+
+        self.connection = None
+
+        if self.proxy is not None and self.proxy_pid == get_process_id():
+            stop(self.proxy, quiet=True)
+
+            self.proxy = None
+            self.url = None
+
+    def supports(self, resource, jsonpath=""):
+        kind = resource.split("/", 1)[0].lower()
+
+        if kind not in self.resource_paths or "/" not in resource:
+            return False
+
+        return re.fullmatch(r"(\.[\w-]+)*", jsonpath) is not None
+
+    # Returns None if the resource does not exist
+    def get_resource(self, resource, namespace):
+        kind, name = resource.split("/", 1)
+        path = self.resource_paths[kind.lower()].format(namespace=namespace, name=name)
+
+        status, content = self.request("GET", path)
+
+        if status == 404:
+            return None
+
+        if status != 200:
+            fail(f"Failed getting {resource}: HTTP status {status}")
+
+        return parse_json(content)
+
+    # Produces the same output as 'kubectl get -o jsonpath' for simple
+    # dotted paths
+    def get_resource_json(self, resource, namespace, jsonpath=""):
+        data = self.get_resource(resource, namespace)
+
+        if data is None:
+            fail(f"Resource {resource} not found")
+
+        for name in jsonpath.split(".")[1:]:
+            if not isinstance(data, dict) or name not in data:
+                return ""
+
+            data = data[name]
+
+        if is_string(data):
+            return data
+
+        return json.dumps(data, separators=(",", ":"))
+
+    # The step commands use the namespace of the kubeconfig's current
+    # context.  The kubeconfig is read only until the namespace is
+    # known to be set.
+    def set_current_namespace(self, namespace):
+        with self.lock:
+            if self.namespace == namespace:
+                return
+
+            if self.get_current_namespace() != namespace:
+                run(f"kubectl --kubeconfig {self.kubeconfig} config set-context --current --namespace {namespace}",
+                    stdout=DEVNULL, quiet=True)
+
+            self.namespace = namespace
+
+    def get_current_namespace(self):
+        if self.kubeconfig is None or not is_file(self.kubeconfig):
+            return None
+
+        data = read_yaml(self.kubeconfig) or dict()
+
+        for context in data.get("contexts") or []:
+            if context.get("name") == data.get("current-context"):
+                return (context.get("context") or dict()).get("namespace")
+
+    def request(self, method, path):
+        with self.lock:
+            return self._request(method, path)
+
+    def _request(self, method, path):
+        import http.client
+
+        if self.url is None:
+            self.start()
+
+        for attempt in range(2):
+            if self.connection is None or self.connection_pid != get_process_id():
+                url = parse_url(self.url)
+
+                self.connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+                self.connection_pid = get_process_id()
+
+            try:
+                self.connection.request(method, path, headers={"Accept": "application/json"})
+                response = self.connection.getresponse()
 
-        stop(self.tunnel)
+                return response.status, response.read().decode("utf-8")
+            except (http.client.HTTPException, OSError) as e:
+                # The server may have closed an idle connection
+                self.connection.close()
+                self.connection = None
 
-        run("minikube delete -p skewer")
+                if attempt == 1:
+                    fail(f"Failed connecting to {self.url}: {e}")
@@ -0,0 +1,415 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+# A small renderer for the GitHub-flavored Markdown we use in
+# READMEs: headings, paragraphs, lists, block quotes, code blocks,
+# tables, links, images, and inline formatting.  It works offline.
+
+import html
+import re
+
+__all__ = [
+    "convert_markdown", "get_heading_fragment",
+]
+
+_fence_re = re.compile(r"^ {0,3}(`{3,}|~{3,})\s*([^`\s]*)")
+_atx_heading_re = re.compile(r"^ {0,3}(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$")
+_setext_heading_re = re.compile(r"^ {0,3}(=+|-+)[ \t]*$")
+_rule_re = re.compile(r"^ {0,3}([-*_])(?:[ \t]*\1){2,}[ \t]*$")
+_list_item_re = re.compile(r"^( {0,3})([*+-]|\d{1,9}[.)])( +|$)")
+_quote_re = re.compile(r"^ {0,3}> ?")
+_html_block_re = re.compile(r"^ {0,3}<(?:!--|/?[A-Za-z])")
+_table_separator_re = re.compile(r"^ {0,3}\|?\s*:?-+:?\s*(?:\|\s*:?-+:?\s*)*\|?\s*$")
+_link_reference_re = re.compile(r"^ {0,3}\[([^\]]+)\]:\s*(\S+)(?:\s+[\"'(](.*)[\"')])?\s*$")
+_bare_url_re = re.compile(r"(?<![\w/=\"])(https?://[^\s<>\x00]*[^\s<>\x00.,:;!?'\")\]])")
+
+def convert_markdown(markdown):
+    lines = markdown.expandtabs(4).split("\n")
+    state = _State(_collect_link_references(lines))
+
+    return "\n".join(_render_blocks(lines, state)) + "\n"
+
+# The same fragments GitHub generates for heading anchors
+def get_heading_fragment(heading):
+    fragment = re.sub(r"[ -]", "_", heading)
+    fragment = re.sub(r"[\W]", "", fragment)
+    fragment = fragment.replace("_", "-")
+
+    return fragment.lower()
+
+class _State:
+    def __init__(self, link_references):
+        self.link_references = link_references
+        self.heading_fragments = dict()
+
+    def get_heading_id(self, heading_html):
+        text = html.unescape(re.sub(r"<[^>]+>", "", heading_html))
+        fragment = get_heading_fragment(text)
+        count = self.heading_fragments.get(fragment, 0)
+
+        self.heading_fragments[fragment] = count + 1
+
+        if count:
+            return f"{fragment}-{count}"
+
+        return fragment
+
+def _collect_link_references(lines):
+    references = dict()
+    fence = None
+
+    for i, line in enumerate(lines):
+        match = _fence_re.match(line)
+
+        if match and fence is None:
+            fence = match.group(1)
+        elif fence is not None:
+            if _is_closing_fence(line, fence):
+                fence = None
+        else:
+            match = _link_reference_re.match(line)
+
+            if match:
+                label, url, title = match.groups()
+                references[label.lower()] = url.strip("<>"), title
+                lines[i] = ""
+
+    return references
+
+def _is_closing_fence(line, fence):
+    stripped = line.strip()
+    return len(stripped) >= len(fence) and stripped == fence[0] * len(stripped)
+
+def _starts_block(line):
+    return any((_fence_re.match(line), _atx_heading_re.match(line), _rule_re.match(line), _quote_re.match(line),
+                _html_block_re.match(line)))
+
+def _render_blocks(lines, state, tight=False):
+    out = list()
+    i = 0
+
+    while i < len(lines):
+        line = lines[i]
+
+        if not line.strip():
+            i += 1
+            continue
+
+        # Fenced code
+        match = _fence_re.match(line)
+
+        if match:
+            fence, language = match.groups()
+            code = list()
+            i += 1
+
+            while i < len(lines) and not _is_closing_fence(lines[i], fence):
+                code.append(lines[i])
+                i += 1
+
+            # An unclosed fence runs to the end, without the blank lines
+            # left by the final newline
+            if i == len(lines):
+                while code and not code[-1].strip():
+                    code.pop()
+
+            i += 1
+
+            out.append(_render_code(code, language))
+            continue
+
+        # Indented code
+        if line.startswith("    "):
+            code = list()
+
+            while i < len(lines) and (lines[i].startswith("    ") or not lines[i].strip()):
+                code.append(lines[i][4:])
+                i += 1
+
+            while code and not code[-1].strip():
+                code.pop()
+
+            out.append(_render_code(code))
+            continue
+
+        # ATX headings
+        match = _atx_heading_re.match(line)
+
+        if match:
+            out.append(_render_heading(len(match.group(1)), match.group(2) or "", state))
+            i += 1
+            continue
+
+        # Horizontal rules
+        if _rule_re.match(line):
+            out.append("<hr>")
+            i += 1
+            continue
+
+        # Block quotes
+        if _quote_re.match(line):
+            quoted = list()
+
+            while i < len(lines) and lines[i].strip():
+                quoted.append(_quote_re.sub("", lines[i], count=1))
+                i += 1
+
+            out.append("<blockquote>")
+            out.extend(_render_blocks(quoted, state))
+            out.append("</blockquote>")
+            continue
+
+        # HTML blocks
+        if _html_block_re.match(line):
+            while i < len(lines) and lines[i].strip():
+                out.append(lines[i])
+                i += 1
+
+            continue
+
+        # Tables
+        if "|" in line and i + 1 < len(lines) and _table_separator_re.match(lines[i + 1]):
+            header = _split_table_row(line)
+            alignments = [_get_alignment(x) for x in _split_table_row(lines[i + 1])]
+            rows = list()
+            i += 2
+
+            while i < len(lines) and lines[i].strip() and "|" in lines[i]:
+                rows.append(_split_table_row(lines[i]))
+                i += 1
+
+            out.append(_render_table(header, alignments, rows, state))
+            continue
+
+        # Lists
+        match = _list_item_re.match(line)
+
+        if match:
+            i = _render_list(lines, i, out, state)
+            continue
+
+        # Paragraphs and setext headings
+        paragraph = [line.strip()]
+        i += 1
+
+        while i < len(lines) and lines[i].strip():
+            match = _setext_heading_re.match(lines[i])
+
+            if match:
+                break
+
+            if _starts_block(lines[i]) or _list_item_re.match(lines[i]):
+                break
+
+            paragraph.append(lines[i].strip())
+            i += 1
+
+        text = "\n".join(paragraph)
+
+        if i < len(lines) and _setext_heading_re.match(lines[i]):
+            level = 1 if lines[i].strip().startswith("=") else 2
+            out.append(_render_heading(level, text, state))
+            i += 1
+        elif tight:
+            out.append(_render_inline(text, state))
+        else:
+            out.append(f"<p>{_render_inline(text, state)}</p>")
+
+    return out
+
+def _render_code(lines, language=None):
+    code = html.escape("\n".join(lines) + "\n" if lines else "")
+
+    if language:
+        return f"<pre><code class=\"language-{html.escape(language)}\">{code}</code></pre>"
+
+    return f"<pre><code>{code}</code></pre>"
+
+def _render_heading(level, text, state):
+    content = _render_inline(text.strip(), state)
+    id = state.get_heading_id(content)
+
+    return f"<h{level} id=\"{id}\"><a class=\"anchor\" href=\"#{id}\"></a>{content}</h{level}>"
+
+def _render_list(lines, i, out, state):
+    first = _list_item_re.match(lines[i])
+    ordered = first.group(2)[0].isdigit()
+    items = list()
+    loose = False
+
+    while i < len(lines):
+        match = _list_item_re.match(lines[i])
+
+        if match is None or match.group(2)[0].isdigit() != ordered:
+            break
+
+        if match.group(3):
+            indent = len(match.group(0))
+        else:
+            indent = len(match.group(1)) + len(match.group(2)) + 1
+
+        item = [lines[i][indent:]]
+        i += 1
+
+        while i < len(lines):
+            line = lines[i]
+
+            if not line.strip():
+                item.append("")
+            elif len(line) - len(line.lstrip()) >= indent:
+                item.append(line[indent:])
+            elif item[-1].strip() and not _starts_block(line) and not _list_item_re.match(line):
+                # A lazy paragraph continuation
+                item.append(line.strip())
+            else:
+                break
+
+            i += 1
+
+        trailing_blank = False
+
+        while item and not item[-1].strip():
+            item.pop()
+            trailing_blank = True
+
+        if trailing_blank and i < len(lines) and _list_item_re.match(lines[i]):
+            loose = True
+
+        if any(not x.strip() for x in item) and not any(_fence_re.match(x) for x in item):
+            loose = True
+
+        items.append(item)
+
+    if ordered:
+        start = int(first.group(2)[:-1])
+        out.append("<ol>" if start == 1 else f"<ol start=\"{start}\">")
+    else:
+        out.append("<ul>")
+
+    for item in items:
+        out.append("<li>{}</li>".format("\n".join(_render_blocks(item, state, tight=not loose))))
+
+    out.append("</ol>" if ordered else "</ul>")
+
+    return i
+
+def _split_table_row(line):
+    line = line.strip()
+
+    if line.startswith("|"):
+        line = line[1:]
+
+    if line.endswith("|") and not line.endswith("\\|"):
+        line = line[:-1]
+
+    return [x.strip().replace("\\|", "|") for x in re.split(r"(?<!\\)\|", line)]
+
+def _get_alignment(cell):
+    if cell.startswith(":") and cell.endswith(":"):
+        return "center"
+
+    if cell.endswith(":"):
+        return "right"
+
+    if cell.startswith(":"):
+        return "left"
+
+def _render_table(header, alignments, rows, state):
+    def render_row(cells, tag):
+        out = list()
+
+        for i, alignment in enumerate(alignments):
+            cell = _render_inline(cells[i], state) if i < len(cells) else ""
+            align = f" align=\"{alignment}\"" if alignment else ""
+
+            out.append(f"<{tag}{align}>{cell}</{tag}>")
+
+        return "<tr>{}</tr>".format("".join(out))
+
+    out = ["<table>", "<thead>", render_row(header, "th"), "</thead>"]
+
+    if rows:
+        out.append("<tbody>")
+        out.extend(render_row(x, "td") for x in rows)
+        out.append("</tbody>")
+
+    out.append("</table>")
+
+    return "\n".join(out)
+
+def _render_inline(text, state):
+    tokens = list()
+
+    def stash(value):
+        tokens.append(value)
+        return f"\x00{len(tokens) - 1}\x00"
+
+    def render_link(url, title=None):
+        title = f" title=\"{title}\"" if title else ""
+        return stash(f"<a href=\"{url}\"{title}>")
+
+    # A URL in the text of a link is not linked again
+    def render_link_text(content):
+        return _bare_url_re.sub(lambda m: stash(m.group(1)), content)
+
+    def replace_image(match):
+        alt, url, title = match.groups()
+        title = f" title=\"{title}\"" if title else ""
+        return stash(f"<img src=\"{url}\" alt=\"{alt}\"{title}>")
+
+    def replace_link(match):
+        content, url, title = match.groups()
+        return render_link(url, title) + render_link_text(content) + stash("</a>")
+
+    def replace_reference_link(match):
+        content, label = match.groups()
+
+        try:
+            url, title = state.link_references[(label or content).lower()]
+        except KeyError:
+            return match.group(0)
+
+        return render_link(html.escape(url), html.escape(title or "")) + render_link_text(content) + stash("</a>")
+
+    # Code spans, autolinks, inline HTML, and backslash escapes are
+    # protected from further processing
+    text = re.sub(r"(`+)(.+?)\1", lambda m: stash(f"<code>{html.escape(m.group(2).strip())}</code>"), text,
+                  flags=re.DOTALL)
+    text = re.sub(r"<(https?://[^>\s]+)>",
+                  lambda m: stash(f"<a href=\"{html.escape(m.group(1))}\">{html.escape(m.group(1))}</a>"), text)
+    text = re.sub(r"<!--.*?-->|</?[A-Za-z][A-Za-z0-9-]*(?:\s[^<>]*)?/?>", lambda m: stash(m.group(0)), text,
+                  flags=re.DOTALL)
+    text = re.sub(r"\\([!-/:-@\[-`{-~])", lambda m: stash(html.escape(m.group(1))), text)
+
+    text = html.escape(text)
+
+    text = re.sub(r"!\[([^\]]*)\]\(\s*(\S+?)(?:\s+&quot;(.*?)&quot;)?\s*\)", replace_image, text)
+    text = re.sub(r"\[([^\]]*)\]\(\s*(\S+?)(?:\s+&quot;(.*?)&quot;)?\s*\)", replace_link, text)
+    text = re.sub(r"\[([^\]]+)\](?:\[([^\]]*)\])?", replace_reference_link, text)
+    # The text of a bare URL is protected from emphasis
+    text = _bare_url_re.sub(lambda m: stash(f"<a href=\"{m.group(1)}\">{m.group(1)}</a>"), text)
+
+    text = re.sub(r"\*\*(?=\S)(.+?)(?<=\S)\*\*", r"<strong>\1</strong>", text, flags=re.DOTALL)
+    text = re.sub(r"(?<!\w)__(?=\S)(.+?)(?<=\S)__(?!\w)", r"<strong>\1</strong>", text, flags=re.DOTALL)
+    text = re.sub(r"\*(?=\S)(.+?)(?<=\S)\*", r"<em>\1</em>", text, flags=re.DOTALL)
+    text = re.sub(r"(?<!\w)_(?=\S)(.+?)(?<=\S)_(?!\w)", r"<em>\1</em>", text, flags=re.DOTALL)
+    text = re.sub(r"~~(?=\S)(.+?)(?<=\S)~~", r"<del>\1</del>", text, flags=re.DOTALL)
+    text = re.sub(r" {2,}\n", "<br>\n", text)
+
+    return re.sub(r"\x00(\d+)\x00", lambda m: tokens[int(m.group(1))], text)
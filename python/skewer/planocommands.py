@@ -22,6 +22,20 @@ from plano.github import *
 from skewer import *
 
 _debug_param = CommandParameter("debug", help="Produce extra debug output on failure")
+_parallel_sites_param = CommandParameter("parallel_sites", help="Run the commands for each site concurrently")
+_reuse_cluster_param = CommandParameter("reuse_cluster", help="Keep the Minikube cluster running for the next run")
+_from_step_param = CommandParameter("from_step", type=int,
+                                    help="Skip the steps before step N (implies --defer-cleanup)")
+_resume_param = CommandParameter("resume", help="Skip the steps completed in the last run (implies --defer-cleanup)")
+_defer_cleanup_param = CommandParameter("defer_cleanup", help="Skip cleaning up and keep the cluster for --resume")
+_cleanup_only_param = CommandParameter("cleanup_only", help="Run only the cleaning up step of a deferred run")
+_background_cleanup_param = CommandParameter("background_cleanup",
+                                             help="Delete the namespaces and Minikube cluster without waiting")
+_fixed_timeouts_param = CommandParameter("fixed_timeouts",
+                                         help="Use the default timeouts instead of timeouts from past runs")
+_record_param = CommandParameter("record", metavar="FILE", help="Record the command results to a cassette FILE")
+_replay_param = CommandParameter("replay", metavar="FILE", help="Replay the command results from a cassette FILE")
+_github_api_param = CommandParameter("github_api", help="Render using the GitHub Markdown API instead of locally")
 
 @command
 def generate(output="README.md"):
@@ -30,17 +44,14 @@ def generate(output="README.md"):
     """
     generate_readme("skewer.yaml", output)
 
-@command
-def render(quiet=False):
+@command(parameters=[_github_api_param])
+def render(github_api=False, quiet=False):
     """
     Render README.html from README.md
     """
     generate()
 
-    markdown = read("README.md")
-    html = convert_github_markdown(markdown)
-
-    write("README.html", html)
+    render_readme("README.md", "README.html", github_api=github_api)
 
     if not quiet:
         print(f"file:{get_real_path('README.html')}")
@@ -50,35 +61,83 @@ def clean():
     remove(find(".", "__pycache__"))
     remove("README.html")
 
-@command(parameters=[_debug_param])
-def run_(*kubeconfigs, debug=False):
+@command(parameters=[_debug_param, _parallel_sites_param, _reuse_cluster_param, _from_step_param, _resume_param,
+                     _defer_cleanup_param, _cleanup_only_param, _background_cleanup_param, _fixed_timeouts_param,
+                     _record_param, _replay_param])
+def run_(*kubeconfigs, debug=False, parallel_sites=False, reuse_cluster=False, from_step=None, resume=False,
+         defer_cleanup=False, cleanup_only=False, background_cleanup=False, fixed_timeouts=False, record=None,
+         replay=None):
     """
     Run the example steps
 
     If no kubeconfigs are provided, Skewer starts a local Minikube
     instance and runs the steps using it.
+
+    With --defer-cleanup, the cluster and its resources are kept
+    after the run.  Use --resume or --from-step N to continue from
+    there, and --cleanup-only to clean up and delete the cluster.
+
+    With --background-cleanup, the run returns once the steps are
+    done.  The namespaces and the Minikube cluster are deleted in the
+    background.
+
+    Awaits and commands with a history of past runs time out at a
+    multiple of their usual duration, so a broken run fails fast.
+    Use --fixed-timeouts to wait for the full default timeouts.
+
+    With --replay, the steps run against the results recorded using
+    --record, without a cluster.
     """
-    if not kubeconfigs:
-        with Minikube("skewer.yaml") as mk:
-            run_steps("skewer.yaml", kubeconfigs=mk.kubeconfigs, work_dir=mk.work_dir, debug=debug)
+    continuing = resume or from_step is not None or cleanup_only
+
+    options = {
+        "debug": debug,
+        "parallel_sites": parallel_sites,
+        "from_step": from_step,
+        "resume": resume,
+        "defer_cleanup": defer_cleanup,
+        "cleanup_only": cleanup_only,
+        "background_cleanup": background_cleanup,
+        "adaptive_timeouts": not fixed_timeouts,
+    }
+
+    if replay:
+        with cassette(replay, "replay") as c:
+            run_steps("skewer.yaml", kubeconfigs=c.kubeconfigs, work_dir=make_temp_dir(), **options)
+    elif not kubeconfigs:
+        reuse = reuse_cluster or defer_cleanup or continuing
+
+        # After the deferred cleanup, the cluster is no longer needed
+        delete = not reuse or (cleanup_only and not (reuse_cluster or defer_cleanup))
+
+        with Minikube("skewer.yaml", reuse=reuse, reset=not continuing, background_cleanup=background_cleanup,
+                      delete=delete) as mk:
+            if record:
+                with cassette(record, "record", kubeconfigs=mk.kubeconfigs):
+                    run_steps("skewer.yaml", kubeconfigs=mk.kubeconfigs, work_dir=mk.work_dir, **options)
+            else:
+                run_steps("skewer.yaml", kubeconfigs=mk.kubeconfigs, work_dir=mk.work_dir, **options)
+    elif record:
+        with cassette(record, "record", kubeconfigs=list(kubeconfigs)):
+            run_steps("skewer.yaml", kubeconfigs=kubeconfigs, **options)
     else:
-        run_steps("skewer.yaml", kubeconfigs=kubeconfigs, debug=debug)
+        run_steps("skewer.yaml", kubeconfigs=kubeconfigs, **options)
 
-@command(parameters=[_debug_param])
-def demo(*kubeconfigs, debug=False):
+@command(parameters=[_debug_param, _parallel_sites_param, _reuse_cluster_param])
+def demo(*kubeconfigs, debug=False, parallel_sites=False, reuse_cluster=False):
     """
     Run the example steps and pause for a demo before cleaning up
     """
     with working_env(SKEWER_DEMO=1):
-        run_(*kubeconfigs, debug=debug)
+        run_(*kubeconfigs, debug=debug, parallel_sites=parallel_sites, reuse_cluster=reuse_cluster)
 
-@command(parameters=[_debug_param])
-def test_(debug=False):
+@command(parameters=[_debug_param, _parallel_sites_param, _reuse_cluster_param])
+def test_(debug=False, parallel_sites=False, reuse_cluster=False):
     """
     Test README generation and run the steps on Minikube
     """
     generate(output=make_temp_file())
-    run_(debug=debug)
+    run_(debug=debug, parallel_sites=parallel_sites, reuse_cluster=reuse_cluster)
 
 @command
 def update_skewer():
@@ -17,8 +17,22 @@
 # under the License.
 #
 
+import skewer.main
+
 from plano import *
 from skewer import *
+from skewer.main import KubeClient, Model, acquire_file_lock, await_resources, benchmark_http, collect_debug_bundle, \
+    get_current_site, get_history_file, get_preload_images, get_site_env, get_timeout, history, is_tunnel_running, \
+    kubectl, load_standard_data, release_file_lock, run_background_cleanup, run_step, run_step_command, \
+    run_step_graph, span, tracing
+from skewer.markdown import convert_markdown
+
+import http.server as _http
+import os as _os
+import re as _re
+import signal as _signal
+import sys as _sys
+import threading as _threading
 
 @test
 def plano_commands():
@@ -36,12 +50,916 @@ def config_files():
 
     parse_yaml(read("config/.github/workflows/main.yaml"))
 
+@test
+def standard_data_cache():
+    with working_dir():
+        yaml_file = write("standard.yaml", "a: 1\n")
+
+        with working_env(SKEWER_CACHE_DIR=get_absolute_path("cache")):
+            assert load_standard_data(yaml_file) == {"a": 1}
+
+            cache_files = find("cache", "*.pickle")
+            assert len(cache_files) == 1, cache_files
+
+            skewer.main._standard_data.clear()
+            write(cache_files[0], "")
+
+            assert load_standard_data(yaml_file) == {"a": 1}
+            assert parse_yaml(read(yaml_file)) == {"a": 1}
+
+            skewer.main._standard_data.clear()
+            _os.utime(yaml_file, ns=(0, 0))
+
+            assert load_standard_data(yaml_file) == {"a": 1}
+            assert len(find("cache", "*.pickle")) == 2
+
 @test
 def generate_readme_():
     with working_dir("example"):
         generate_readme("skewer.yaml", "README.md")
         check_file("README.md")
 
+    skewer_file = get_absolute_path("example/skewer.yaml")
+
+    with working_dir():
+        write("skewer.yaml", read(skewer_file) + "workflow: https://example.net/main.yaml\n")
+
+        with working_env(SKEWER_CACHE_DIR=get_absolute_path("cache")):
+            generate_readme("skewer.yaml", "README.md")
+            content = read("README.md")
+            mtime = _os.path.getmtime("README.md")
+
+            generate_readme("skewer.yaml", "README.md")
+            assert _os.path.getmtime("README.md") == mtime
+
+            write("skewer.yaml", read("skewer.yaml").replace("An overview", "A new overview"))
+
+            generate_readme("skewer.yaml", "README.md")
+            assert read("README.md") == content.replace("An overview", "A new overview")
+
+            # A change to the Markdown module, which makes the heading
+            # fragments, invalidates the cache
+            cache_file = find("cache/readmes", "*.json")[0]
+            input_key = read_json(cache_file)["input_key"]
+            markdown_code_file = skewer.main.markdown_code_file
+
+            try:
+                skewer.main.markdown_code_file = write("markdown.py", read(markdown_code_file) + "# Changed\n")
+                generate_readme("skewer.yaml", "README.md")
+            finally:
+                skewer.main.markdown_code_file = markdown_code_file
+
+            assert read_json(cache_file)["input_key"] != input_key
+
+@test
+def generate_readmes_():
+    skewer_file = get_absolute_path("example/skewer.yaml")
+
+    with working_dir():
+        for name in ("a", "b", "external/c"):
+            write(join(name, "skewer.yaml"), read(skewer_file) + "workflow: https://example.net/main.yaml\n")
+
+        with working_env(SKEWER_CACHE_DIR=get_absolute_path("cache")):
+            skewer.main._standard_data.clear()
+
+            generate_readmes(".", jobs=2)
+
+            # The workers get the standard data loaded before the fork
+            assert len(skewer.main._standard_data) == 2, skewer.main._standard_data.keys()
+
+            check_file("a/README.md")
+            check_file("b/README.md")
+            assert not exists("external/c/README.md")
+
+            write("b/skewer.yaml", "steps: []\nnot_an_attribute: 1\n")
+
+            with expect_error():
+                generate_readmes(".", jobs=2)
+
+            # Only external dirs inside the given dir are skipped
+            write("other/external/d/skewer.yaml", read("a/skewer.yaml"))
+            generate_readmes(get_absolute_path("other/external"), jobs=2)
+
+            check_file("other/external/d/README.md")
+
+@test
+def render_readme_():
+    readme_file = get_absolute_path("example/README.md")
+
+    with working_dir():
+        with working_env(SKEWER_CACHE_DIR=get_absolute_path("cache")):
+            copy(readme_file, "README.md")
+
+            render_readme("README.md", "README.html")
+            html = read("README.html")
+
+            for fragment in _re.findall(r"\]\(#([^)]+)\)", read("README.md")):
+                assert f"id=\"{fragment}\"" in html, fragment
+
+            assert "<a href=\"http://localhost:8080\">http://localhost:8080</a>" in html
+            assert "</a></a>" not in html
+
+            render_readme("README.md", "README.html")
+            assert read("README.html") == html
+
+    result = convert_markdown("# A - B\n\n# A - B\n\n* x *y* `z`\n* [a][b]\n\n[b]: http://c\n")
+
+    assert "<h1 id=\"a---b\">" in result, result
+    assert "<h1 id=\"a---b-1\">" in result, result
+    assert "<li>x <em>y</em> <code>z</code></li>" in result, result
+    assert "<a href=\"http://c\">a</a>" in result, result
+
+    result = convert_markdown("See http://y.com/_x_ and _x_.\n")
+    assert result == "<p>See <a href=\"http://y.com/_x_\">http://y.com/_x_</a> and <em>x</em>.</p>\n", result
+
+    # As in the standard steps
+    result = convert_markdown("Open [http://localhost:8080](http://localhost:8080) and [http://x.com/_y_][z].\n\n"
+                              "[z]: http://x.com/_y_\n")
+    assert result == ("<p>Open <a href=\"http://localhost:8080\">http://localhost:8080</a> and "
+                      "<a href=\"http://x.com/_y_\">http://x.com/_y_</a>.</p>\n"), result
+
+    result = convert_markdown("~~~\ncode\n\n")
+    assert result == "<pre><code>code\n</code></pre>\n", result
+
+@test
+def run_step_parallel_sites():
+    with working_dir():
+        write_yaml("skewer.yaml", {
+            "title": "Parallel sites",
+            "sites": {
+                "west": {"platform": "podman", "env": {"SKUPPER_PLATFORM": "podman"}},
+                "east": {"platform": "podman", "env": {"SKUPPER_PLATFORM": "podman"}},
+            },
+            "steps": [
+                {"title": "Sleep", "commands": {"west": [{"run": "sleep 1"}], "east": [{"run": "sleep 1"}]}},
+                {"title": "Fail", "commands": {"west": [{"run": "true"}], "east": [{"run": "false"}]}},
+            ],
+        })
+
+        model = Model("skewer.yaml")
+        model.check()
+
+        steps = list(model.steps)
+
+        with Timer() as timer:
+            run_step(model, steps[0], get_current_dir(), parallel_sites=True)
+
+        assert timer.elapsed_time < 2, timer.elapsed_time
+
+        with expect_error(contains="site east"):
+            run_step(model, steps[1], get_current_dir(), parallel_sites=True)
+
+@test
+def run_step_graph_():
+    with working_dir():
+        sites = {"west": {"platform": "podman", "env": {"SKUPPER_PLATFORM": "podman"}}}
+
+        write_yaml("skewer.yaml", {
+            "title": "Step graph",
+            "sites": sites,
+            "steps": [
+                {"name": "one", "title": "One", "commands": {"west": [{"run": "touch one"}]}},
+                {"name": "two", "title": "Two", "depends_on": "one", "commands": {"west": [{"run": "sleep 1"}]}},
+                {"name": "three", "title": "Three", "depends_on": ["one"], "commands": {"west": [{"run": "sleep 1"}]}},
+                {"title": "Four", "commands": {"west": [{"run": "touch four"}]}},
+            ],
+        })
+
+        model = Model("skewer.yaml")
+        model.check()
+
+        with Timer() as timer:
+            run_step_graph(model, list(model.steps), get_current_dir())
+
+        assert timer.elapsed_time < 2, timer.elapsed_time
+        check_file("one")
+        check_file("four")
+
+        write_yaml("skewer.yaml", {
+            "title": "Step graph",
+            "sites": sites,
+            "steps": [
+                {"name": "one", "title": "One", "depends_on": "two"},
+                {"name": "two", "title": "Two"},
+            ],
+        })
+
+        with expect_error(contains="not the name of a preceding step"):
+            Model("skewer.yaml").check()
+
+@test
+def tracing_():
+    with working_dir():
+        write_yaml("skewer.yaml", {
+            "title": "Tracing",
+            "sites": {"west": {"platform": "podman", "env": {"SKUPPER_PLATFORM": "podman"}}},
+            "steps": [
+                {"name": "one", "title": "One", "commands": {"west": [{"run": "true"}, {"run": "sleep 0.1"}]}},
+                {"title": "Two", "depends_on": "one", "commands": {"west": [{"run": "false"}]}},
+            ],
+        })
+
+        model = Model("skewer.yaml")
+        model.check()
+
+        with expect_error():
+            with tracing(get_current_dir()):
+                run_step_graph(model, list(model.steps), get_current_dir())
+
+        timeline = read_json("timeline.json")
+        trace = read_json("trace.json")
+        spans = {x["name"]: x for x in timeline}
+
+        assert set(spans) == {"step 1 'One'", "step 2 'Two'", "site 'west'", "true", "sleep 0.1", "false"}, spans
+        assert spans["sleep 0.1"]["duration"] >= 0.1, spans
+        assert spans["step 2 'Two'"]["failed"], spans
+        assert not spans["step 1 'One'"]["failed"], spans
+        assert len(timeline) == len(trace["traceEvents"]) == 7, trace
+
+@test
+def cassette_():
+    with working_dir():
+        write_yaml("skewer.yaml", {
+            "title": "Cassette",
+            "sites": {"west": {"platform": "podman", "env": {"SKUPPER_PLATFORM": "podman"}}},
+            "steps": [
+                {"title": "One", "commands": {"west": [{"run": "touch one && echo hello"}]}},
+                {"title": "Two", "commands": {"west": [{"run": "false", "expect_failure": True}]}},
+            ],
+        })
+
+        model = Model("skewer.yaml")
+        model.check()
+
+        with cassette("cassette.jsonl", "record"):
+            for step in model.steps:
+                run_step(model, step, get_current_dir())
+
+        remove("one")
+
+        with Timer() as timer:
+            with cassette("cassette.jsonl", "replay"):
+                for step in model.steps:
+                    run_step(model, step, get_current_dir())
+
+        assert not exists("one")
+        assert timer.elapsed_time < 1, timer.elapsed_time
+
+        entries = [parse_json(x) for x in read_lines("cassette.jsonl")]
+        assert entries[1]["result"] == [0, "hello\n"], entries
+
+        write_yaml("skewer.yaml", {
+            "title": "Cassette",
+            "sites": {"west": {"platform": "podman", "env": {"SKUPPER_PLATFORM": "podman"}}},
+            "steps": [{"title": "One", "commands": {"west": [{"run": "echo other"}]}}],
+        })
+
+        model = Model("skewer.yaml")
+
+        with expect_error(contains="no result"):
+            with cassette("cassette.jsonl", "replay"):
+                run_step(model, model.steps[0], get_current_dir())
+
+        # Without a cassette, a failed command raises the process error
+        write_yaml("skewer.yaml", {
+            "title": "Cassette",
+            "sites": {"west": {"platform": "podman", "env": {"SKUPPER_PLATFORM": "podman"}}},
+            "steps": [{"title": "One", "commands": {"west": [{"run": "exit 3"}]}}],
+        })
+
+        model = Model("skewer.yaml")
+
+        with expect_exception(PlanoProcessError):
+            run_step(model, model.steps[0], get_current_dir())
+
+        with cassette("cassette.jsonl", "record"):
+            with expect_error(contains="non-zero exit status 3"):
+                run_step(model, model.steps[0], get_current_dir())
+
+        # While recording, the output shows up before the command exits
+        with cassette("cassette.jsonl", "record"):
+            with expect_output(contains="first\nsecond\n") as out:
+                with output_redirected(out, quiet=True):
+                    thread = _threading.Thread(target=run_step_command, args=("echo first; sleep 1; echo second", "x"))
+                    thread.start()
+
+                    sleep(0.5, quiet=True)
+                    output = read(out)
+
+                    thread.join()
+
+        assert "first\n" in output and "second" not in output, output
+
+@test
+def collect_debug_bundle_():
+    with working_dir():
+        write("bin/skupper", "#!/bin/sh\n[ \"$1\" = debug ] && exec sleep 10\nyes skupper | head -c 100000\n")
+        _os.chmod("bin/skupper", 0o755)
+
+        write_yaml("skewer.yaml", {
+            "title": "Debug bundle",
+            "sites": {
+                "west": {"platform": "podman", "env": {"SKUPPER_PLATFORM": "podman"}},
+                "east": {"platform": "podman", "env": {"SKUPPER_PLATFORM": "podman"}},
+            },
+            "steps": [],
+        })
+
+        model = Model("skewer.yaml")
+
+        with working_env(PATH=f"{get_absolute_path('bin')}:{ENV['PATH']}"):
+            with Timer() as timer:
+                archive_file, results = collect_debug_bundle(model, get_absolute_path("debug"), timeout=1,
+                                                             max_output_size=1000)
+
+        assert timer.elapsed_time < 3, timer.elapsed_time
+        assert len(results) == 12, results
+
+        check_file(archive_file)
+
+        for site_name, command, output_file in results:
+            output = read(output_file)
+
+            if command == "skupper debug events":
+                assert "Killed after 1 seconds" in output, output
+            else:
+                assert output.startswith("[99000 bytes omitted]\nskupper\n"), output
+                assert output.endswith("skupper\n"), output
+
+@test
+def preload_images():
+    skewer_file = get_absolute_path("example/skewer.yaml")
+
+    with working_dir():
+        with working_env(SKEWER_PRELOAD_IMAGES="quay.io/skupper/skupper-router:main, quay.io/skupper/controller:main"):
+            images = get_preload_images(Model(skewer_file))
+
+        # The example's own images are untagged, so they are left out
+        assert images == ["quay.io/skupper/skupper-router:main", "quay.io/skupper/controller:main"], images
+
+        with working_env(SKEWER_PRELOAD_IMAGES="a:latest localhost:5000/b b:1 c@sha256:0"):
+            images = get_preload_images(Model(skewer_file))
+
+        assert images == ["b:1", "c@sha256:0"], images
+
+        write_yaml("skewer.yaml", {"title": "Preload images", "sites": {}, "steps": [], "preload_images": "a:1"})
+
+        with expect_error(contains="must be a list"):
+            Model("skewer.yaml").check()
+
+        images = ["quay.io/skupper/hello-world-frontend:1", "quay.io/skupper/hello-world-backend:1"]
+
+        write("bin/docker", "#!/bin/sh\necho \"$@\" >> docker.log\n[ \"$1\" = save ] && echo image > \"$3\"\n"
+                            "[ \"$2\" = bad ] && exit 1\nexit 0\n")
+        write("bin/minikube", "#!/bin/sh\necho \"$@\" >> minikube.log\n")
+
+        _os.chmod("bin/docker", 0o755)
+        _os.chmod("bin/minikube", 0o755)
+
+        with working_env(PATH=f"{get_absolute_path('bin')}:{ENV['PATH']}",
+                         SKEWER_CACHE_DIR=get_absolute_path("cache")):
+            preloader = skewer.main._ImagePreloader("skewer", images[:2] + ["bad"]).start()
+            preloader.load()
+
+            assert sorted(preloader.archives) == sorted(images[:2]), preloader.archives
+            assert len(read_lines("docker.log")) == 5, read_lines("docker.log")
+            assert len(read_lines("minikube.log")) == 2, read_lines("minikube.log")
+
+            for archive in preloader.archives.values():
+                assert read(archive) == "image\n"
+
+            preloader = skewer.main._ImagePreloader("skewer", images[:2]).start()
+            preloader.load()
+
+            assert len(read_lines("docker.log")) == 5, read_lines("docker.log")
+            assert len(read_lines("minikube.log")) == 4, read_lines("minikube.log")
+
+@test
+def background_cleanup():
+    with working_dir():
+        write("bin/kubectl", "#!/bin/sh\necho \"$@\" >> kubectl.log\n")
+        write("bin/skupper", "#!/bin/sh\necho \"$@\" >> skupper.log\n")
+        write("bin/minikube", "#!/bin/sh\nsleep 1\necho \"$@\" >> minikube.log\n")
+
+        for name in "kubectl", "skupper", "minikube":
+            _os.chmod(join("bin", name), 0o755)
+
+        write_yaml("skewer.yaml", {
+            "title": "Background cleanup",
+            "sites": {
+                "west": {"platform": "kubernetes", "namespace": "west", "env": {"KUBECONFIG": "~/.kube/config-west"}},
+                "east": {"platform": "podman", "env": {"SKUPPER_PLATFORM": "podman"}},
+            },
+            "steps": [{"standard": "general/cleaning_up"}],
+        })
+
+        model = Model("skewer.yaml")
+
+        with working_env(PATH=f"{get_absolute_path('bin')}:{ENV['PATH']}"):
+            run_background_cleanup(model, model.steps[0], get_absolute_path("work"))
+
+            assert read("kubectl.log") == "delete namespace west --ignore-not-found --wait=false\n", read("kubectl.log")
+            assert read("skupper.log") == "delete\n", read("skupper.log")
+
+            mk = Minikube("skewer.yaml", profile="test", work_dir=make_dir("work"), background_cleanup=True)
+            mk.lock_file = get_absolute_path("test.lock")
+            mk.lock = acquire_file_lock(mk.lock_file)
+            mk.tracing = tracing(mk.work_dir).__enter__()
+            mk.tunnel = start("sleep 60")
+
+            with Timer() as timer:
+                mk.__exit__(None, None, None)
+
+            assert timer.elapsed_time < 1, timer.elapsed_time
+            assert not exists("minikube.log")
+
+            lock = acquire_file_lock(mk.lock_file)
+
+            try:
+                assert read("minikube.log") == "delete -p test\n", read("minikube.log")
+            finally:
+                release_file_lock(lock)
+
+            mk.tunnel.wait()
+
+            # The next run waits for the namespace to finish terminating
+            write("bin/kubectl", "#!/bin/sh\necho \"$@\" >> kubectl-get.log\n"
+                                 "[ $(wc -l < kubectl-get.log) -gt 2 ] && exit 1\necho Terminating\n")
+
+            skewer.main.await_namespace_cleanup(model, timeout=10)
+
+            assert len(read_lines("kubectl-get.log")) == 3, read_lines("kubectl-get.log")
+            assert "get namespace west" in read("kubectl-get.log")
+
+@test
+def sites_in_threads():
+    with working_dir():
+        write_yaml("skewer.yaml", {
+            "title": "Sites in threads",
+            "sites": {
+                name: {"platform": "kubernetes", "namespace": name,
+                       "env": {"KUBECONFIG": f"kc-{name}", "SITE_NAME": name}}
+                for name in ("west", "east", "north", "south")
+            },
+            "steps": [],
+        })
+
+        model = Model("skewer.yaml")
+        barrier = _threading.Barrier(len(model.sites))
+        results = dict()
+        errors = list()
+
+        def run_site(name):
+            try:
+                with model.get_site(name) as site:
+                    barrier.wait()
+
+                    for i in range(5):
+                        assert get_current_site() is site
+                        output = call("sh -c 'echo $SITE_NAME $KUBECONFIG'", env=get_site_env())
+                        assert output.split() == [name, f"kc-{name}"], output
+                        assert run_step_command(f"test \"$SITE_NAME\" = {name}", "test") == 0
+
+                    results[name] = kubectl()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [_threading.Thread(target=run_site, args=(x,)) for x, _ in model.sites]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        assert not errors, errors
+        assert results["west"] == "kubectl --kubeconfig kc-west --namespace west", results
+        assert len(set(results.values())) == 4, results
+        assert "SITE_NAME" not in ENV
+        assert get_current_site() is None
+
+@test
+def await_resources_():
+    def deployment(name, available):
+        return {"kind": "Deployment", "metadata": {"name": name},
+                "status": {"conditions": [{"type": "Available", "status": str(available)}]}}
+
+    def service(name):
+        return {"kind": "Service", "metadata": {"name": name}}
+
+    with working_dir():
+        write_yaml("skewer.yaml", {
+            "title": "Await resources",
+            "sites": {"west": {"platform": "kubernetes", "namespace": "west", "env": {"KUBECONFIG": "kc-west"}}},
+            "steps": [],
+        })
+
+        write_json("items-1.json", {"items": [deployment("frontend", False)]})
+        write_json("items-2.json", {"items": [deployment("frontend", True), deployment("backend", False)]})
+        write_json("items-3.json", {"items": [deployment("frontend", True), deployment("backend", True),
+                                              service("backend")]})
+
+        # Each call serves the next listing, and the last one after that
+        write("bin/kubectl", "#!/bin/sh\necho \"$@\" >> kubectl.log\nn=$(wc -l < kubectl.log)\n"
+              "[ $n -gt 3 ] && n=3\ncat items-$n.json\n")
+        _os.chmod("bin/kubectl", 0o755)
+
+        model = Model("skewer.yaml")
+
+        with working_env(PATH=f"{get_absolute_path('bin')}:{ENV['PATH']}"):
+            with model.get_site("west"):
+                await_resources(["deployment/frontend", "deployment/backend", "service/backend"], timeout=10)
+
+            calls = read("kubectl.log").splitlines()
+
+            assert len(calls) == 3, calls
+            expected = "--kubeconfig kc-west --namespace west get deployment,service -o json"
+            assert all(x == expected for x in calls), calls
+
+            remove("kubectl.log")
+            copy("items-3.json", "items-1.json")
+
+            # Short names and plurals resolve as they do in kubectl
+            with model.get_site("west"):
+                await_resources(["deploy/frontend", "deployments/backend", "svc/backend"], timeout=10)
+
+            calls = read("kubectl.log").splitlines()
+
+            assert calls == [expected], calls
+
+            remove("kubectl.log")
+
+            with model.get_site("west"):
+                with expect_error(contains="Timed out waiting for deployment/other"):
+                    await_resources(["deployment/frontend", "deployment/other"], timeout=0.5)
+
+@test
+def adaptive_timeouts():
+    def command_span(duration, site="west", failed=False):
+        return {"name": "sleep 1", "category": "command", "duration": duration, "failed": failed,
+                "args": {"site": site}}
+
+    with working_dir():
+        with history("history.json") as h:
+            assert get_timeout("sleep 1", "west", 300) == 300
+            assert get_timeout("sleep 1", "west") is None
+
+            h.add_spans([command_span(x) for x in (1, 2)])
+
+            assert get_timeout("sleep 1", "west", 300) == 300
+
+            h.add_spans([command_span(20), command_span(1000, failed=True), command_span(1000, site="east")])
+
+            assert get_timeout("sleep 1", "west", 300) == 60, get_timeout("sleep 1", "west", 300)
+            assert get_timeout("sleep 1", "west", 45) == 45
+            assert get_timeout("sleep 1", "west") == 60
+
+        assert read_json("history.json") == {"west: sleep 1": [1, 2, 20], "east: sleep 1": [1000]}
+
+        with history("history.json") as h:
+            h.add_spans([command_span(1) for i in range(30)])
+
+            assert len(h.durations["west: sleep 1"]) == 20
+            assert get_timeout("sleep 1", "west", 300) == 30
+
+        with history("history.json", adaptive=False):
+            assert get_timeout("sleep 1", "west", 300) == 300
+
+        # Spans from the tracing context go to the history
+        with history("history.json") as h, tracing(make_dir("work")):
+            with span("true", "command", site="west"):
+                pass
+
+        assert len(read_json("history.json")["west: true"]) == 1
+
+        # Minikube opens the outer tracing context before run_steps
+        # enters the history
+        with tracing(make_dir("work")):
+            with span("false", "command", site="west"):
+                pass
+
+            with history("history.json"), tracing(make_dir("work")):
+                with span("true", "command", site="west"):
+                    pass
+
+        assert len(read_json("history.json")["west: true"]) == 2
+        assert "west: false" not in read_json("history.json")
+
+        # Commands that share a first line have separate durations
+        with history("history.json") as h, tracing(make_dir("work")):
+            for command in ("echo start\nsleep 1", "echo start\nsleep 2"):
+                with span("echo start", "command", site="west", key=command):
+                    pass
+
+            assert get_timeout("echo start\nsleep 1", "west") is None
+
+        durations = read_json("history.json")
+
+        assert len(durations["west: echo start\nsleep 1"]) == 1
+        assert len(durations["west: echo start\nsleep 2"]) == 1
+        assert "west: echo start" not in durations
+
+        with expect_error(contains="timed out"):
+            run_step_command("sleep 10", "sleep 10", timeout=0.5)
+
+        assert run_step_command("true", "true", timeout=5) == 0
+
+    with working_env(SKEWER_CACHE_DIR="/cache"):
+        assert get_history_file("skewer.yaml").startswith("/cache/history/")
+
+@test
+def kube_client():
+    resources = {
+        "/api/v1/namespaces/west/services/frontend": {
+            "kind": "Service",
+            "status": {"loadBalancer": {"ingress": [{"ip": "10.0.0.1"}]}},
+        },
+        "/api/v1/namespaces/west/secrets/skupper-console-users": {
+            "kind": "Secret",
+            "data": {"admin": "c2VjcmV0"},
+        },
+    }
+
+    class Handler(_http.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            content = emit_json(resources.get(self.path, {"kind": "Status"})).encode("utf-8")
+
+            self.send_response(200 if self.path in resources else 404)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = _http.HTTPServer(("localhost", 0), Handler)
+    server_thread = _threading.Thread(target=server.serve_forever)
+    server_thread.start()
+
+    try:
+        client = KubeClient(url=f"http://localhost:{server.server_port}")
+
+        assert client.supports("service/frontend")
+        assert client.supports("service/frontend", ".status.loadBalancer.ingress")
+        assert not client.supports("route/frontend")
+        assert not client.supports("service/frontend", ".items[0]")
+
+        assert client.get_resource("service/frontend", "west") is not None
+        assert client.get_resource("service/backend", "west") is None
+
+        result = client.get_resource_json("service/frontend", "west", ".status.loadBalancer.ingress")
+        assert result == '[{"ip":"10.0.0.1"}]', result
+
+        result = client.get_resource_json("secret/skupper-console-users", "west", ".data.admin")
+        assert result == "c2VjcmV0", result
+
+        result = client.get_resource_json("service/frontend", "west", ".status.nope")
+        assert result == "", result
+
+        with expect_error():
+            client.get_resource_json("service/backend", "west")
+
+        client.stop()
+    finally:
+        server.shutdown()
+        server.server_close()
+        server_thread.join()
+
+@test
+def kube_client_exit():
+    with working_dir():
+        write_yaml("skewer.yaml", {
+            "title": "Kube client exit",
+            "sites": {"west": {"platform": "kubernetes", "namespace": "west", "env": {"KUBECONFIG": "kc-west"}}},
+            "steps": [],
+        })
+
+        write("bin/kubectl", "#!/bin/sh\necho $$ > proxy.pid\necho Starting to serve on 127.0.0.1:1\nexec sleep 60\n")
+        _os.chmod("bin/kubectl", 0o755)
+
+        write("script.py", "from skewer.main import Model, get_current_kube_client\n"
+                           "with Model('skewer.yaml').get_site('west'):\n"
+                           "    get_current_kube_client()[1].start()\n")
+
+        with working_env(PATH=f"{get_absolute_path('bin')}:{ENV['PATH']}", PYTHONPATH=_os.pathsep.join(_sys.path)):
+            run(f"{_sys.executable} script.py")
+
+        # The proxy is stopped and reaped at exit
+        assert not exists(f"/proc/{read('proxy.pid').strip()}")
+
+@test
+def benchmark_http_():
+    class Handler(_http.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            content = b"hello"
+
+            self.send_response(200 if self.path == "/api/hello" else 500)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = _http.ThreadingHTTPServer(("localhost", 0), Handler)
+    server_thread = _threading.Thread(target=server.serve_forever)
+    server_thread.start()
+
+    url = f"http://localhost:{server.server_port}/api/hello"
+
+    try:
+        result = benchmark_http(url, duration=0.5, concurrency=4)
+
+        assert result["requests"] > 0, result
+        assert result["errors"] == 0, result
+        assert result["requests_per_second"] > 0, result
+        assert result["latency_ms"]["p50"] <= result["latency_ms"]["p95"] <= result["latency_ms"]["p99"], result
+
+        with expect_error(contains="No successful requests"):
+            benchmark_http(f"http://localhost:{server.server_port}/other", duration=0.2, concurrency=2)
+
+        with working_dir():
+            write_yaml("skewer.yaml", {
+                "title": "Benchmark",
+                "sites": {"west": {"platform": "podman", "env": {"SKUPPER_PLATFORM": "podman"}}},
+                "steps": [{"title": "One", "commands": {"west": [
+                    {"benchmark_http": {"url": url, "duration": 0.2, "concurrency": 2}},
+                    {"benchmark_http": {"url": url, "duration": 0.2}},
+                ]}}],
+            })
+
+            model = Model("skewer.yaml")
+            model.check()
+
+            with expect_output(contains="Throughput:") as out:
+                with output_redirected(out, quiet=True):
+                    run_step(model, model.steps[0], get_current_dir())
+
+            results = read_json("benchmarks.json")
+
+            assert len(results) == 2, results
+            assert results[0]["site"] == "west", results
+            assert results[0]["step"] == 1, results
+            assert results[0]["concurrency"] == 2, results
+            assert results[1]["concurrency"] == 10, results
+
+            write_yaml("skewer.yaml", {
+                "title": "Benchmark",
+                "sites": {"west": {"platform": "podman", "env": {"SKUPPER_PLATFORM": "podman"}}},
+                "steps": [{"title": "One", "commands": {"west": [{"benchmark_http": {"duration": 1}}]}}],
+            })
+
+            with expect_error(contains="'url' field"):
+                Model("skewer.yaml").check()
+    finally:
+        server.shutdown()
+        server.server_close()
+        server_thread.join()
+
+@test
+def minikube_reuse():
+    with working_dir():
+        lock_file = get_absolute_path("test.lock")
+        lock = acquire_file_lock(lock_file)
+        acquired = _threading.Event()
+
+        def acquire():
+            release_file_lock(acquire_file_lock(lock_file))
+            acquired.set()
+
+        thread = _threading.Thread(target=acquire)
+        thread.start()
+
+        try:
+            assert not acquired.wait(0.5)
+        finally:
+            release_file_lock(lock)
+
+        thread.join()
+
+        assert acquired.is_set()
+
+        write("bin/minikube", f"#!/bin/sh\necho \"$@\" >> {get_absolute_path('minikube.log')}\n"
+                              "[ \"$1\" = tunnel ] && sleep 60\nexit 0\n")
+        _os.chmod("bin/minikube", 0o755)
+
+        mk = Minikube("skewer.yaml", profile="test", work_dir=make_dir("work"))
+        pid_file = join("work", "minikube-tunnel.pid")
+        pids = list()
+
+        def start_tunnel():
+            mk.start_detached_tunnel()
+            pids.append(int(read(pid_file)))
+
+        # The tunnels start detached, so wait for each to be logged
+        def await_tunnels(count):
+            skewer.main.await_condition(lambda: is_file("minikube.log") and len(read_lines("minikube.log")) == count,
+                                        5, lambda: f"Timed out waiting for {count} tunnels")
+
+        with working_env(PATH=f"{get_absolute_path('bin')}:{ENV['PATH']}"):
+            try:
+                start_tunnel()
+                await_tunnels(1)
+
+                assert is_tunnel_running(pids[0], "test")
+                assert not is_tunnel_running(pids[0], "other")
+
+                # A running tunnel is reused
+                start_tunnel()
+
+                assert pids[1] == pids[0], pids
+                assert read_lines("minikube.log") == ["tunnel -p test\n"], read_lines("minikube.log")
+
+                # A PID that now belongs to another process is not
+                with start("sleep 60") as proc:
+                    write(pid_file, str(proc.pid))
+                    start_tunnel()
+
+                await_tunnels(2)
+
+                assert pids[2] not in (pids[0], proc.pid), pids
+
+                # Nor is a PID for a process that has exited
+                write(pid_file, str(proc.pid))
+                start_tunnel()
+                await_tunnels(3)
+
+                assert pids[3] != proc.pid, pids
+
+                # Deleting a reused cluster stops its detached tunnel
+                mk.stop_detached_tunnel()
+
+                assert not exists(pid_file)
+                skewer.main.await_condition(lambda: not is_tunnel_running(pids[3], "test"), 5,
+                                            "Timed out waiting for the tunnel to stop")
+            finally:
+                for pid in set(pids):
+                    _os.killpg(pid, _signal.SIGTERM)
+
+@test
+def run_farm_():
+    with working_dir():
+        make_dir("example-1")
+        make_dir("example-2")
+
+        with expect_error(contains="2 of 2 examples failed"):
+            run_farm(["example-1", "example-2"], jobs=2, output_dir="output")
+
+        check_file("output/1-example-1.txt")
+        check_file("output/2-example-2.txt")
+
+    with working_dir():
+        running_dir = get_absolute_path(make_dir("running"))
+
+        write("bin/minikube", "#!/bin/sh\n"
+                              "[ \"$1\" = profile ] && echo '{\"valid\": []}'\n"
+                              "[ \"$1\" = tunnel ] && exec sleep 60\n"
+                              "[ \"$1\" = update-context ] && touch \"$KUBECONFIG\"\n"
+                              "exit 0\n")
+        write("bin/kubectl", "#!/bin/sh\n")
+        write("bin/skupper", "#!/bin/sh\n")
+
+        for name in "minikube", "kubectl", "skupper":
+            _os.chmod(join("bin", name), 0o755)
+
+        # Each example counts the examples running alongside it
+        for i in range(1, 5):
+            command = f"touch {running_dir}/{i} && ls {running_dir} | wc -l >> {get_absolute_path('counts')} && " \
+                      f"sleep 1 && rm {running_dir}/{i}"
+
+            if i == 3:
+                command = f"{command} && false"
+
+            write_yaml(f"example-{i}/skewer.yaml", {
+                "title": f"Example {i}",
+                "workflow": None,
+                "sites": {"west": {"platform": "kubernetes", "namespace": "west", "env": {"KUBECONFIG": "~/config"}}},
+                "steps": [{"title": "Count", "commands": {"west": [{"run": command}]}}],
+            })
+
+        with working_env(PATH=f"{get_absolute_path('bin')}:{ENV['PATH']}",
+                         XDG_RUNTIME_DIR=get_absolute_path(make_dir("runtime")),
+                         SKEWER_CACHE_DIR=get_absolute_path("cache")):
+            with expect_output(contains="Total: 4, failed: 1") as out:
+                with output_redirected(out, quiet=True):
+                    with expect_error(contains="1 of 4 examples failed"):
+                        run_farm([f"example-{i}" for i in range(1, 5)], jobs=2, output_dir="output")
+
+                summary = [x for x in read_lines(out) if x.rstrip().endswith(".txt)")]
+
+        counts = [int(x) for x in read_lines("counts")]
+
+        assert len(counts) == 4, counts
+        assert max(counts) == 2, counts
+
+        assert len(summary) == 4, summary
+        assert ["FAILED" in x for x in summary] == [False, False, True, False], summary
+        assert all(f"example-{i} " in x for i, x in enumerate(summary, 1)), summary
+
 @test
 def run_steps_():
     with working_dir("example"):
@@ -54,6 +972,24 @@ def run_steps_demo():
         with Minikube("skewer.yaml") as mk:
             run_steps("skewer.yaml", kubeconfigs=mk.kubeconfigs, work_dir=mk.work_dir, debug=True)
 
+@test
+def run_steps_resume():
+    with working_dir("example"):
+        try:
+            with Minikube("skewer.yaml", reuse=True) as mk:
+                run_steps("skewer.yaml", kubeconfigs=mk.kubeconfigs, work_dir=mk.work_dir, defer_cleanup=True)
+
+            checkpoint = read_json(join(mk.work_dir, "checkpoint.json"))
+            assert checkpoint["completed_steps"], checkpoint
+
+            with Minikube("skewer.yaml", reuse=True, reset=False) as mk:
+                run_steps("skewer.yaml", kubeconfigs=mk.kubeconfigs, work_dir=mk.work_dir, resume=True)
+                run_steps("skewer.yaml", kubeconfigs=mk.kubeconfigs, work_dir=mk.work_dir, cleanup_only=True)
+
+            assert not exists(join(mk.work_dir, "checkpoint.json"))
+        finally:
+            run("minikube delete -p skewer", check=False)
+
 @test
 def run_steps_debug():
     with working_dir("example"):